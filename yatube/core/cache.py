@@ -0,0 +1,301 @@
+import math
+import pickle
+import random
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache as default_cache
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.utils.module_loading import import_string
+
+from .middleware import count_cache_tier
+
+MISSING = object()
+
+# локальные уровни общие для всех потоков процесса, как у LocMemCache
+_local_tiers = {}
+_local_tiers_lock = threading.Lock()
+
+
+def lock_key(key):
+    return f'{key}:lock'
+
+
+def is_fresh(expires_at, delta, beta):
+    ''' Вероятностное раннее истечение (XFetch)
+
+    Чем дольше пересчёт delta и ближе срок expires_at, тем вероятнее
+    один из читателей обновит значение заранее, до общего промаха.
+    '''
+    if expires_at is None:
+        return True
+    return time.time() - delta * beta * math.log(1 - random.random()) < (
+        expires_at)
+
+
+def get_or_compute(key, compute, timeout, cache=None, beta=None,
+                   stale_timeout=None, lock_timeout=None):
+    ''' Значение из кеша, пересчитываемое одним процессом за раз
+
+    Пока владелец блокировки пересчитывает ключ, остальные получают
+    прежнее значение (stale-while-revalidate) ещё stale_timeout секунд
+    после срока, а если его нет, ждут результат до lock_timeout секунд.
+    '''
+    cache = cache or default_cache
+    beta = settings.STAMPEDE_BETA if beta is None else beta
+    if stale_timeout is None:
+        stale_timeout = settings.STAMPEDE_STALE_TIMEOUT
+    if lock_timeout is None:
+        lock_timeout = settings.STAMPEDE_LOCK_TIMEOUT
+
+    entry = cache.get(key)
+    if entry is not None and is_fresh(*entry[1:], beta):
+        return entry[0]
+    deadline = time.monotonic() + lock_timeout
+    while not cache.add(lock_key(key), True, lock_timeout):
+        if entry is not None:
+            return entry[0]
+        if time.monotonic() >= deadline:
+            # владелец блокировки не успел: считаем сами, без записи
+            return compute()
+        time.sleep(settings.STAMPEDE_POLL_INTERVAL)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry[0]
+    try:
+        started = time.time()
+        value = compute()
+        delta = time.time() - started
+        if timeout is None:
+            cache.set(key, (value, None, delta), None)
+        else:
+            cache.set(
+                key, (value, started + delta + timeout, delta),
+                timeout + stale_timeout)
+        return value
+    finally:
+        cache.delete(lock_key(key))
+
+
+class LocalTier:
+    ''' LRU процесса, ограниченный числом записей, байтами и сроком '''
+
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.counts = Counter()
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(key) + len(entry[0])
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return MISSING
+            data, expires_at = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                self.counts['expired'] += 1
+                return MISSING
+            self.entries.move_to_end(key)
+        return pickle.loads(data)
+
+    def set(self, key, value, timeout):
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        size = len(key) + len(data)
+        with self.lock:
+            self._remove(key)
+            if timeout <= 0 or size > self.max_bytes:
+                return
+            self.entries[key] = (data, time.monotonic() + timeout)
+            self.size += size
+            while (len(self.entries) > self.max_entries
+                   or self.size > self.max_bytes):
+                self._remove(next(iter(self.entries)))
+                self.counts['evicted'] += 1
+
+    def delete(self, key):
+        with self.lock:
+            self._remove(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def count(self, tier, hit, number=1):
+        self.counts[tier, hit] += number
+        # запросу важно, какой уровень ответил, а промах - только общий
+        if hit or tier == 'shared':
+            count_cache_tier(tier if hit else 'miss', number)
+
+    def stats(self):
+        stats = {}
+        for tier in ('local', 'shared'):
+            hits = self.counts[tier, True]
+            lookups = hits + self.counts[tier, False]
+            stats[tier] = {
+                'hits': hits,
+                'misses': lookups - hits,
+                'hit_rate': round(hits / lookups, 4) if lookups else None,
+            }
+        stats['local'].update(
+            entries=len(self.entries), bytes=self.size,
+            evicted=self.counts['evicted'], expired=self.counts['expired'])
+        return stats
+
+
+class TieredCache(BaseCache):
+    ''' Двухуровневый кеш: LRU процесса поверх общего бэкенда
+
+    Общий уровень OPTIONS['SHARED'] (например, FileBasedCache) видят все
+    процессы, локальный держит прочитанные значения не дольше
+    LOCAL_TIMEOUT секунд. Ключи под шаблон SHARED_ONLY (версии областей,
+    блокировки) читаются только из общего уровня, поэтому новая версия
+    сразу видна всем процессам, а фрагменты с прежней версией в ключе
+    больше не запрашиваются и вытесняются из LRU.
+    '''
+
+    def __init__(self, name, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        shared = options.get('SHARED', {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'})
+        self.shared = import_string(shared['BACKEND'])(
+            shared.get('LOCATION', ''), shared)
+        self.local_timeout = options.get('LOCAL_TIMEOUT', 5)
+        pattern = options.get('SHARED_ONLY')
+        self.shared_only = re.compile(pattern) if pattern else None
+        with _local_tiers_lock:
+            if name not in _local_tiers:
+                _local_tiers[name] = LocalTier(
+                    options.get('LOCAL_MAX_ENTRIES', 1000),
+                    options.get('LOCAL_MAX_BYTES', 16 * 1024 * 1024))
+            self.local = _local_tiers[name]
+
+    def local_key(self, key, version=None):
+        ''' Ключ локального уровня или None для ключей SHARED_ONLY '''
+        if self.shared_only and self.shared_only.search(key):
+            return None
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def get_local_timeout(self, timeout=DEFAULT_TIMEOUT):
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        if timeout is None:
+            return self.local_timeout
+        return min(timeout, self.local_timeout)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        if not self.shared.add(key, value, timeout, version):
+            return False
+        local_key = self.local_key(key, version)
+        if local_key:
+            self.local.set(local_key, value, self.get_local_timeout(timeout))
+        return True
+
+    def get(self, key, default=None, version=None):
+        local_key = self.local_key(key, version)
+        if local_key:
+            value = self.local.get(local_key)
+            self.local.count('local', value is not MISSING)
+            if value is not MISSING:
+                return value
+        value = self.shared.get(key, MISSING, version)
+        self.local.count('shared', value is not MISSING)
+        if value is MISSING:
+            return default
+        if local_key:
+            # срок записи в общем уровне неизвестен, держим не дольше
+            # LOCAL_TIMEOUT
+            self.local.set(local_key, value, self.local_timeout)
+        return value
+
+    def get_many(self, keys, version=None):
+        found, remote = {}, {}
+        for key in keys:
+            local_key = self.local_key(key, version)
+            value = self.local.get(local_key) if local_key else MISSING
+            if value is MISSING:
+                remote[key] = local_key
+            else:
+                found[key] = value
+        local_lookups = len(found) + sum(map(bool, remote.values()))
+        self.local.count('local', True, len(found))
+        self.local.count('local', False, local_lookups - len(found))
+        if remote:
+            values = self.shared.get_many(remote, version=version)
+            self.local.count('shared', True, len(values))
+            self.local.count('shared', False, len(remote) - len(values))
+            for key, value in values.items():
+                if remote[key]:
+                    self.local.set(remote[key], value, self.local_timeout)
+            found.update(values)
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.shared.set(key, value, timeout, version)
+        local_key = self.local_key(key, version)
+        if local_key:
+            self.local.set(local_key, value, self.get_local_timeout(timeout))
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.shared.set_many(data, timeout, version)
+        local_timeout = self.get_local_timeout(timeout)
+        for key, value in data.items():
+            local_key = self.local_key(key, version)
+            if local_key and key not in failed:
+                self.local.set(local_key, value, local_timeout)
+        return failed
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.shared.touch(key, timeout, version)
+
+    def delete(self, key, version=None):
+        local_key = self.local_key(key, version)
+        if local_key:
+            self.local.delete(local_key)
+        self.shared.delete(key, version)
+
+    def delete_many(self, keys, version=None):
+        keys = list(keys)
+        for key in keys:
+            local_key = self.local_key(key, version)
+            if local_key:
+                self.local.delete(local_key)
+        self.shared.delete_many(keys, version)
+
+    def has_key(self, key, version=None):
+        local_key = self.local_key(key, version)
+        if local_key and self.local.get(local_key) is not MISSING:
+            return True
+        return self.shared.has_key(key, version)
+
+    def incr(self, key, delta=1, version=None):
+        value = self.shared.incr(key, delta, version)
+        local_key = self.local_key(key, version)
+        if local_key:
+            self.local.delete(local_key)
+        return value
+
+    def clear(self):
+        self.local.clear()
+        self.shared.clear()
+
+    def close(self, **kwargs):
+        self.shared.close(**kwargs)
+
+    def stats(self):
+        ''' Попадания по уровням, накопленные процессом '''
+        return self.local.stats()
@@ -0,0 +1,38 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from core.routers import mark_synced, replicate
+
+
+class Command(BaseCommand):
+    help = 'Копирует основную базу SQLite в реплики READ_REPLICAS'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=float, default=0,
+            help='Повторять каждые N секунд, 0 - скопировать один раз')
+
+    def handle(self, *args, **options):
+        if not settings.READ_REPLICAS:
+            raise CommandError('Реплики не настроены: задайте YATUBE_REPLICAS')
+        databases = [connections[alias] for alias in (
+            DEFAULT_DB_ALIAS, *settings.READ_REPLICAS)]
+        if any(db.vendor != 'sqlite' for db in databases):
+            raise CommandError('Репликатор умеет копировать только SQLite')
+        source = databases[0].settings_dict['NAME']
+        while True:
+            started = time.monotonic()
+            for db in databases[1:]:
+                # всё записанное до начала копии попадёт в реплику
+                written_at = time.time_ns()
+                replicate(source, db.settings_dict['NAME'])
+                mark_synced(db.alias, written_at)
+            self.stdout.write(
+                f'Реплик обновлено: {len(databases) - 1} за '
+                f'{time.monotonic() - started:.2f} с')
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
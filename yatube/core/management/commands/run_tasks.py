@@ -0,0 +1,88 @@
+import multiprocessing
+import time
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                ThreadPoolExecutor, wait)
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.queue import claim, release_stale, run_claimed
+
+
+class Command(BaseCommand):
+    help = ('Выполняет фоновые задачи из очереди core.queue пулом '
+            'потоков или процессов')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=None,
+            help='Размер пула, по умолчанию TASK_WORKERS; 0 - без пула')
+        parser.add_argument(
+            '--processes', action='store_true',
+            help='Пул процессов вместо потоков, для задач на CPU')
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Выполнить готовые задачи и выйти')
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        if workers is None:
+            workers = settings.TASK_WORKERS
+        self.done = self.failed = 0
+        if not workers:
+            self.run_inline(options['once'])
+        else:
+            self.run_pool(self.get_executor(workers, options['processes']),
+                          workers, options['once'])
+        self.stdout.write(
+            f'Задач выполнено: {self.done}, с ошибкой: {self.failed}')
+
+    def get_executor(self, workers, processes):
+        if not processes:
+            return ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix='task')
+        # новые процессы не наследуют соединения с базой родителя
+        return ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=django.setup)
+
+    def count(self, ok):
+        if ok:
+            self.done += 1
+        else:
+            self.failed += 1
+
+    def run_inline(self, once):
+        while True:
+            release_stale()
+            claimed = claim(1)
+            for pk, token in claimed:
+                self.count(run_claimed(pk, token))
+            if not claimed:
+                if once:
+                    return
+                time.sleep(settings.TASK_POLL_INTERVAL)
+
+    def run_pool(self, executor, workers, once):
+        ''' В пуле не больше 2 * workers задач: остальные ждут в базе,
+        где их могут забрать другие воркеры '''
+        running = set()
+        with executor:
+            while True:
+                release_stale()
+                claimed = claim(2 * workers - len(running))
+                running.update(
+                    executor.submit(run_claimed, pk, token)
+                    for pk, token in claimed)
+                if not running:
+                    if once:
+                        return
+                    time.sleep(settings.TASK_POLL_INTERVAL)
+                    continue
+                finished, running = wait(
+                    running, timeout=settings.TASK_POLL_INTERVAL,
+                    return_when=FIRST_COMPLETED)
+                for future in finished:
+                    self.count(future.result())
@@ -0,0 +1,216 @@
+import heapq
+import json
+import logging
+import random
+from collections import Counter
+from contextlib import ExitStack
+from contextvars import ContextVar
+from functools import wraps
+from time import perf_counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.template.base import Template
+
+from .routers import finish_request, start_request
+
+logger = logging.getLogger('core.metrics')
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+_metrics = ContextVar('request_metrics', default=None)
+_instrumented = False
+
+
+class RequestMetrics:
+    ''' Счётчики одного запроса: SQL, шаблоны, кеш и общее время '''
+
+    def __init__(self, slowest=3):
+        self.started = perf_counter()
+        self.queries = 0
+        self.sql_time = 0.0
+        self.slowest = []
+        self.slowest_limit = slowest
+        self.template_time = 0.0
+        self.template_depth = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_tiers = Counter()
+
+    def add_query(self, sql, duration):
+        self.queries += 1
+        self.sql_time += duration
+        item = (duration, self.queries, sql)
+        if len(self.slowest) < self.slowest_limit:
+            heapq.heappush(self.slowest, item)
+        else:
+            heapq.heappushpop(self.slowest, item)
+
+    def as_dict(self, request, response):
+        match = request.resolver_match
+        return {
+            'view': match.view_name if match else None,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'wall_ms': round((perf_counter() - self.started) * 1000, 2),
+            'queries': self.queries,
+            'sql_ms': round(self.sql_time * 1000, 2),
+            'template_ms': round(self.template_time * 1000, 2),
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'cache_tiers': dict(self.cache_tiers),
+            'slowest': [
+                {'ms': round(duration * 1000, 2), 'sql': sql[:200]}
+                for duration, _, sql in sorted(self.slowest, reverse=True)
+            ],
+        }
+
+    def server_timing(self, data):
+        return ', '.join((
+            f'db;dur={data["sql_ms"]};desc="{data["queries"]} queries"',
+            f'tpl;dur={data["template_ms"]}',
+            f'cache;desc="hits={data["cache_hits"]} '
+            f'misses={data["cache_misses"]}'
+            + ''.join(f' {tier}={count}'
+                      for tier, count in data['cache_tiers'].items())
+            + '"',
+            f'total;dur={data["wall_ms"]}',
+        ))
+
+
+def query_timer(execute, sql, params, many, context):
+    metrics = _metrics.get()
+    started = perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        if metrics is not None:
+            metrics.add_query(sql, perf_counter() - started)
+
+
+def timed_render(render):
+    @wraps(render)
+    def wrapper(self, *args, **kwargs):
+        metrics = _metrics.get()
+        if metrics is None:
+            return render(self, *args, **kwargs)
+        # вложенные include учитываются во времени внешнего шаблона
+        metrics.template_depth += 1
+        started = perf_counter()
+        try:
+            return render(self, *args, **kwargs)
+        finally:
+            metrics.template_depth -= 1
+            if not metrics.template_depth:
+                metrics.template_time += perf_counter() - started
+    return wrapper
+
+
+def counted_get(get):
+    @wraps(get)
+    def wrapper(self, key, default=None, *args, **kwargs):
+        value = get(self, key, default, *args, **kwargs)
+        metrics = _metrics.get()
+        if metrics is not None:
+            if value is default:
+                metrics.cache_misses += 1
+            else:
+                metrics.cache_hits += 1
+        return value
+    return wrapper
+
+
+def counted_get_many(get_many):
+    @wraps(get_many)
+    def wrapper(self, keys, *args, **kwargs):
+        keys = list(keys)
+        values = get_many(self, keys, *args, **kwargs)
+        metrics = _metrics.get()
+        if metrics is not None:
+            metrics.cache_hits += len(values)
+            metrics.cache_misses += len(keys) - len(values)
+        return values
+    return wrapper
+
+
+def count_cache_tier(tier, count=1):
+    ''' Учитывает чтение уровня многоуровневого кеша в метриках запроса '''
+    metrics = _metrics.get()
+    if metrics is not None and count:
+        metrics.cache_tiers[tier] += count
+
+
+def instrument():
+    ''' Один раз оборачивает рендер шаблонов и чтение из кешей '''
+    global _instrumented
+    if _instrumented:
+        return
+    _instrumented = True
+    Template.render = timed_render(Template.render)
+    for backend in {type(caches[alias]) for alias in settings.CACHES}:
+        backend.get = counted_get(backend.get)
+        backend.get_many = counted_get_many(backend.get_many)
+
+
+class RequestMetricsMiddleware:
+    ''' Замеряет стоимость запроса для доли REQUEST_METRICS_SAMPLE_RATE.
+
+    Результат отдаётся в заголовке Server-Timing и строкой JSON
+    в логгер core.metrics.
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        instrument()
+
+    def __call__(self, request):
+        rate = settings.REQUEST_METRICS_SAMPLE_RATE
+        if not rate or random.random() >= rate:
+            return self.get_response(request)
+        metrics = RequestMetrics(settings.REQUEST_METRICS_SLOWEST)
+        token = _metrics.set(metrics)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(query_timer))
+                response = self.get_response(request)
+        finally:
+            _metrics.reset(token)
+        data = metrics.as_dict(request, response)
+        stats = getattr(caches['default'], 'stats', None)
+        if stats is not None:
+            data['cache_stats'] = stats()
+        response['Server-Timing'] = metrics.server_timing(data)
+        logger.info(json.dumps(data, ensure_ascii=False))
+        return response
+
+
+class PrimaryPinMiddleware:
+    ''' Закрепляет чтение за основной базой после записи пользователя
+
+    Небезопасные методы читают из default целиком, а после записи
+    cookie REPLICA_PIN_COOKIE держит на default и следующие запросы.
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.READ_REPLICAS:
+            return self.get_response(request)
+        token = start_request(
+            request.method not in SAFE_METHODS
+            or settings.REPLICA_PIN_COOKIE in request.COOKIES)
+        try:
+            response = self.get_response(request)
+        finally:
+            state = finish_request(token)
+        if state.wrote:
+            response.set_cookie(
+                settings.REPLICA_PIN_COOKIE, '1',
+                max_age=settings.REPLICA_PIN_SECONDS,
+                httponly=True, samesite='Lax')
+        return response
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 
 
 class CreatedModel(models.Model):
@@ -11,3 +12,58 @@ class CreatedModel(models.Model):
     class Meta:
         # Это абстрактная модель:
         abstract = True
+
+
+class Task(models.Model):
+    """Отложенный вызов фоновой задачи из core.queue."""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    FAILED = 'failed'
+    STATUSES = (
+        (QUEUED, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (FAILED, 'Не выполнена'),
+    )
+
+    name = models.CharField(
+        max_length=200,
+        verbose_name='Задача')
+    arguments = models.TextField(
+        verbose_name='Аргументы JSON')
+    status = models.CharField(
+        max_length=10,
+        choices=STATUSES,
+        default=QUEUED,
+        verbose_name='Состояние')
+    attempts = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Неудачных попыток')
+    run_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name='Выполнить после')
+    locked_by = models.CharField(
+        max_length=32,
+        blank=True,
+        verbose_name='Воркер')
+    locked_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Взята воркером')
+    error = models.TextField(
+        blank=True,
+        verbose_name='Последняя ошибка')
+    created = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Поставлена')
+
+    class Meta:
+        verbose_name_plural = 'Фоновые задачи'
+        verbose_name = 'Фоновая задача'
+        indexes = [
+            models.Index(
+                fields=['status', 'run_at'],
+                name='task_due_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.name} ({self.status})'
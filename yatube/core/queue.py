@@ -0,0 +1,201 @@
+''' Очередь фоновых задач в базе
+
+Задача - функция с декоратором @task. Вызов task.delay(...) после
+фиксации текущей транзакции записывает строку Task, а воркер
+(manage.py run_tasks) забирает готовые строки, выполняет их в пуле
+потоков или процессов и повторяет упавшие с растущей паузой. Удачно
+выполненные строки удаляются, исчерпавшие повторы остаются в статусе
+failed с текстом ошибки.
+
+При TASKS_EAGER задача выполняется тем же процессом сразу после
+фиксации - так работают тесты и окружение без воркера.
+'''
+import json
+import logging
+import random
+import traceback
+import uuid
+from datetime import timedelta
+from importlib import import_module
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+# имя задачи -> BackgroundTask; воркер выполняет только задачи отсюда
+REGISTRY = {}
+
+
+class BackgroundTask:
+    ''' Функция, которую можно выполнить сейчас или поставить в очередь '''
+
+    def __init__(self, function, retries=None):
+        self.function = function
+        self.name = f'{function.__module__}.{function.__name__}'
+        self.retries = retries
+        self.__doc__ = function.__doc__
+
+    def __call__(self, *args, **kwargs):
+        return self.function(*args, **kwargs)
+
+    def __repr__(self):
+        return f'<BackgroundTask {self.name}>'
+
+    @property
+    def max_retries(self):
+        if self.retries is None:
+            return settings.TASK_RETRIES
+        return self.retries
+
+    def delay(self, *args, **kwargs):
+        ''' Ставит вызов в очередь после фиксации текущей транзакции '''
+        self.apply_async(args, kwargs)
+
+    def apply_async(self, args=(), kwargs=None, countdown=0):
+        ''' Как delay, но воркер возьмёт задачу не раньше countdown секунд
+
+        Аргументы сериализуются в JSON сразу, поэтому ошибка в них видна
+        в месте вызова, а не у воркера. При TASKS_EAGER пауза не
+        выдерживается.
+        '''
+        arguments = json.dumps(
+            [list(args), kwargs or {}], ensure_ascii=False)
+        if settings.TASKS_EAGER:
+            transaction.on_commit(lambda: run_eager(self, arguments))
+        else:
+            transaction.on_commit(lambda: Task.objects.create(
+                name=self.name, arguments=arguments,
+                run_at=timezone.now() + timedelta(seconds=countdown)))
+
+
+def task(function=None, retries=None):
+    ''' Регистрирует функцию как фоновую задачу: @task или @task(retries=N)
+
+    retries - число повторов после первой неудачи, по умолчанию
+    TASK_RETRIES.
+    '''
+    def decorator(function):
+        background = BackgroundTask(function, retries)
+        REGISTRY[background.name] = background
+        return background
+
+    if function is not None:
+        return decorator(function)
+    return decorator
+
+
+def get_task(name):
+    ''' Задача по имени; модуль задачи импортируется при первом вызове '''
+    if name not in REGISTRY:
+        try:
+            import_module(name.rpartition('.')[0])
+        except ImportError:
+            pass
+    return REGISTRY.get(name)
+
+
+def call(background, arguments):
+    args, kwargs = json.loads(arguments)
+    return background(*args, **kwargs)
+
+
+def run_eager(background, arguments):
+    try:
+        call(background, arguments)
+    except Exception:
+        logger.exception('Задача %s не выполнена', background.name)
+
+
+def retry_delay(attempts):
+    ''' Пауза перед повтором: удваивается с каждой попыткой, до предела
+
+    Случайная добавка до четверти паузы разводит повторы задач,
+    упавших одновременно.
+    '''
+    delay = min(settings.TASK_RETRY_DELAY * 2 ** (attempts - 1),
+                settings.TASK_RETRY_MAX_DELAY)
+    return timedelta(seconds=delay * random.uniform(1, 1.25))
+
+
+def claim(limit):
+    ''' Забирает до limit готовых задач: пары (id, метка воркера)
+
+    Строки помечаются меткой одним UPDATE с условием на статус, так что
+    параллельные воркеры не получат одну задачу дважды.
+    '''
+    now = timezone.now()
+    due = Task.objects.filter(
+        status=Task.QUEUED, run_at__lte=now).order_by('run_at', 'pk')
+    ids = list(due.values_list('pk', flat=True)[:limit])
+    if not ids:
+        return []
+    token = uuid.uuid4().hex
+    Task.objects.filter(pk__in=ids, status=Task.QUEUED).update(
+        status=Task.RUNNING, locked_by=token, locked_at=now)
+    return [(pk, token) for pk in Task.objects.filter(
+        locked_by=token).values_list('pk', flat=True)]
+
+
+def release_stale():
+    ''' Возвращает в очередь задачи воркеров, которые не дожили до конца
+
+    Такой запуск считается неудачной попыткой: задача уходит на повтор
+    с паузой или, исчерпав повторы, остаётся в статусе failed.
+    '''
+    expired = timezone.now() - timedelta(seconds=settings.TASK_LOCK_TIMEOUT)
+    stale = Task.objects.filter(status=Task.RUNNING, locked_at__lt=expired)
+    return sum(
+        fail(task_row, get_task(task_row.name),
+             f'Воркер не завершил задачу за {settings.TASK_LOCK_TIMEOUT} с')
+        for task_row in stale)
+
+
+def fail(task_row, background, error):
+    ''' Неудачная попытка; строку меняет только владелец метки
+
+    Возвращает 0, если задачу уже вернули в очередь как зависшую.
+    '''
+    attempts = task_row.attempts + 1
+    changes = {'attempts': attempts, 'error': error,
+               'locked_by': '', 'locked_at': None}
+    if background is None or attempts > background.max_retries:
+        changes['status'] = Task.FAILED
+    else:
+        changes['status'] = Task.QUEUED
+        changes['run_at'] = timezone.now() + retry_delay(attempts)
+    return Task.objects.filter(
+        pk=task_row.pk, status=Task.RUNNING, locked_by=task_row.locked_by,
+    ).update(**changes)
+
+
+def run_claimed(pk, token):
+    ''' Выполняет взятую задачу; True - успешно, False - упала или не найдена
+
+    Задачу, которую за время работы вернули в очередь как зависшую и,
+    возможно, взял другой воркер, этот запуск не удаляет и не помечает.
+    Вызывается в потоке или процессе пула воркера, поэтому сама
+    закрывает соединения с базой, ставшие ненужными.
+    '''
+    try:
+        task_row = Task.objects.filter(
+            pk=pk, status=Task.RUNNING, locked_by=token).first()
+        if task_row is None:
+            return False
+        background = get_task(task_row.name)
+        if background is None:
+            fail(task_row, None, f'Задача {task_row.name} не найдена')
+            return False
+        try:
+            call(background, task_row.arguments)
+        except Exception:
+            logger.exception('Задача %s не выполнена', task_row.name)
+            fail(task_row, background, traceback.format_exc())
+            return False
+        Task.objects.filter(pk=pk, locked_by=token).delete()
+        return True
+    finally:
+        close_old_connections()
@@ -0,0 +1,103 @@
+import random
+import sqlite3
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+_state = ContextVar('replica_state', default=None)
+
+
+class ReplicaState:
+    ''' Куда читает текущий запрос и писал ли он в основную базу '''
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.wrote = False
+        # реплики, из которых можно читать; None - любые
+        self.replicas = None
+
+
+def start_request(pinned):
+    return _state.set(ReplicaState(pinned))
+
+
+def finish_request(token):
+    state = _state.get()
+    _state.reset(token)
+    return state
+
+
+def synced_key(alias):
+    return f'replica_synced:{alias}'
+
+
+def mark_synced(alias, written_at):
+    ''' В реплике alias есть все записи основной базы до written_at '''
+    cache.set(synced_key(alias), written_at, timeout=None)
+
+
+def require_synced(written_at):
+    ''' Запрос читает только из реплик, получивших записи до written_at
+
+    written_at - время последнего изменения страницы в наносекундах,
+    как у версий кеша лент. Если такой реплики нет, запрос читает из
+    default: страница, собранная из отставшей реплики, попала бы в кеш
+    фрагментов и в ETag под новой версией.
+    '''
+    state = _state.get()
+    replicas = settings.READ_REPLICAS
+    if not replicas or state is None or state.pinned:
+        return
+    synced = cache.get_many([synced_key(alias) for alias in replicas])
+    state.replicas = [
+        alias for alias in replicas
+        if synced.get(synced_key(alias), 0) >= written_at
+    ]
+    if not state.replicas:
+        state.pinned = True
+
+
+class ReplicaRouter:
+    ''' Чтение из реплик внутри запросов, запись и всё прочее - в default
+
+    После первой записи запрос до конца читает из default, а
+    PrimaryPinMiddleware продлевает это на REPLICA_PIN_SECONDS, чтобы
+    пользователь сразу видел свои изменения, пока реплики догоняют.
+    Страницы с версиями кеша читают только из догнавших реплик, см.
+    require_synced.
+    '''
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        replicas = settings.READ_REPLICAS
+        if (not replicas or state is None or state.pinned
+                or connections[DEFAULT_DB_ALIAS].in_atomic_block):
+            return DEFAULT_DB_ALIAS
+        return random.choice(
+            replicas if state.replicas is None else state.replicas)
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.pinned = state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # схему в реплики переносит репликатор вместе с данными
+        return db not in settings.READ_REPLICAS
+
+
+def replicate(source, target):
+    ''' Копирует базу SQLite source в target через backup API '''
+    source = sqlite3.connect(source)
+    target = sqlite3.connect(target)
+    try:
+        source.backup(target)
+    finally:
+        source.close()
+        target.close()
@@ -0,0 +1,43 @@
+import time
+
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+@receiver(connection_created)
+def sqlite_tuned(sender, connection, **kwargs):
+    ''' PRAGMA из SQLITE_PRAGMAS; реплики открываются только для чтения '''
+    connection.health_checked_at = time.monotonic()
+    if connection.vendor != 'sqlite':
+        return
+    replica = connection.alias in settings.READ_REPLICAS
+    with connection.cursor() as cursor:
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            # режим журнала реплики задаёт репликатор
+            if not (replica and name == 'journal_mode'):
+                cursor.execute(f'PRAGMA {name} = {value}')
+        if replica:
+            cursor.execute('PRAGMA query_only = ON')
+
+
+@receiver(request_started)
+def connections_checked(sender, **kwargs):
+    ''' Закрывает постоянные соединения, переставшие отвечать '''
+    now = time.monotonic()
+    for connection in connections.all():
+        if connection.connection is None or connection.in_atomic_block:
+            continue
+        checked_at = getattr(connection, 'health_checked_at', now)
+        if now - checked_at < settings.CONN_HEALTH_CHECK_INTERVAL:
+            continue
+        connection.health_checked_at = now
+        try:
+            # курсор драйвера: проверка не попадает в учёт запросов Django
+            cursor = connection.connection.cursor()
+            cursor.execute('SELECT 1')
+            cursor.close()
+        except connection.Database.Error:
+            connection.close()
@@ -0,0 +1,49 @@
+from django import template
+from django.core.cache import InvalidCacheBackendError, caches
+from django.core.cache.utils import make_template_fragment_key
+from django.templatetags.cache import CacheNode, do_cache
+
+from core.cache import get_or_compute
+
+register = template.Library()
+
+
+class StampedeCacheNode(CacheNode):
+    ''' {% cache %}, пересчитывающий фрагмент через get_or_compute '''
+
+    def get_cache(self, context):
+        if self.cache_name:
+            try:
+                return caches[self.cache_name.resolve(context)]
+            except (template.VariableDoesNotExist,
+                    InvalidCacheBackendError):
+                raise template.TemplateSyntaxError(
+                    f'Invalid cache name for cache tag: {self.cache_name}')
+        try:
+            return caches['template_fragments']
+        except InvalidCacheBackendError:
+            return caches['default']
+
+    def render(self, context):
+        try:
+            expire_time = self.expire_time_var.resolve(context)
+            if expire_time is not None:
+                expire_time = int(expire_time)
+        except (template.VariableDoesNotExist, ValueError, TypeError):
+            raise template.TemplateSyntaxError(
+                f'"cache" tag got a bad timeout: {self.expire_time_var}')
+        vary_on = [var.resolve(context) for var in self.vary_on]
+        return get_or_compute(
+            make_template_fragment_key(self.fragment_name, vary_on),
+            lambda: self.nodelist.render(context),
+            expire_time,
+            cache=self.get_cache(context),
+        )
+
+
+@register.tag('cache')
+def do_stampede_cache(parser, token):
+    node = do_cache(parser, token)
+    return StampedeCacheNode(
+        node.nodelist, node.expire_time_var, node.fragment_name,
+        node.vary_on, node.cache_name)
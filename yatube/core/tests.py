@@ -1,6 +1,42 @@
+import json
+import os
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 from http import HTTPStatus
+from io import StringIO
 
-from django.test import Client, TestCase
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.http import HttpResponse
+from django.template import Context, Template
+from django.test import (Client, RequestFactory, SimpleTestCase, TestCase,
+                         TransactionTestCase, override_settings)
+from django.urls import resolve, reverse
+from django.utils import timezone
+
+from .cache import TieredCache, get_or_compute, lock_key
+from .middleware import PrimaryPinMiddleware
+from .models import Task
+from .queue import claim, release_stale, run_claimed, task
+from .routers import (ReplicaRouter, mark_synced, replicate,
+                      require_synced)
+
+CALLS = []
+
+
+@task
+def remember(value):
+    CALLS.append(value)
+
+
+@task(retries=1)
+def broken():
+    raise ValueError('сломано')
 
 
 class ViewTestClass(TestCase):
@@ -12,3 +48,331 @@ class ViewTestClass(TestCase):
         response = self.client.get('/nonexist-page/')
         self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
         self.assertTemplateUsed(response, template)
+
+
+@override_settings(REQUEST_METRICS_SAMPLE_RATE=1)
+class RequestMetricsTest(TestCase):
+    def test_metrics_are_reported(self):
+        url = reverse('posts:index')
+        cache.clear()
+        with self.assertLogs('core.metrics', 'INFO') as logs:
+            response = self.client.get(url)
+        timing = response['Server-Timing']
+        for metric in ('db;dur=', 'tpl;dur=', 'cache;desc=', 'total;dur='):
+            self.assertIn(metric, timing)
+        data = json.loads(logs.records[0].getMessage())
+        self.assertEqual(data['view'], resolve(url).view_name)
+        self.assertEqual(data['status'], HTTPStatus.OK)
+        self.assertGreaterEqual(data['queries'], 1)
+        self.assertEqual(len(data['slowest']), min(data['queries'], 3))
+        self.assertGreater(data['template_ms'], 0)
+        self.assertGreaterEqual(data['cache_hits'] + data['cache_misses'], 1)
+        self.assertEqual(
+            sum(data['cache_tiers'].values()),
+            data['cache_hits'] + data['cache_misses'])
+        self.assertIn('local', data['cache_stats'])
+
+    @override_settings(REQUEST_METRICS_SAMPLE_RATE=0)
+    def test_unsampled_request_is_untouched(self):
+        response = self.client.get(reverse('posts:index'))
+        self.assertNotIn('Server-Timing', response)
+
+
+@override_settings(READ_REPLICAS=['replica'])
+class ReplicaRouterTest(SimpleTestCase):
+    def setUp(self):
+        self.router = ReplicaRouter()
+        self.factory = RequestFactory()
+
+    def request(self, method='get', cookies=None, write=False,
+                written_at=None):
+        reads = []
+
+        def view(request):
+            if written_at is not None:
+                require_synced(written_at)
+            if write:
+                self.router.db_for_write(None)
+            reads.append(self.router.db_for_read(None))
+            return HttpResponse()
+
+        request = getattr(self.factory, method)('/')
+        request.COOKIES.update(cookies or {})
+        response = PrimaryPinMiddleware(view)(request)
+        return reads[0], response
+
+    def test_reads_outside_requests_use_primary(self):
+        self.assertEqual(self.router.db_for_read(None), 'default')
+        self.assertEqual(self.router.db_for_write(None), 'default')
+
+    def test_safe_request_reads_replica(self):
+        db, response = self.request()
+        self.assertEqual(db, 'replica')
+        self.assertNotIn(settings.REPLICA_PIN_COOKIE, response.cookies)
+
+    def test_write_pins_request_and_sets_cookie(self):
+        db, response = self.request(write=True)
+        self.assertEqual(db, 'default')
+        cookie = response.cookies[settings.REPLICA_PIN_COOKIE]
+        self.assertEqual(cookie['max-age'], settings.REPLICA_PIN_SECONDS)
+
+    def test_pinned_requests_read_primary(self):
+        db, _ = self.request(
+            cookies={settings.REPLICA_PIN_COOKIE: '1'})
+        self.assertEqual(db, 'default')
+        db, _ = self.request(method='post')
+        self.assertEqual(db, 'default')
+
+    def test_versioned_page_reads_synced_replica(self):
+        """Страница с версиями кеша не читает отставшую реплику"""
+        cache.delete('replica_synced:replica')
+        written_at = time.time_ns()
+        db, response = self.request(written_at=written_at)
+        self.assertEqual(db, 'default')
+        self.assertNotIn(settings.REPLICA_PIN_COOKIE, response.cookies)
+        mark_synced('replica', written_at)
+        db, _ = self.request(written_at=written_at)
+        self.assertEqual(db, 'replica')
+        cache.delete('replica_synced:replica')
+
+    def test_replicas_are_not_migrated(self):
+        self.assertFalse(self.router.allow_migrate('replica', 'posts'))
+        self.assertTrue(self.router.allow_migrate('default', 'posts'))
+
+
+class ReplicateTest(SimpleTestCase):
+    def test_replicate_copies_sqlite_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, 'primary.sqlite3')
+            target = os.path.join(directory, 'replica.sqlite3')
+            with sqlite3.connect(source) as db:
+                db.execute('CREATE TABLE post (text TEXT)')
+                db.execute("INSERT INTO post VALUES ('first')")
+            replicate(source, target)
+            with sqlite3.connect(source) as db:
+                db.execute("INSERT INTO post VALUES ('second')")
+            with sqlite3.connect(target) as db:
+                self.assertEqual(
+                    db.execute('SELECT count(*) FROM post').fetchone(), (1,))
+            replicate(source, target)
+            with sqlite3.connect(target) as db:
+                self.assertEqual(
+                    db.execute('SELECT count(*) FROM post').fetchone(), (2,))
+
+    @override_settings(READ_REPLICAS=[])
+    def test_command_requires_replicas(self):
+        with self.assertRaises(CommandError):
+            call_command('replicate')
+
+
+class SqliteTuningTest(TestCase):
+    def pragma(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_connection_pragmas(self):
+        """Соединение SQLite открывается с PRAGMA из настроек"""
+        self.assertEqual(self.pragma('synchronous'), 1)
+        self.assertEqual(self.pragma('temp_store'), 2)
+        self.assertEqual(self.pragma('busy_timeout'), 5000)
+        self.assertEqual(
+            self.pragma('cache_size'), settings.SQLITE_PRAGMAS['cache_size'])
+
+
+class StampedeCacheTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+
+    def compute(self, value='fresh', delay=0):
+        def compute():
+            self.calls += 1
+            time.sleep(delay)
+            return value
+        return compute
+
+    def test_value_is_cached(self):
+        for _ in range(3):
+            self.assertEqual(
+                get_or_compute('key', self.compute(), 60), 'fresh')
+        self.assertEqual(self.calls, 1)
+
+    def test_stale_value_served_while_locked(self):
+        cache.set('key', ('stale', time.time() - 1, 0), 60)
+        cache.add(lock_key('key'), True, 10)
+        self.assertEqual(get_or_compute('key', self.compute(), 60), 'stale')
+        self.assertEqual(self.calls, 0)
+        cache.delete(lock_key('key'))
+        self.assertEqual(get_or_compute('key', self.compute(), 60), 'fresh')
+
+    def test_concurrent_miss_computed_once(self):
+        compute = self.compute(delay=0.1)
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            values = list(pool.map(
+                lambda _: get_or_compute('key', compute, 60), range(8)))
+        self.assertEqual(values, ['fresh'] * 8)
+        self.assertEqual(self.calls, 1)
+
+    def test_early_expiration(self):
+        cache.set('key', ('old', time.time() + 60, 1), 120)
+        self.assertEqual(
+            get_or_compute('key', self.compute(), 60, beta=0), 'old')
+        self.assertEqual(
+            get_or_compute('key', self.compute(), 60, beta=1e6), 'fresh')
+
+    def test_cache_tag(self):
+        template = Template(
+            '{% load stampede %}{% cache 60 fragment key %}{{ value }}'
+            '{% endcache %}')
+        self.assertEqual(
+            template.render(Context({'key': 1, 'value': 'a'})), 'a')
+        self.assertEqual(
+            template.render(Context({'key': 1, 'value': 'b'})), 'a')
+        self.assertEqual(
+            template.render(Context({'key': 2, 'value': 'b'})), 'b')
+
+
+class TieredCacheTest(SimpleTestCase):
+    def tiered(self, name, **options):
+        options = {
+            'SHARED': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': 'tiered-test',
+            },
+            'SHARED_ONLY': r'^version:',
+            **options,
+        }
+        tiered = TieredCache(f'{self.id()}:{name}', {'OPTIONS': options})
+        tiered.clear()
+        return tiered
+
+    def test_local_tier_serves_repeat_reads(self):
+        tiered = self.tiered('process')
+        tiered.set('key', 'value')
+        tiered.shared.delete('key')
+        self.assertEqual(tiered.get('key'), 'value')
+        self.assertEqual(tiered.get_many(['key', 'other']), {'key': 'value'})
+        stats = tiered.stats()
+        self.assertEqual(stats['local']['hits'], 2)
+        self.assertEqual(stats['shared']['misses'], 1)
+
+    def test_lru_evicts_by_entries_and_bytes(self):
+        tiered = self.tiered(
+            'process', LOCAL_MAX_ENTRIES=2, LOCAL_MAX_BYTES=1000)
+        tiered.set('a', 1)
+        tiered.set('b', 2)
+        tiered.get('a')
+        tiered.set('c', 3)
+        tiered.set('big', 'x' * 2000)
+        self.assertEqual(
+            set(tiered.local.entries), {tiered.make_key('a'),
+                                        tiered.make_key('c')})
+        self.assertEqual(tiered.local.stats()['local']['evicted'], 1)
+        self.assertEqual(tiered.get_many(['b', 'big']),
+                         {'b': 2, 'big': 'x' * 2000})
+
+    def test_local_entries_expire(self):
+        tiered = self.tiered('process', LOCAL_TIMEOUT=0.05)
+        tiered.set('key', 'old')
+        tiered.shared.set('key', 'new')
+        self.assertEqual(tiered.get('key'), 'old')
+        time.sleep(0.1)
+        self.assertEqual(tiered.get('key'), 'new')
+
+    def test_versions_are_shared_between_processes(self):
+        first, second = self.tiered('first'), self.tiered('second')
+        first.set('version:feed', 1)
+        self.assertEqual(second.get('version:feed'), 1)
+        first.set('version:feed', 2)
+        self.assertEqual(second.get('version:feed'), 2)
+        self.assertEqual(second.stats()['local']['hits'], 0)
+        first.set('fragment:2', 'page')
+        self.assertEqual(second.get('fragment:2'), 'page')
+        first.delete('fragment:2')
+        self.assertIsNone(first.get('fragment:2'))
+
+
+class TaskQueueTest(TransactionTestCase):
+    def setUp(self):
+        CALLS.clear()
+
+    def run_tasks(self, workers=0):
+        out = StringIO()
+        call_command('run_tasks', workers=workers, once=True, stdout=out)
+        return out.getvalue()
+
+    def test_enqueued_after_commit(self):
+        with transaction.atomic():
+            remember.delay(1)
+            self.assertFalse(Task.objects.exists())
+        with self.assertRaises(ZeroDivisionError), transaction.atomic():
+            remember.delay(2)
+            1 / 0
+        self.assertEqual(Task.objects.count(), 1)
+        self.assertIn('Задач выполнено: 1', self.run_tasks())
+        self.assertEqual(CALLS, [1])
+        self.assertFalse(Task.objects.exists())
+
+    @override_settings(TASK_RETRY_DELAY=10)
+    def test_retries_with_backoff(self):
+        broken.delay()
+        with self.assertLogs('core.queue', 'ERROR'):
+            self.run_tasks()
+        row = Task.objects.get()
+        self.assertEqual((row.status, row.attempts), (Task.QUEUED, 1))
+        self.assertGreaterEqual(
+            row.run_at - timezone.now(), timedelta(seconds=9))
+        self.assertIn('Задач выполнено: 0', self.run_tasks())
+
+        Task.objects.update(run_at=timezone.now())
+        with self.assertLogs('core.queue', 'ERROR'):
+            self.run_tasks()
+        row = Task.objects.get()
+        self.assertEqual((row.status, row.attempts), (Task.FAILED, 2))
+        self.assertIn('сломано', row.error)
+
+    def test_unknown_task_fails(self):
+        Task.objects.create(name='os.system', arguments='[["true"], {}]')
+        self.run_tasks()
+        self.assertEqual(Task.objects.get().status, Task.FAILED)
+
+    @override_settings(TASK_RETRY_DELAY=0)
+    def test_stale_tasks_requeued(self):
+        for value in range(5):
+            remember.delay(value)
+        Task.objects.filter(arguments='[[0], {}]').update(
+            status=Task.RUNNING, locked_by='dead',
+            locked_at=timezone.now() - timedelta(days=1))
+        self.assertIn('Задач выполнено: 5', self.run_tasks(workers=2))
+        self.assertCountEqual(CALLS, range(5))
+        self.assertFalse(Task.objects.exists())
+
+    def test_stale_task_exhausts_retries(self):
+        broken.delay()
+        Task.objects.update(
+            status=Task.RUNNING, locked_by='dead', attempts=1,
+            locked_at=timezone.now() - timedelta(days=1))
+        self.assertEqual(release_stale(), 1)
+        row = Task.objects.get()
+        self.assertEqual((row.status, row.attempts), (Task.FAILED, 2))
+
+    @override_settings(TASK_RETRY_DELAY=0)
+    def test_released_run_keeps_new_claim(self):
+        remember.delay(1)
+        [(pk, token)] = claim(1)
+        Task.objects.update(locked_at=timezone.now() - timedelta(days=1))
+        release_stale()
+        [(_, new_token)] = claim(1)
+        self.assertFalse(run_claimed(pk, token))
+        self.assertEqual(Task.objects.get().locked_by, new_token)
+        self.assertTrue(run_claimed(pk, new_token))
+        self.assertFalse(Task.objects.exists())
+
+    @override_settings(TASKS_EAGER=True)
+    def test_eager_runs_in_process(self):
+        with transaction.atomic():
+            remember.delay(3)
+            self.assertEqual(CALLS, [])
+        self.assertEqual(CALLS, [3])
+        self.assertFalse(Task.objects.exists())
@@ -0,0 +1,233 @@
+''' JSON API лент, постов и комментариев для мобильных клиентов
+
+Ответы собираются из словарей без шаблонов. Параметр fields выбирает
+поля поста и сужает выборку через only(), ленты листаются курсорами
+after и before, как страницы сайта.
+'''
+from functools import wraps
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.http import Http404, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.views.decorators.http import require_GET
+
+from .cache import conditional_page
+from .models import Group, Post, User
+from .renditions import rendition_set
+from .timeline import TimelinePaginator
+from .utils import CursorPaginator, get_comments_page
+from .views import group_scopes, post_scopes, profile_scopes
+
+# поле ответа -> поля модели для only() и связи для select_related
+POST_FIELDS = {
+    'id': ((), ()),
+    'text': (('text',), ()),
+    'pub_date': (('pub_date',), ()),
+    'author': (('author', 'author__username', 'author__first_name',
+                'author__last_name'), ('author',)),
+    'group': (('group', 'group__slug', 'group__title'), ('group',)),
+    'image': (('image',), ()),
+    'comments_count': (('comments_count',), ()),
+}
+
+
+class ApiError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def json_response(data, status=200):
+    return JsonResponse(
+        data, status=status, json_dumps_params={'ensure_ascii': False})
+
+
+def api_view(view):
+    ''' Только GET, ошибки и 404 отдаются JSON, а не страницей сайта '''
+    @require_GET
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            return view(request, *args, **kwargs)
+        except ApiError as error:
+            return json_response({'error': error.message}, error.status)
+        except Http404:
+            return json_response({'error': 'Не найдено.'}, 404)
+    return wrapper
+
+
+def get_fields(request):
+    ''' Поля поста из ?fields=, по умолчанию все '''
+    value = request.GET.get('fields')
+    if not value:
+        return list(POST_FIELDS)
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in POST_FIELDS]
+    if unknown:
+        raise ApiError(f'Неизвестные поля: {", ".join(unknown)}. '
+                       f'Доступны: {", ".join(POST_FIELDS)}.')
+    return fields
+
+
+def get_limit(request, default, maximum):
+    try:
+        limit = int(request.GET.get('limit', default))
+    except ValueError:
+        raise ApiError('limit должен быть целым числом.')
+    return max(1, min(limit, maximum))
+
+
+def project(post_list, fields):
+    ''' Выборка только нужных полям колонок
+
+    pub_date загружается всегда: по нему строятся курсоры.
+    '''
+    only, related = {'pub_date'}, set()
+    for field in fields:
+        columns, relations = POST_FIELDS[field]
+        only.update(columns)
+        related.update(relations)
+    if related:
+        post_list = post_list.select_related(*sorted(related))
+    return post_list.only(*only)
+
+
+def serialize_user(user):
+    return {'username': user.username, 'name': user.get_full_name()}
+
+
+def serialize_image(image):
+    if not image:
+        return None
+    return {
+        'url': image.url,
+        'renditions': [
+            {'width': width, 'format': extension,
+             'url': default_storage.url(name)}
+            for width, extension, name in rendition_set(image.name)
+        ],
+    }
+
+
+def serialize_post(post, fields):
+    data = {}
+    for field in fields:
+        if field == 'id':
+            data['id'] = post.pk
+        elif field == 'pub_date':
+            data['pub_date'] = post.pub_date.isoformat()
+        elif field == 'author':
+            data['author'] = serialize_user(post.author)
+        elif field == 'group':
+            data['group'] = post.group and {
+                'slug': post.group.slug, 'title': post.group.title}
+        elif field == 'image':
+            data['image'] = serialize_image(post.image)
+        else:
+            data[field] = getattr(post, field)
+    return data
+
+
+def serialize_comment(comment):
+    return {
+        'id': comment.pk,
+        'author': comment.author.username,
+        'author_name': comment.author.get_full_name(),
+        'text': comment.text,
+        'created': comment.created.isoformat(),
+    }
+
+
+def page_response(paginator, request, fields):
+    page = paginator.get_page(
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+    )
+    return json_response({
+        'results': [serialize_post(post, fields) for post in page],
+        'next_cursor': page.next_cursor,
+        'previous_cursor': page.previous_cursor,
+    })
+
+
+def feed_response(request, post_list):
+    fields = get_fields(request)
+    paginator = CursorPaginator(
+        project(post_list, fields),
+        get_limit(request, settings.QUANTITY_POST, settings.API_PAGE_LIMIT))
+    return page_response(paginator, request, fields)
+
+
+@api_view
+@conditional_page(lambda: ['index'])
+def index(request):
+    return feed_response(request, Post.objects.all())
+
+
+@api_view
+@conditional_page(group_scopes)
+def group_posts(request, slug):
+    group = get_object_or_404(Group.objects.only('pk'), slug=slug)
+    return feed_response(request, group.posts.all())
+
+
+@api_view
+@conditional_page(profile_scopes)
+def profile(request, username):
+    author = get_object_or_404(User.objects.only('pk'), username=username)
+    return feed_response(request, author.posts.all())
+
+
+@api_view
+def follow_index(request):
+    if not request.user.is_authenticated:
+        raise ApiError('Нужна авторизация.', 401)
+    fields = get_fields(request)
+    paginator = TimelinePaginator(
+        request.user,
+        get_limit(request, settings.QUANTITY_POST, settings.API_PAGE_LIMIT),
+        project(Post.objects.all(), fields))
+    return page_response(paginator, request, fields)
+
+
+@api_view
+@conditional_page(post_scopes)
+def post_detail(request, post_id):
+    fields = get_fields(request)
+    post = get_object_or_404(project(Post.objects.all(), fields), pk=post_id)
+    return json_response(serialize_post(post, fields))
+
+
+@api_view
+def posts_batch(request):
+    ''' Посты по списку ?ids= одним запросом в порядке списка '''
+    fields = get_fields(request)
+    try:
+        ids = [int(pk) for pk in request.GET.get('ids', '').split(',') if pk]
+    except ValueError:
+        raise ApiError('ids - список целых чисел через запятую.')
+    if not ids:
+        raise ApiError('Передайте ids.')
+    if len(ids) > settings.API_BATCH_LIMIT:
+        raise ApiError(
+            f'Не больше {settings.API_BATCH_LIMIT} постов за запрос.')
+    posts = project(Post.objects.all(), fields).in_bulk(ids)
+    return json_response({
+        'results': [serialize_post(posts[pk], fields)
+                    for pk in dict.fromkeys(ids) if pk in posts],
+        'missing': [pk for pk in dict.fromkeys(ids) if pk not in posts],
+    })
+
+
+@api_view
+@conditional_page(post_scopes)
+def comments(request, post_id):
+    page_obj = get_comments_page(post_id, request)
+    if not page_obj and not Post.objects.filter(pk=post_id).exists():
+        raise Http404
+    return json_response({
+        'results': [serialize_comment(comment) for comment in page_obj],
+        'next_cursor': page_obj.next_cursor,
+    })
@@ -0,0 +1,110 @@
+import time
+from datetime import datetime, timezone
+from hashlib import md5
+
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.core.cache import cache
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+
+from core.routers import require_synced
+
+from .notifications import unread_count
+
+GLOBAL_SCOPE = 'all'
+
+
+def version_key(scope):
+    return f'feed_version:{scope}'
+
+
+def new_version():
+    # версия от текущего времени не повторит старую после вытеснения ключа
+    # и служит временем последнего изменения области
+    return time.time_ns()
+
+
+def get_versions(*scopes):
+    ''' Текущие версии областей кеша (лента, группа, профиль, пост) '''
+    keys = [version_key(scope) for scope in (GLOBAL_SCOPE, *scopes)]
+    versions = cache.get_many(keys)
+    missing = {key: new_version() for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, timeout=None)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def bump_versions(*scopes):
+    ''' Инвалидирует все фрагменты указанных областей '''
+    version = new_version()
+    cache.set_many(
+        {version_key(scope): version for scope in scopes}, timeout=None)
+
+
+def post_scopes(post):
+    ''' Области кеша, в которых отображается пост '''
+    scopes = ['index', f'profile:{post.author_id}', f'post:{post.pk}']
+    if post.group_id:
+        scopes.append(f'group:{post.group_id}')
+    return scopes
+
+
+def feed_cache_key(request, *scopes):
+    ''' Ключ фрагмента ленты: версии областей и курсор страницы '''
+    return ':'.join(map(str, (
+        *scopes,
+        *get_versions(*scopes),
+        request.GET.get('after', ''),
+        request.GET.get('before', ''),
+    )))
+
+
+def page_validators(request, *scopes):
+    ''' ETag и Last-Modified страницы без обращения к её данным
+
+    Версии областей меняются при каждой записи поста, комментария или
+    группы, поэтому последняя из них не раньше max(pub_date, updated).
+    Число непрочитанных уведомлений из шапки тоже входит в ETag.
+    Страница читается только из реплик, в которых уже есть эти записи.
+    '''
+    versions = get_versions(*scopes)
+    require_synced(max(versions))
+    etag = md5(':'.join(map(str, (
+        *scopes,
+        *versions,
+        request.GET.urlencode(),
+        request.session.get(SESSION_KEY, ''),
+        request.COOKIES.get(settings.CSRF_COOKIE_NAME, ''),
+        unread_count(request.user),
+    ))).encode()).hexdigest()
+    modified = datetime.fromtimestamp(max(versions) / 1e9, tz=timezone.utc)
+    return etag, modified
+
+
+def conditional_page(get_scopes):
+    ''' condition() для страницы с областями кеша от get_scopes
+
+    get_scopes принимает аргументы view и возвращает None, если объекта
+    страницы нет: тогда проверка пропускается и view отдаст 404.
+    '''
+    def validators(request, *args, **kwargs):
+        if not hasattr(request, 'page_validators'):
+            scopes = get_scopes(*args, **kwargs)
+            request.page_validators = (
+                (None, None) if scopes is None
+                else page_validators(request, *scopes))
+        return request.page_validators
+
+    def etag(request, *args, **kwargs):
+        return validators(request, *args, **kwargs)[0]
+
+    def last_modified(request, *args, **kwargs):
+        return validators(request, *args, **kwargs)[1]
+
+    def decorator(view):
+        view = condition(etag_func=etag, last_modified_func=last_modified)(
+            view)
+        return cache_control(private=True, no_cache=True)(view)
+    return decorator
@@ -0,0 +1,104 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Comment, Follow, Post, User, UserCounter
+from .utils import bulk_batch_size
+
+
+def shifted(field, delta):
+    ''' F(field) + delta не ниже нуля: счётчики - беззнаковые поля, и
+    уменьшение уже разошедшегося счётчика не должно ронять запись '''
+    if delta < 0:
+        return Greatest(F(field) + delta, 0)
+    return F(field) + delta
+
+
+def change_counters(user_id, **deltas):
+    ''' Атомарно сдвигает счётчики пользователя на deltas '''
+    if user_id is None:
+        return
+    UserCounter.objects.filter(user_id=user_id).update(
+        **{field: shifted(field, delta) for field, delta in deltas.items()})
+
+
+def change_comments_count(post_id, delta):
+    Post.objects.filter(pk=post_id).update(
+        comments_count=shifted('comments_count', delta))
+
+
+def change_many(queryset, field, deltas, key='pk'):
+    ''' Сдвигает field строк queryset на deltas[key] для пачки строк
+
+    Строки с одинаковым сдвигом обновляются одним UPDATE, так что
+    запросов столько, сколько разных сдвигов, а не строк.
+    '''
+    keys = defaultdict(list)
+    for pk, delta in deltas.items():
+        if pk is not None and delta:
+            keys[delta].append(pk)
+    for delta, pks in keys.items():
+        queryset.filter(**{f'{key}__in': pks}).update(
+            **{field: shifted(field, delta)})
+
+
+def get_counter(user):
+    ''' Счётчики пользователя; отсутствующие пересчитываются '''
+    try:
+        return user.counter
+    except UserCounter.DoesNotExist:
+        rebuild_user_counters(User.objects.filter(pk=user.pk))
+        return UserCounter.objects.get(user=user)
+
+
+def count_of(model, field, outer='pk', **filters):
+    ''' Подзапрос COUNT(*) по связи field на внешнюю строку '''
+    return Coalesce(Subquery(
+        model.objects.filter(**filters, **{field: OuterRef(outer)})
+        .order_by()
+        .values(field)
+        .annotate(total=Count('pk'))
+        .values('total')
+    ), 0)
+
+
+USER_COUNTERS = {
+    'posts_count': (Post, 'author'),
+    'followers_count': (Follow, 'author'),
+    'following_count': (Follow, 'user'),
+}
+
+
+def rebuild_user_counters(users):
+    ''' Пересчитывает счётчики users, возвращает число исправлений '''
+    fixed = 0
+    UserCounter.objects.bulk_create(
+        (UserCounter(user_id=pk)
+         for pk in users.values_list('pk', flat=True).iterator()),
+        batch_size=bulk_batch_size(UserCounter, 1000),
+        ignore_conflicts=True,
+    )
+    counters = UserCounter.objects.filter(user__in=users)
+    for field, (model, relation) in USER_COUNTERS.items():
+        actual = count_of(model, relation, outer='user')
+        fixed += counters.annotate(actual=actual).exclude(
+            **{field: F('actual')}).count()
+        counters.update(**{field: actual})
+    return fixed
+
+
+def rebuild_comment_counters(posts):
+    actual = count_of(Comment, 'post', active=True)
+    fixed = posts.annotate(actual=actual).exclude(
+        comments_count=F('actual')).count()
+    posts.update(comments_count=actual)
+    return fixed
+
+
+def rebuild_counters():
+    ''' Сверяет все счётчики с данными, возвращает число исправлений '''
+    with transaction.atomic():
+        return (rebuild_user_counters(User.objects.all())
+                + rebuild_comment_counters(Post.objects.all()))
@@ -0,0 +1,138 @@
+''' Потоковая выгрузка таблиц в NDJSON и CSV
+
+Строки читаются через iterator(chunk_size) по возрастанию id, так что
+память не зависит от размера таблицы, а выгрузку можно продолжить с
+последнего записанного id (параметр after).
+'''
+import csv
+import datetime
+import json
+
+from django.conf import settings
+
+from .models import Comment, Follow, Group, Post
+
+EXPORTS = {
+    'posts': Post,
+    'comments': Comment,
+    'follows': Follow,
+    'groups': Group,
+}
+# блок, которым NDJSON читается с конца при продолжении выгрузки
+TAIL_BLOCK = 64 * 1024
+# формат -> MIME-тип ответа
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv; charset=utf-8',
+}
+
+
+def export_columns(name):
+    ''' Колонки таблицы: id и значения полей, внешние ключи - как *_id '''
+    return [field.attname for field in EXPORTS[name]._meta.concrete_fields]
+
+
+def export_rows(name, after=None, chunk_size=None):
+    rows = EXPORTS[name]._default_manager.order_by('pk').values_list(
+        *export_columns(name))
+    if after is not None:
+        rows = rows.filter(pk__gt=after)
+    return rows.iterator(chunk_size=chunk_size or settings.EXPORT_CHUNK_SIZE)
+
+
+def dump_value(value):
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return value
+
+
+def ndjson_lines(columns, rows):
+    for row in rows:
+        yield json.dumps(
+            dict(zip(columns, map(dump_value, row))),
+            ensure_ascii=False) + '\n'
+
+
+class Line:
+    ''' Файл для csv.writer, который возвращает записанную строку '''
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(columns, rows, header=True):
+    writer = csv.writer(Line())
+    if header:
+        yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow(map(dump_value, row))
+
+
+def export_lines(name, export_format, after=None, chunk_size=None,
+                 header=True):
+    ''' Строки выгрузки name в формате export_format после id after '''
+    columns = export_columns(name)
+    rows = export_rows(name, after, chunk_size)
+    if export_format == 'csv':
+        return csv_lines(columns, rows, header)
+    return ndjson_lines(columns, rows)
+
+
+def last_ndjson_line(file):
+    ''' Последняя целая строка NDJSON: файл читается с конца блоками '''
+    end = file.seek(0, 2)
+    position = end
+    lines = [b'']
+    while position > 0:
+        position = max(0, position - TAIL_BLOCK)
+        file.seek(position)
+        # последний элемент - недописанный хвост, первый - обрывок блока
+        lines = file.read(end - position).split(b'\n')
+        if len(lines) >= 3:
+            break
+    if len(lines) < 2:
+        return None, 0
+    return lines[-2], end - len(lines[-1])
+
+
+def csv_records(file):
+    ''' Целые записи CSV из бинарного файла, начиная с текущей позиции
+
+    Текст постов может содержать переводы строк в кавычках, поэтому
+    граница записи - перевод строки при чётном числе кавычек с начала
+    записи; недописанная последняя запись не возвращается.
+    '''
+    record, quoted = b'', False
+    for line in file:
+        record += line
+        quoted ^= bool(line.count(b'"') % 2)
+        if not quoted and record.endswith(b'\n'):
+            yield record
+            record = b''
+
+
+def last_csv_record(file):
+    ''' Последняя целая запись CSV: файл читается с начала '''
+    last, length = None, 0
+    for last in csv_records(file):
+        length += len(last)
+    return last, length
+
+
+def last_exported_id(path, export_format):
+    ''' id последней целой записи выгрузки и длина файла до её конца
+
+    Недописанная запись в конце файла не учитывается: продолжение
+    выгрузки пишется с этой длины.
+    '''
+    with open(path, 'rb') as file:
+        if export_format == 'csv':
+            last, length = last_csv_record(file)
+        else:
+            last, length = last_ndjson_line(file)
+    if last is None:
+        return None, length
+    if export_format == 'csv':
+        value = last.split(b',', 1)[0].strip()
+        return (None if value == b'id' else int(value)), length
+    return json.loads(last)['id'], length
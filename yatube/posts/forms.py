@@ -1,6 +1,7 @@
 from django import forms
 
 from .models import Comment, Post
+from .uploads import check_image
 
 
 class PostForm(forms.ModelForm):
@@ -8,6 +9,22 @@ class PostForm(forms.ModelForm):
         model = Post
         fields = ['text', 'group', 'image']
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # отклонённую при приёме картинку ImageField не откроет,
+        # пусть тогда покажет причину отказа
+        error = getattr(self.files.get('image'), 'upload_error', None)
+        if error is not None:
+            field = self.fields['image']
+            field.error_messages = {
+                **field.error_messages, 'invalid_image': error.messages[0]}
+
+    def clean_image(self):
+        image = self.cleaned_data['image']
+        if hasattr(image, 'image'):
+            check_image(image.size, image.image.format, image.image.size)
+        return image
+
 
 class CommentForm(forms.ModelForm):
     class Meta:
@@ -0,0 +1,73 @@
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import F
+from sorl.thumbnail import default
+from sorl.thumbnail.images import ImageFile
+
+from core.queue import task
+
+from .models import StoredImage
+from .renditions import delete_set
+from .storage import image_storage
+from .utils import bulk_batch_size
+
+
+def add_refs(counts, using=DEFAULT_DB_ALIAS):
+    ''' Прибавляет картинкам ссылки counts (имя -> число) одним
+    INSERT ... ON CONFLICT DO UPDATE на пачку
+
+    Строка создаётся или увеличивается одним оператором, поэтому
+    release_image не удалит её между проверкой и увеличением.
+    '''
+    rows = [(name, refs) for name, refs in counts.items() if name and refs]
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    table, name, refs = (quote(StoredImage._meta.db_table), quote('name'),
+                         quote('refs'))
+    size = bulk_batch_size(StoredImage, len(rows) or 1, using)
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), size):
+            batch = rows[start:start + size]
+            cursor.execute(
+                f'INSERT INTO {table} ({name}, {refs}) VALUES '
+                f'{", ".join(["(%s, %s)"] * len(batch))} '
+                f'ON CONFLICT ({name}) DO UPDATE '
+                f'SET {refs} = {table}.{refs} + excluded.{refs}',
+                [value for row in batch for value in row])
+
+
+def acquire_image(name):
+    ''' Ещё один пост ссылается на картинку name '''
+    add_refs({name: 1})
+
+
+def acquire_images(counts):
+    ''' acquire_image для пачки постов: counts - имя -> число ссылок '''
+    add_refs(counts)
+
+
+def release_image(name):
+    ''' Пост больше не ссылается на name; последняя ссылка удаляет файл
+
+    Уменьшение и удаление опустевшей строки идут одной транзакцией, а
+    файл удаляет задача, поставленная после её фиксации.
+    '''
+    if not name:
+        return
+    with transaction.atomic():
+        StoredImage.objects.filter(name=name, refs__gt=0).update(
+            refs=F('refs') - 1)
+        deleted, _ = StoredImage.objects.filter(name=name, refs=0).delete()
+    if deleted:
+        delete_orphan.delay(name)
+
+
+@task
+def delete_orphan(name):
+    ''' Удаляет картинку и её версии, если ссылок так и не появилось '''
+    if StoredImage.objects.filter(name=name).exists():
+        return
+    delete_set(name)
+    # миниатюры sorl, подготовленные до наборов версий
+    image = ImageFile(name, image_storage)
+    default.kvstore.delete(image)
+    image.delete()
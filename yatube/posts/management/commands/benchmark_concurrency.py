@@ -0,0 +1,214 @@
+import json
+import random
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.db.models.signals import post_save
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from core.models import Task
+from posts.models import Comment, Delivery, Follow, Group, Post, User
+from posts.utils import bulk_batch_size
+
+from .benchmark_posts import PERCENTILES, percentile
+
+# настройки SQLite по умолчанию, с которыми сравнивается SQLITE_PRAGMAS
+UNTUNED_PRAGMAS = {'journal_mode': 'DELETE', 'synchronous': 'FULL'}
+SAMPLE_SIZE = 200
+# таблицы, в которые пишет нагрузка; созданные ею строки удаляются после
+# прогона в этом порядке, сигналы возвращают счётчики и ленты
+CREATED = (Follow, Comment, Post, Delivery, Task, Session)
+
+
+class Command(BaseCommand):
+    help = ('Смешанная нагрузка чтения и записи на страницы постов '
+            'из нескольких потоков')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--threads', type=int, default=8,
+            help='Число потоков-клиентов, 0 - один клиент без пула')
+        parser.add_argument(
+            '--duration', type=float, default=10, help='Секунд нагрузки')
+        parser.add_argument(
+            '--write-ratio', type=float, default=0.2,
+            help='Доля запросов на запись')
+        parser.add_argument(
+            '--untuned', action='store_true',
+            help='Прогон с настройками SQLite по умолчанию для сравнения')
+        parser.add_argument(
+            '--seed', type=int, default=None)
+        parser.add_argument(
+            '--output', help='JSON-файл, в который сохраняются результаты')
+
+    def load_sample(self):
+        self.posts = list(Post.objects.order_by('-pk').values_list(
+            'pk', flat=True)[:SAMPLE_SIZE])
+        self.users = list(User.objects.order_by('-pk')[:SAMPLE_SIZE])
+        self.slugs = list(Group.objects.values_list(
+            'slug', flat=True)[:SAMPLE_SIZE])
+        if not (self.posts and self.slugs and len(self.users) > 1):
+            raise CommandError(
+                'Мало данных, сначала запустите seed_posts')
+        self.operations = {
+            'read': [
+                ('index', lambda client, rnd: client.get(
+                    reverse('posts:index'))),
+                ('group_list', lambda client, rnd: client.get(reverse(
+                    'posts:group_list', args=[rnd.choice(self.slugs)]))),
+                ('profile', lambda client, rnd: client.get(reverse(
+                    'posts:profile', args=[rnd.choice(self.users)]))),
+                ('post_detail', lambda client, rnd: client.get(reverse(
+                    'posts:post_detail', args=[rnd.choice(self.posts)]))),
+            ],
+            'write': [
+                ('add_comment', lambda client, rnd: client.post(
+                    reverse('posts:add_comment',
+                            args=[rnd.choice(self.posts)]),
+                    {'text': 'Комментарий из нагрузочного теста'})),
+                ('post_create', lambda client, rnd: client.post(
+                    reverse('posts:create'),
+                    {'text': 'Пост из нагрузочного теста'})),
+                ('profile_follow', lambda client, rnd: client.get(reverse(
+                    'posts:profile_follow', args=[rnd.choice(self.users)]))),
+            ],
+        }
+
+    def work(self, deadline, seed, write_ratio):
+        rnd = random.Random(seed)
+        client = None
+        timings, errors, messages = defaultdict(list), Counter(), Counter()
+        try:
+            while time.monotonic() < deadline:
+                if client is None:
+                    try:
+                        client = Client()
+                        client.force_login(rnd.choice(self.users))
+                    except Exception as error:
+                        client = None
+                        errors['login'] += 1
+                        messages[f'login: {error}'] += 1
+                        continue
+                kind = 'write' if rnd.random() < write_ratio else 'read'
+                name, request = rnd.choice(self.operations[kind])
+                started = time.perf_counter()
+                try:
+                    failed = request(client, rnd).status_code >= 500
+                except Exception as error:
+                    failed = True
+                    messages[f'{name}: {error}'] += 1
+                elapsed = (time.perf_counter() - started) * 1000
+                if failed:
+                    errors[name] += 1
+                else:
+                    timings[name].append(elapsed)
+        finally:
+            if self.threaded:
+                connections.close_all()
+        return timings, errors, messages
+
+    def run(self, options):
+        deadline = time.monotonic() + options['duration']
+        seed = options['seed']
+        jobs = max(options['threads'], 1)
+        seeds = [None if seed is None else seed + i for i in range(jobs)]
+        if self.threaded:
+            with ThreadPoolExecutor(max_workers=jobs) as pool:
+                return list(pool.map(
+                    lambda seed: self.work(
+                        deadline, seed, options['write_ratio']),
+                    seeds))
+        return [self.work(deadline, seeds[0], options['write_ratio'])]
+
+    def record(self, sender, instance, created, **kwargs):
+        ''' Запоминает id строк, созданных нагрузкой в этом процессе '''
+        if created:
+            self.created[sender].append(instance.pk)
+
+    def clean_up(self):
+        ''' Удаляет только строки нагрузки: записи пользователей сайта за
+        время прогона остаются '''
+        for model in CREATED:
+            pks = self.created[model]
+            size = bulk_batch_size(model, 500)
+            for start in range(0, len(pks), size):
+                model.objects.filter(pk__in=pks[start:start + size]).delete()
+        # force_login отметил вход выбранных пользователей
+        for user in self.users:
+            user.last_login = self.last_logins[user.pk]
+        User.objects.bulk_update(self.users, ['last_login'])
+
+    def measure(self, options):
+        ''' Прогон нагрузки: результаты потоков и время; после прогона
+        строки нагрузки удаляются '''
+        self.created = defaultdict(list)
+        self.last_logins = {user.pk: user.last_login for user in self.users}
+        for model in CREATED:
+            post_save.connect(self.record, sender=model, weak=False)
+        # рассылки нагрузки остаются задачами в очереди и удаляются с ней,
+        # не дойдя до подписчиков
+        tuning = {'TASKS_EAGER': False}
+        if options['untuned']:
+            tuning['SQLITE_PRAGMAS'] = UNTUNED_PRAGMAS
+            # потоки открывают свои соединения уже с выбранными PRAGMA
+            connections.close_all()
+        started = time.monotonic()
+        try:
+            with override_settings(**tuning):
+                results = self.run(options)
+            return results, time.monotonic() - started
+        finally:
+            for model in CREATED:
+                post_save.disconnect(self.record, sender=model)
+            if options['untuned']:
+                # journal_mode хранится в файле базы: новое соединение
+                # возвращает WAL из SQLITE_PRAGMAS
+                connections.close_all()
+                connection.ensure_connection()
+            self.clean_up()
+
+    def handle(self, *args, **options):
+        self.load_sample()
+        self.threaded = options['threads'] > 0
+        if options['untuned'] and not self.threaded:
+            raise CommandError('--untuned работает только с потоками')
+        results, elapsed = self.measure(options)
+
+        timings, errors, messages = defaultdict(list), Counter(), Counter()
+        for thread_timings, thread_errors, thread_messages in results:
+            for name, values in thread_timings.items():
+                timings[name] += values
+            errors.update(thread_errors)
+            messages.update(thread_messages)
+        report = {}
+        for name, values in sorted(timings.items()):
+            report[name] = {'requests': len(values), 'errors': errors[name]}
+            for percent in PERCENTILES:
+                report[name][f'p{percent}'] = round(
+                    percentile(values, percent), 3)
+            self.stdout.write(
+                f'{name}: {len(values)} запросов, ошибок {errors[name]}, '
+                + ', '.join(f'p{percent} {report[name][f"p{percent}"]} мс'
+                            for percent in PERCENTILES))
+        total = sum(len(values) for values in timings.values())
+        failed = sum(errors.values())
+        for message, count in messages.most_common():
+            self.stderr.write(f'{count} x {message}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Всего {total} запросов за {elapsed:.1f} с: '
+            f'{total / elapsed:.1f} в секунду, ошибок {failed}'))
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump({
+                    'threads': options['threads'],
+                    'write_ratio': options['write_ratio'],
+                    'untuned': options['untuned'],
+                    'throughput': round(total / elapsed, 1),
+                    'errors': failed,
+                    'operations': report,
+                }, output, ensure_ascii=False, indent=2)
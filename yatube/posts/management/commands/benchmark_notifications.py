@@ -0,0 +1,181 @@
+import json
+from time import perf_counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from core.models import Task
+from posts.counters import rebuild_user_counters
+from posts.models import Delivery, Follow, Notification, Post, User
+from posts.notifications import (deliver_notifications, unread_count,
+                                 unread_key)
+from posts.utils import bulk_batch_size
+
+from .benchmark_posts import PERCENTILES, percentile
+
+PREFIX = 'notify_bench'
+# подписчиков, на которых замеряется наивная запись уведомления в запросе
+NAIVE_SAMPLE = 1000
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('Замеряет уведомления подписчиков автора с большой аудиторией: '
+            'цену публикации в запросе, фоновую рассылку и счётчик шапки')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--followers', type=int, default=100_000)
+        parser.add_argument(
+            '--posts', type=int, default=100,
+            help='Постов за одно окно сводки')
+        parser.add_argument(
+            '--output', help='JSON-файл, в который сохраняются результаты')
+
+    def ensure_followers(self, count):
+        ''' Автор и count подписчиков; недостающие создаются пачками
+
+        Повторный запуск берёт уже созданных пользователей.
+        '''
+        author, _ = User.objects.get_or_create(username=f'{PREFIX}_author')
+        have = Follow.objects.filter(author=author).count()
+        if have < count:
+            started = perf_counter()
+            User.objects.bulk_create(
+                (User(username=f'{PREFIX}_{i}', password='!')
+                 for i in range(have, count)),
+                batch_size=bulk_batch_size(User, 2000),
+                ignore_conflicts=True)
+            users = User.objects.filter(
+                username__startswith=f'{PREFIX}_').exclude(pk=author.pk)
+            Follow.objects.bulk_create(
+                (Follow(user_id=pk, author=author) for pk in users.exclude(
+                    follower__author=author).values_list(
+                        'pk', flat=True)[:count - have].iterator()),
+                batch_size=bulk_batch_size(Follow, 2000))
+            rebuild_user_counters(User.objects.filter(
+                username__startswith=f'{PREFIX}_'))
+            self.stdout.write(
+                f'Создано подписчиков: {count - have} за '
+                f'{perf_counter() - started:.1f} с')
+        return author
+
+    def publish(self, author, count):
+        ''' Посты как в запросе: транзакция, сигналы, задача после фиксации
+
+        Возвращает id постов, время и число запросов каждой публикации.
+        '''
+        ids, timings, queries = [], [], []
+        for i in range(count):
+            with CaptureQueriesContext(connection) as captured:
+                started = perf_counter()
+                with transaction.atomic():
+                    post = Post.objects.create(
+                        text=f'Пост замера уведомлений {i}', author=author)
+                timings.append((perf_counter() - started) * 1000)
+            ids.append(post.pk)
+            queries.append(len(captured))
+        return ids, timings, queries
+
+    def deliver(self, author):
+        delivery = Delivery.objects.get(author=author, started=False)
+        started = perf_counter()
+        deliver_notifications(delivery.pk)
+        return perf_counter() - started
+
+    def naive_ms(self, author, post_id):
+        ''' Запись уведомления на каждого подписчика прямо в запросе,
+        пересчитанная с NAIVE_SAMPLE подписчиков на всех '''
+        users = list(Follow.objects.filter(author=author).values_list(
+            'user_id', flat=True)[:NAIVE_SAMPLE])
+        started = perf_counter()
+        try:
+            with transaction.atomic():
+                for user_id in users:
+                    Notification.objects.create(
+                        user_id=user_id, author=author, post_id=post_id,
+                        kind=Notification.POST, read=True)
+                raise Rollback
+        except Rollback:
+            pass
+        per_follower = (perf_counter() - started) * 1000 / len(users)
+        return per_follower * Follow.objects.filter(author=author).count()
+
+    def handle(self, *args, **options):
+        author = self.ensure_followers(options['followers'])
+        followers = Follow.objects.filter(author=author).count()
+        Notification.objects.filter(author=author).delete()
+        Delivery.objects.filter(author=author).delete()
+        last_task = Task.objects.order_by('-pk').values_list(
+            'pk', flat=True).first() or 0
+
+        report = {'followers': followers, 'posts': options['posts'],
+                  'batch_size': settings.NOTIFICATION_BATCH_SIZE}
+        ids, timings, queries = self.publish(author, options['posts'])
+        try:
+            for percent in PERCENTILES:
+                report[f'publish_p{percent}_ms'] = round(
+                    percentile(timings, percent), 3)
+            report['publish_queries'] = max(queries)
+            report['deliveries'] = Delivery.objects.filter(
+                author=author).count()
+            report['tasks'] = Task.objects.filter(
+                pk__gt=last_task, name=deliver_notifications.name).count()
+            self.stdout.write(
+                f'Публикация {options["posts"]} постов: p50 '
+                f'{report["publish_p50_ms"]} мс, p99 '
+                f'{report["publish_p99_ms"]} мс, запросов до '
+                f'{report["publish_queries"]}, рассылок '
+                f'{report["deliveries"]}, задач {report["tasks"]}')
+
+            elapsed = self.deliver(author)
+            report['deliver_new_s'] = round(elapsed, 2)
+            report['deliver_new_per_s'] = round(followers / elapsed)
+            counts = set(Notification.objects.filter(
+                author=author).values_list('count', flat=True))
+            report['digest_counts'] = sorted(counts)
+            self.stdout.write(
+                f'Новые сводки: {followers} подписчиков за {elapsed:.2f} с '
+                f'({report["deliver_new_per_s"]} в с), событий в сводке '
+                f'{report["digest_counts"]}')
+
+            more, _, _ = self.publish(author, 1)
+            ids += more
+            elapsed = self.deliver(author)
+            report['deliver_merge_s'] = round(elapsed, 2)
+            report['deliver_merge_per_s'] = round(followers / elapsed)
+            self.stdout.write(
+                f'Дополнение сводок: {elapsed:.2f} с '
+                f'({report["deliver_merge_per_s"]} в с)')
+
+            reader = User.objects.get(pk=Follow.objects.filter(
+                author=author).values_list('user_id', flat=True).first())
+            cache.delete(unread_key(reader.pk))
+            for state in ('cold', 'warm'):
+                started = perf_counter()
+                unread_count(reader)
+                report[f'unread_{state}_ms'] = round(
+                    (perf_counter() - started) * 1000, 3)
+            self.stdout.write(
+                f'Счётчик шапки: {report["unread_cold_ms"]} мс без кеша, '
+                f'{report["unread_warm_ms"]} мс из кеша')
+
+            report['naive_publish_ms'] = round(
+                self.naive_ms(author, ids[-1]))
+            self.stdout.write(
+                f'Наивная запись на подписчика в запросе: около '
+                f'{report["naive_publish_ms"]} мс на пост')
+        finally:
+            Task.objects.filter(
+                pk__gt=last_task, name=deliver_notifications.name).delete()
+            Notification.objects.filter(author=author).delete()
+            Delivery.objects.filter(author=author).delete()
+            Post.objects.filter(pk__in=ids).delete()
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, ensure_ascii=False, indent=2)
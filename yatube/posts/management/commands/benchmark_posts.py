@@ -0,0 +1,226 @@
+import json
+import math
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from time import perf_counter
+from unittest import mock
+
+from django.core.cache import cache, caches
+from django.core.files.storage import FileSystemStorage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.http import urlencode
+
+from core.middleware import instrument
+from posts import urls
+from posts.models import Post, UserCounter
+from posts.search import WORD
+
+PERCENTILES = (50, 95, 99)
+# адрес, который вызывается без замера перед каждым запросом к ключу
+PREPARE = {'profile_unfollow': 'profile_follow'}
+# параметры строки запроса: имя адреса -> (параметр, ключ из аргументов)
+QUERY_STRINGS = {'search': ('q', 'word')}
+# адреса, которые не замеряются: выгрузка доступна только персоналу
+# и отдаёт таблицы целиком
+SKIPPED = {'export'}
+# обращения, которые считаются вводом-выводом страницы помимо запросов к базе
+CACHE_CALLS = ('get', 'get_many', 'set', 'set_many', 'add', 'delete',
+               'delete_many', 'has_key', 'incr', 'touch')
+STORAGE_CALLS = ('exists', '_open', 'size', 'listdir', 'get_modified_time')
+IO_LABELS = {
+    'queries': 'запросов',
+    'cache_calls': 'кеш',
+    'storage_calls': 'хранилище',
+}
+
+
+def percentile(values, percent):
+    ''' Процентиль по ближайшему рангу '''
+    values = sorted(values)
+    rank = max(math.ceil(percent / 100 * len(values)), 1)
+    return values[rank - 1]
+
+
+@contextmanager
+def count_io():
+    ''' Считает обращения к кешу default и к файловому хранилищу
+
+    Вложенные вызовы (get_many через get и т. п.) не учитываются, так что
+    число равно обращениям кода страницы, а не внутренним бэкенда.
+    '''
+    counts = Counter()
+    depth = Counter()
+    # метрики запросов оборачивают методы кеша при первом запросе; позже
+    # обёртки легли бы поверх подмены и пропали вместе с ней
+    instrument()
+
+    def counted(kind, method):
+        def wrapper(*args, **kwargs):
+            depth[kind] += 1
+            try:
+                if depth[kind] == 1:
+                    counts[kind] += 1
+                return method(*args, **kwargs)
+            finally:
+                depth[kind] -= 1
+        return wrapper
+
+    with ExitStack() as stack:
+        for kind, backend, names in (
+                ('cache', type(caches['default']), CACHE_CALLS),
+                ('storage', FileSystemStorage, STORAGE_CALLS)):
+            for name in names:
+                stack.enter_context(mock.patch.object(
+                    backend, name, counted(kind, getattr(backend, name))))
+        yield counts
+
+
+class Command(BaseCommand):
+    help = ('Замеряет задержку и число обращений к базе, кешу и хранилищу '
+            'для каждого адреса posts/urls.py')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requests', type=int, default=50,
+            help='Число замеров на адрес')
+        parser.add_argument(
+            '--warmup', type=int, default=3,
+            help='Число прогревочных запросов, не попадающих в замеры')
+        parser.add_argument(
+            '--cold', action='store_true',
+            help='Очищать кеш перед каждым запросом')
+        parser.add_argument(
+            '--output', help='JSON-файл, в который сохраняются результаты')
+        parser.add_argument(
+            '--baseline', help='JSON-файл прошлого прогона для сравнения')
+        parser.add_argument(
+            '--threshold', type=float, default=10,
+            help='Рост p95 в процентах, считающийся регрессией')
+
+    def get_arguments(self):
+        ''' Значения параметров адресов из самых нагруженных данных '''
+        reader = UserCounter.objects.select_related('user').order_by(
+            '-following_count').first()
+        author = UserCounter.objects.select_related('user').order_by(
+            '-followers_count').first()
+        if reader is None or author is None:
+            raise CommandError(
+                'Нет пользователей, сначала запустите seed_posts')
+        post = (
+            Post.objects.select_related('group').filter(
+                author=reader.user, group__isnull=False).first()
+            or Post.objects.select_related('group').filter(
+                group__isnull=False).first()
+        )
+        if post is None:
+            raise CommandError('Нужен хотя бы один пост в группе')
+        return reader.user, {
+            'post_id': post.pk,
+            'slug': post.group.slug,
+            'username': author.user.username,
+            'word': (WORD.findall(post.text) or ['пост'])[0],
+        }
+
+    def get_urls(self, arguments):
+        found = {}
+        for pattern in urls.urlpatterns:
+            if pattern.name in SKIPPED:
+                continue
+            names = pattern.pattern.converters.keys()
+            missing = set(names) - set(arguments)
+            if missing:
+                self.stderr.write(
+                    f'{pattern.name}: нет значений для {", ".join(missing)}')
+                continue
+            url = reverse(
+                f'{urls.app_name}:{pattern.name}',
+                kwargs={name: arguments[name] for name in names})
+            if pattern.name in QUERY_STRINGS:
+                param, key = QUERY_STRINGS[pattern.name]
+                url += f'?{urlencode({param: arguments[key]})}'
+            found[pattern.name] = url
+        return found
+
+    def measure(self, client, url, requests, warmup, cold, prepare=None):
+        timings, queries, io = [], [], Counter()
+        for i in range(warmup + requests):
+            if prepare:
+                client.get(prepare)
+            if cold:
+                cache.clear()
+            with CaptureQueriesContext(connection) as captured, \
+                    count_io() as calls:
+                started = perf_counter()
+                response = client.get(url)
+                elapsed = perf_counter() - started
+            if i >= warmup:
+                timings.append(elapsed * 1000)
+                queries.append(len(captured.captured_queries))
+                io.update(calls)
+        result = {
+            'url': url,
+            'status': response.status_code,
+            'queries': sum(queries) / len(queries),
+            'cache_calls': io['cache'] / requests,
+            'storage_calls': io['storage'] / requests,
+        }
+        for percent in PERCENTILES:
+            result[f'p{percent}'] = round(percentile(timings, percent), 3)
+        return result
+
+    def compare(self, report, baseline, threshold):
+        for name, result in report.items():
+            before = baseline.get(name)
+            if before is None:
+                self.stdout.write(f'{name}: нет в базовом прогоне')
+                continue
+            change = (result['p95'] - before['p95']) / before['p95'] * 100
+            line = (
+                f'{name}: p95 {before["p95"]} -> {result["p95"]} мс '
+                f'({change:+.1f}%)')
+            regression = change > threshold
+            for key, label in IO_LABELS.items():
+                if key not in before:
+                    continue
+                line += f', {label} {before[key]:g} -> {result[key]:g}'
+                regression = regression or result[key] > before[key]
+            self.stdout.write(
+                self.style.WARNING(line) if regression else line)
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1:
+            raise CommandError('--requests должно быть больше нуля')
+        user, arguments = self.get_arguments()
+        client = Client()
+        client.force_login(user)
+        report = {}
+        # подписки, комментарии и правки из прогона откатываются
+        with transaction.atomic():
+            found = self.get_urls(arguments)
+            for name, url in found.items():
+                report[name] = result = self.measure(
+                    client, url, options['requests'], options['warmup'],
+                    options['cold'], found.get(PREPARE.get(name)))
+                self.stdout.write(
+                    f'{name} {url} [{result["status"]}]: '
+                    + ', '.join(f'p{percent} {result[f"p{percent}"]} мс'
+                                for percent in PERCENTILES)
+                    + ''.join(f', {label} {result[key]:g}'
+                              for key, label in IO_LABELS.items()))
+            transaction.set_rollback(True)
+        if options['baseline']:
+            with open(options['baseline']) as baseline:
+                self.compare(
+                    report, json.load(baseline)['urls'],
+                    options['threshold'])
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump({
+                    'requests': options['requests'],
+                    'cold': options['cold'],
+                    'urls': report,
+                }, output, ensure_ascii=False, indent=2)
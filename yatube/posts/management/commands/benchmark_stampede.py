@@ -0,0 +1,131 @@
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from importlib import import_module
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory
+from django.urls import reverse
+
+from core.templatetags import stampede
+from posts import views
+from posts.cache import feed_cache_key
+from posts.models import Post
+
+from .benchmark_posts import PERCENTILES, percentile
+
+# страница ленты: view, его аргументы, фрагмент шаблона и область кеша
+FeedPage = namedtuple('FeedPage', 'name url view kwargs fragment scope')
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает число запросов ленты при истечении фрагмента '
+            'index, group_posts и profile без защиты и через '
+            'get_or_compute')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=32)
+        parser.add_argument('--rounds', type=int, default=10)
+        parser.add_argument(
+            '--compute-ms', type=float, default=50,
+            help='Дополнительное время каждого запроса ленты к базе')
+
+    def get_pages(self):
+        post = Post.objects.filter(group__isnull=False).select_related(
+            'author', 'group').order_by('-pub_date').first()
+        if post is None:
+            raise CommandError(
+                'Нет постов с группой: заполните базу командой seed_posts')
+        slug, username = post.group.slug, post.author.username
+        return [
+            FeedPage('index', reverse('posts:index'), views.index, {},
+                     'index_page', 'index'),
+            FeedPage('group_posts', reverse('posts:group_list', args=[slug]),
+                     views.group_posts, {'slug': slug},
+                     'group_page', f'group:{post.group_id}'),
+            FeedPage('profile', reverse('posts:profile', args=[username]),
+                     views.profile, {'username': username},
+                     'profile_page', f'profile:{post.author_id}'),
+        ]
+
+    def make_request(self, page):
+        request = self.factory.get(page.url)
+        request.user = AnonymousUser()
+        request.session = self.session_store()
+        return request
+
+    def fragment_key(self, page):
+        return make_template_fragment_key(
+            page.fragment,
+            [feed_cache_key(self.make_request(page), page.scope)])
+
+    def feed_query(self, execute, sql, params, many, context):
+        ''' Считает и замедляет запросы к постам: пересчёты фрагмента '''
+        if 'FROM "posts_post"' in sql:
+            with self.lock:
+                self.computed += 1
+            time.sleep(self.compute_ms / 1000)
+        return execute(sql, params, many, context)
+
+    def naive(self, key, compute, timeout, cache=cache):
+        ''' {% cache %} без защиты: каждый промах пересчитывает фрагмент '''
+        value = cache.get(key)
+        if value is None:
+            value = compute()
+            cache.set(key, value, timeout)
+        return value
+
+    def expire(self, page, mode):
+        key = self.fragment_key(page)
+        cache.delete(key)
+        if mode == 'protected, stale':
+            # просроченная запись: её можно отдать, пока идёт пересчёт
+            page.view(self.make_request(page), **page.kwargs)
+            value, _, delta = cache.get(key)
+            cache.set(key, (value, time.time() - 1, delta), 60)
+
+    def request(self, page, barrier):
+        request = self.make_request(page)
+        barrier.wait()
+        with connection.execute_wrapper(self.feed_query):
+            started = time.perf_counter()
+            page.view(request, **page.kwargs)
+            return (time.perf_counter() - started) * 1000
+
+    def run(self, page, mode, threads, rounds):
+        timings = []
+        naive = mock.patch.object(stampede, 'get_or_compute', self.naive)
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            with naive if mode == 'naive' else nullcontext():
+                self.computed = 0
+                for _ in range(rounds):
+                    self.expire(page, mode)
+                    barrier = threading.Barrier(threads)
+                    timings += pool.map(
+                        lambda _: self.request(page, barrier),
+                        range(threads))
+        self.stdout.write(
+            f'{page.name}, {mode}: запросов ленты за истечение '
+            f'{self.computed / rounds:g}, '
+            + ', '.join(f'p{percent} {percentile(timings, percent):.1f} мс'
+                        for percent in PERCENTILES))
+
+    def handle(self, *args, **options):
+        self.lock = threading.Lock()
+        self.compute_ms = options['compute_ms']
+        self.factory = RequestFactory()
+        self.session_store = import_module(
+            settings.SESSION_ENGINE).SessionStore
+        threads, rounds = options['threads'], options['rounds']
+        for page in self.get_pages():
+            for mode in ('naive', 'protected, cold', 'protected, stale'):
+                self.run(page, mode, threads, rounds)
+            cache.delete(self.fragment_key(page))
@@ -0,0 +1,148 @@
+import json
+import tempfile
+import tracemalloc
+import warnings
+from io import BytesIO
+from time import perf_counter
+
+from django.core.handlers.base import BaseHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import Client, RequestFactory, override_settings
+from django.urls import reverse
+from PIL import Image
+
+from posts.models import Post, User
+
+from .benchmark_posts import PERCENTILES, percentile
+
+# без своих обработчиков загрузки поста принимают обработчики Django
+DEFAULT_HANDLERS = []
+BOUNDED_HANDLERS = ['posts.uploads.BoundedImageUploadHandler']
+
+
+def make_image(size, image_format):
+    ''' Картинка из шума, чтобы JPEG не сжимался до пустяка '''
+    output = BytesIO()
+    Image.effect_noise(size, 64).convert('RGB').save(
+        output, image_format, quality=90)
+    return output.getvalue()
+
+
+def make_bomb(size):
+    ''' Однотонный PNG: килобайты на диске, сотни мегабайт в памяти '''
+    output = BytesIO()
+    Image.new('L', size).save(output, 'PNG')
+    return output.getvalue()
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('Замеряет пиковую память и время создания поста с картинкой '
+            'с обработчиками загрузок Django и BoundedImageUploadHandler')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', default='640x480,1920x1080,4000x3000',
+            help='Размеры JPEG через запятую')
+        parser.add_argument(
+            '--bomb', default='12000x12000',
+            help='Размер однотонного PNG, пустая строка - без него')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument(
+            '--output', help='JSON-файл, в который сохраняются результаты')
+
+    def parse_size(self, value):
+        try:
+            width, height = map(int, value.split('x'))
+        except ValueError:
+            raise CommandError(f'Размер {value} не в формате ШxВ')
+        return width, height
+
+    def measure(self, content, name, handlers):
+        ''' Пик памяти Python от разбора запроса до ответа, без тела '''
+        request = self.factory.post(
+            reverse('posts:create'),
+            {'text': 'Пост из замера загрузок',
+             'image': self.named(content, name)})
+        request._dont_enforce_csrf_checks = True
+        with override_settings(IMAGE_UPLOAD_HANDLERS=handlers):
+            tracemalloc.reset_peak()
+            baseline, _ = tracemalloc.get_traced_memory()
+            started = perf_counter()
+            try:
+                with transaction.atomic():
+                    response = self.handler.get_response(request)
+                    raise Rollback
+            except Rollback:
+                pass
+            elapsed = (perf_counter() - started) * 1000
+            _, peak = tracemalloc.get_traced_memory()
+        return response.status_code == 302, (peak - baseline) / 1024, elapsed
+
+    def named(self, content, name):
+        upload = BytesIO(content)
+        upload.name = name
+        return upload
+
+    def handle(self, *args, **options):
+        user = User.objects.first()
+        if user is None:
+            raise CommandError('Нет пользователей, сначала запустите '
+                               'seed_posts')
+        cases = [
+            (value, f'image-{value}.jpg',
+             make_image(self.parse_size(value), 'JPEG'))
+            for value in options['sizes'].split(',') if value
+        ]
+        if options['bomb']:
+            cases.append((
+                f'bomb {options["bomb"]}', 'bomb.png',
+                make_bomb(self.parse_size(options['bomb']))))
+
+        client = Client()
+        client.force_login(user)
+        self.factory = RequestFactory()
+        self.factory.cookies = client.cookies
+        self.handler = BaseHandler()
+        self.handler.load_middleware()
+        posts_before = Post.objects.count()
+
+        report = {}
+        tracemalloc.start()
+        try:
+            with tempfile.TemporaryDirectory() as media, \
+                    override_settings(MEDIA_ROOT=media), \
+                    warnings.catch_warnings():
+                warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+                for case, name, content in cases:
+                    for mode, handlers in (('django', DEFAULT_HANDLERS),
+                                           ('bounded', BOUNDED_HANDLERS)):
+                        runs = [self.measure(content, name, handlers)
+                                for _ in range(options['repeat'])]
+                        peaks = [peak for _, peak, _ in runs]
+                        timings = [elapsed for _, _, elapsed in runs]
+                        result = {
+                            'bytes': len(content),
+                            'accepted': runs[0][0],
+                            'peak_kb': round(max(peaks), 1),
+                        }
+                        for percent in PERCENTILES:
+                            result[f'p{percent}'] = round(
+                                percentile(timings, percent), 3)
+                        report[f'{case} {mode}'] = result
+                        self.stdout.write(
+                            f'{case} ({len(content) // 1024} КБ), {mode}: '
+                            f'{"принят" if result["accepted"] else "отклонён"}'
+                            f', пик памяти {result["peak_kb"]} КБ, '
+                            f'p50 {result["p50"]} мс')
+        finally:
+            tracemalloc.stop()
+        if Post.objects.count() != posts_before:
+            raise CommandError('Замер оставил посты в базе')
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, ensure_ascii=False, indent=2)
@@ -0,0 +1,86 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from posts.models import Follow, Post
+from posts.timeline import TimelinePaginator
+from posts.utils import CursorPaginator, get_comments_paginator, get_feed
+
+TEMP_SORT = 'USE TEMP B-TREE'
+
+
+class Command(BaseCommand):
+    help = ('Снимает EXPLAIN QUERY PLAN запросов каждой ленты: первой '
+            'страницы и страницы за курсором')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output',
+            help='JSON-файл, в который сохраняются планы запросов')
+
+    def get_paginators(self):
+        ''' Пагинаторы лент те же, что строят view, но без запроса,
+        шаблонов и кеша '''
+        post = Post.objects.select_related('author', 'group').filter(
+            group__isnull=False).first()
+        follow = Follow.objects.filter(user__isnull=False).select_related(
+            'user').first()
+        if post is None or follow is None:
+            raise CommandError(
+                'Нужны хотя бы один пост в группе и одна подписка')
+        per_page = settings.QUANTITY_POST
+        return {
+            'index': CursorPaginator(
+                get_feed(Post.objects.all()), per_page),
+            'group_posts': CursorPaginator(
+                get_feed(post.group.posts.all()), per_page),
+            'profile': CursorPaginator(
+                get_feed(post.author.posts.all()), per_page),
+            'post_detail': get_comments_paginator(
+                post.pk, settings.COMMENTS_PER_PAGE),
+            'follow_index': TimelinePaginator(follow.user, per_page),
+        }
+
+    def explain(self, sql, params):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def capture(self, paginator):
+        ''' SQL и параметры запросов первой и следующей страниц '''
+        queries = []
+
+        def collect(execute, sql, params, many, context):
+            queries.append((sql, params))
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(collect):
+            page = paginator.get_page()
+            if page.next_cursor:
+                paginator.get_page(after=page.next_cursor)
+        return queries
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('EXPLAIN QUERY PLAN есть только у SQLite')
+        report = {}
+        for name, paginator in self.get_paginators().items():
+            plans = [
+                {'sql': sql, 'plan': self.explain(sql, params)}
+                for sql, params in self.capture(paginator)
+                if sql.startswith('SELECT')
+            ]
+            report[name] = {'queries': plans}
+            sorts = sum(
+                TEMP_SORT in step for plan in plans for step in plan['plan'])
+            self.stdout.write(
+                f'{name}: запросов {len(plans)}, сортировок '
+                f'во временном B-дереве {sorts}')
+            for plan in plans:
+                for step in plan['plan']:
+                    self.stdout.write(f'    {step}')
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, ensure_ascii=False, indent=2)
@@ -0,0 +1,60 @@
+import os
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.export import EXPORTS, FORMATS, export_lines, last_exported_id
+
+
+class Command(BaseCommand):
+    help = ('Потоково выгружает посты, комментарии, подписки или группы '
+            'в NDJSON или CSV по возрастанию id')
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', choices=list(EXPORTS))
+        parser.add_argument(
+            '--format', dest='export_format', choices=list(FORMATS),
+            default='ndjson')
+        parser.add_argument(
+            '--output', help='Файл выгрузки, по умолчанию stdout')
+        parser.add_argument(
+            '--after', type=int, help='Выгружать строки с id больше этого')
+        parser.add_argument(
+            '--resume', action='store_true',
+            help='Продолжить --output после последней целой записи')
+        parser.add_argument('--chunk-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        name, export_format = options['name'], options['export_format']
+        path, after = options['output'], options['after']
+        length = 0
+        if options['resume']:
+            if not path:
+                raise CommandError('--resume работает только с --output')
+            if after is not None:
+                raise CommandError('--resume и --after несовместимы')
+            if os.path.exists(path):
+                after, length = last_exported_id(path, export_format)
+                # недописанная запись обрезается и выгружается заново
+                os.truncate(path, length)
+        # заголовок CSV пишется только в начало файла
+        header = export_format == 'csv' and length == 0 and after is None
+        lines = export_lines(
+            name, export_format, after, options['chunk_size'], header)
+
+        started = perf_counter()
+        count = 0
+        if path:
+            mode = 'a' if options['resume'] else 'w'
+            with open(path, mode, encoding='utf-8', newline='') as output:
+                for count, line in enumerate(lines, 1):
+                    output.write(line)
+        else:
+            for count, line in enumerate(lines, 1):
+                self.stdout.write(line, ending='')
+        if header:
+            count -= 1
+        elapsed = perf_counter() - started
+        self.stderr.write(
+            f'{name}: выгружено {count} строк после id {after} '
+            f'за {elapsed:.1f} с ({count / max(elapsed, 1e-9):.0f} строк/с)')
@@ -0,0 +1,413 @@
+import csv
+import io
+import json
+import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import islice
+from time import perf_counter
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+from django.db import reset_queries, transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+from django.utils._os import safe_join
+from django.utils.dateparse import parse_datetime
+
+from posts.cache import GLOBAL_SCOPE, bump_versions
+from posts.counters import change_many
+from posts.export import EXPORTS, FORMATS, csv_records
+from posts.images import acquire_images
+from posts.models import ImportCheckpoint, Post, User, UserCounter
+from posts.renditions import render_set
+from posts.storage import image_storage
+from posts.timeline import fan_out_posts
+from posts.uploads import check_image, read_header
+from posts.utils import bulk_batch_size
+
+from .seed_posts import keep_dates
+
+# даты из файла, которые при вставке не заменяются текущим временем
+DATE_FIELDS = {
+    'posts': ('pub_date',),
+    'comments': ('created', 'updated'),
+}
+# столько причин пропуска строк выводится, остальные только считаются
+SKIP_REPORTS = 10
+# как часто выводится скорость импорта, секунд
+REPORT_INTERVAL = 5
+
+
+class SkipRow(Exception):
+    pass
+
+
+def value(row, column):
+    ''' Значение колонки; пустая строка CSV и null - нет значения '''
+    result = row.get(column)
+    return None if result in ('', None) else result
+
+
+def parse_date(text):
+    if text is None:
+        return timezone.now()
+    date = parse_datetime(text)
+    if date is None:
+        raise SkipRow(f'дата {text!r} не в формате ISO 8601')
+    if timezone.is_naive(date):
+        date = timezone.make_aware(date)
+    return date
+
+
+def parse_int(text):
+    return None if text is None else int(text)
+
+
+def parse_bool(text, default=True):
+    if text is None:
+        return default
+    return text not in (False, 0, '0', 'False', 'false')
+
+
+def parse_csv(record):
+    return next(csv.reader(io.StringIO(record.decode(), newline='')))
+
+
+def parse_csv_row(columns, record):
+    return dict(zip(columns, parse_csv(record)))
+
+
+def parse_json_row(line):
+    row = json.loads(line)
+    if not isinstance(row, dict):
+        raise SkipRow('строка не объект JSON')
+    return row
+
+
+def read_records(path, import_format, position):
+    ''' Строки файла после байта position: разбор и позиция за строкой
+
+    Разбор - функция без аргументов, возвращающая строку словарём. Она
+    вызывается при загрузке пачки, поэтому битая строка пропускается,
+    а позиция всё равно уходит за неё. Недописанная последняя строка
+    не читается: её допишут, и повторный запуск начнёт с неё.
+    '''
+    with open(path, 'rb') as file:
+        if import_format == 'csv':
+            header = next(csv_records(file), None)
+            if header is None:
+                return
+            try:
+                columns = parse_csv(header)
+            except (ValueError, csv.Error) as error:
+                raise CommandError(f'Заголовок CSV не читается: {error}')
+            position = max(position, len(header))
+            file.seek(position)
+            for record in csv_records(file):
+                position += len(record)
+                yield partial(parse_csv_row, columns, record), position
+            return
+        file.seek(position)
+        for line in file:
+            if not line.endswith(b'\n'):
+                return
+            position += len(line)
+            if line.strip():
+                yield partial(parse_json_row, line), position
+
+
+class Command(BaseCommand):
+    help = ('Загружает посты, комментарии, группы или подписки из NDJSON '
+            'или CSV пачками bulk_create с продолжением после сбоя')
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', choices=list(EXPORTS))
+        parser.add_argument('path', help='Файл NDJSON или CSV')
+        parser.add_argument(
+            '--format', dest='import_format', choices=list(FORMATS),
+            help='Формат файла, по умолчанию - по расширению')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument(
+            '--images',
+            help='Каталог картинок: колонка image - путь в нём, файлы '
+                 'проверяются, сохраняются и получают версии. Без него '
+                 'image - имя уже сохранённой картинки')
+        parser.add_argument(
+            '--workers', type=int, default=4,
+            help='Потоки обработки картинок, 0 - без пула')
+        parser.add_argument(
+            '--from-start', action='store_true',
+            help='Начать файл сначала, не продолжая с сохранённой позиции')
+
+    def handle(self, *args, **options):
+        name, path = options['name'], options['path']
+        import_format = options['import_format'] or (
+            'csv' if path.lower().endswith('.csv') else 'ndjson')
+        if not os.path.isfile(path):
+            raise CommandError(f'Нет файла {path}')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size должно быть больше нуля')
+        self.model = EXPORTS[name]
+        self.images = options['images']
+        self.skipped = self.image_errors = 0
+        self.load_maps()
+
+        source = f'{name}:{os.path.abspath(path)}'
+        if options['from_start']:
+            ImportCheckpoint.objects.filter(source=source).delete()
+        checkpoint, _ = ImportCheckpoint.objects.get_or_create(source=source)
+        if checkpoint.position:
+            self.stdout.write(
+                f'Продолжение с байта {checkpoint.position}, '
+                f'уже загружено строк: {checkpoint.rows}')
+
+        records = read_records(path, import_format, checkpoint.position)
+        dates = [self.model._meta.get_field(field)
+                 for field in DATE_FIELDS.get(name, ())]
+        started = perf_counter()
+        workers = options['workers'] if self.images else 0
+        pool = ThreadPoolExecutor(max_workers=workers) if workers else None
+        self.map = pool.map if pool else map
+        try:
+            with keep_dates(*dates):
+                total = self.import_batches(
+                    name, records, checkpoint, options['batch_size'])
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        self.report(name, total, perf_counter() - started)
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово, пропущено строк: {self.skipped}, '
+            f'картинок с ошибками: {self.image_errors}'))
+
+    def import_batches(self, name, records, checkpoint, batch_size):
+        ''' Пачка за пачкой: разбор, проверки, вставка вместе с позицией '''
+        build = getattr(self, f'make_{name}')
+        started = reported = perf_counter()
+        total = 0
+        while True:
+            batch = list(islice(records, batch_size))
+            if not batch:
+                return total
+            objects = []
+            for parse, position in batch:
+                try:
+                    objects.append(build(parse()))
+                except (SkipRow, KeyError, ValueError, TypeError,
+                        csv.Error) as error:
+                    self.skip(error, position)
+            objects = self.prepare(name, objects)
+            checkpoint.position = batch[-1][1]
+            checkpoint.rows += len(objects)
+            with transaction.atomic():
+                # пачка и позиция за ней записываются вместе
+                self.insert(name, objects)
+                checkpoint.save()
+            # сигналы не срабатывали, кеш лент сбрасывается целиком
+            bump_versions(GLOBAL_SCOPE)
+            # при DEBUG журнал запросов держит SQL каждой вставки
+            reset_queries()
+            total += len(objects)
+            if perf_counter() - reported >= REPORT_INTERVAL:
+                reported = perf_counter()
+                self.report(name, total, reported - started)
+
+    def report(self, name, total, elapsed):
+        self.stdout.write(
+            f'{name}: {total} строк за {elapsed:.1f} с '
+            f'({total / max(elapsed, 1e-9):.0f} строк/с)')
+
+    def skip(self, error, position=None):
+        self.skipped += 1
+        if self.skipped > SKIP_REPORTS:
+            return
+        reason = (f'нет колонки {error}' if isinstance(error, KeyError)
+                  else error)
+        if position is not None:
+            reason = f'строка до байта {position}: {reason}'
+        self.stderr.write(f'Пропуск, {reason}')
+
+    def load_maps(self):
+        ''' Пользователи и группы в памяти вместо запроса на строку '''
+        self.users = dict(
+            User.objects.values_list('username', 'pk').iterator())
+        self.user_ids = set(self.users.values())
+        self.groups = dict(
+            EXPORTS['groups'].objects.values_list('slug', 'pk').iterator())
+        self.group_ids = set(self.groups.values())
+
+    def resolve(self, row, column, names, ids):
+        ''' id по колонке column_id или по имени в колонке column '''
+        pk = value(row, f'{column}_id')
+        if pk is not None:
+            if int(pk) not in ids:
+                raise SkipRow(f'{column}_id {pk} не найден')
+            return int(pk)
+        key = value(row, column)
+        if key is None:
+            return None
+        if key not in names:
+            raise SkipRow(f'{column} {key} не найден')
+        return names[key]
+
+    def make_posts(self, row):
+        author = self.resolve(row, 'author', self.users, self.user_ids)
+        if author is None:
+            raise SkipRow('нет автора')
+        return Post(
+            id=parse_int(value(row, 'id')),
+            text=row['text'],
+            author_id=author,
+            group_id=self.resolve(row, 'group', self.groups, self.group_ids),
+            pub_date=parse_date(value(row, 'pub_date')),
+            image=value(row, 'image') or '',
+        )
+
+    def make_comments(self, row):
+        author = self.resolve(row, 'author', self.users, self.user_ids)
+        post = value(row, 'post_id') or value(row, 'post')
+        if author is None or post is None:
+            raise SkipRow('нет автора или поста')
+        created = parse_date(value(row, 'created'))
+        updated = value(row, 'updated')
+        return EXPORTS['comments'](
+            id=parse_int(value(row, 'id')),
+            post_id=int(post),
+            author_id=author,
+            text=row['text'],
+            created=created,
+            updated=created if updated is None else parse_date(updated),
+            active=parse_bool(value(row, 'active')),
+        )
+
+    def make_groups(self, row):
+        slug = row['slug']
+        if slug in self.groups:
+            raise SkipRow(f'группа {slug} уже есть')
+        return EXPORTS['groups'](
+            id=parse_int(value(row, 'id')),
+            title=row['title'],
+            slug=slug,
+            description=value(row, 'description') or '',
+        )
+
+    def make_follows(self, row):
+        user = self.resolve(row, 'user', self.users, self.user_ids)
+        author = self.resolve(row, 'author', self.users, self.user_ids)
+        if user is None or author is None or user == author:
+            raise SkipRow('нужны разные подписчик и автор')
+        return EXPORTS['follows'](user_id=user, author_id=author)
+
+    def store_image(self, path):
+        ''' Стадия картинок: проверка, сохранение по хешу и версии
+
+        Выполняется в пуле потоков, ошибки возвращаются, а не
+        выбрасываются, чтобы пост загрузился без картинки.
+        '''
+        try:
+            full_path = safe_join(self.images, path)
+            with open(full_path, 'rb') as file:
+                info = read_header(file.read(settings.IMAGE_HEADER_BYTES))
+                if info is None:
+                    raise ValidationError('файл не распознан как картинка')
+                check_image(os.fstat(file.fileno()).st_size, *info)
+                file.seek(0)
+                name = image_storage.save(
+                    f'posts/{os.path.basename(full_path)}', File(file))
+            render_set(name)
+            return name, None
+        except Exception as error:
+            return None, f'{path}: {error}'
+
+    def store_images(self, posts):
+        paths = list({post.image.name for post in posts if post.image})
+        stored = dict(zip(paths, self.map(self.store_image, paths)))
+        for post in posts:
+            if not post.image:
+                continue
+            name, error = stored[post.image.name]
+            if error is not None:
+                self.image_errors += 1
+                if self.image_errors <= SKIP_REPORTS:
+                    self.stderr.write(f'Картинка {error}')
+            post.image = name or ''
+
+    def prepare(self, name, objects):
+        ''' Пачка без занятых id и slug, подписок-дублей и комментариев к
+        несуществующим постам; по запросу на проверку, а не на строку '''
+        if name == 'posts' and self.images:
+            self.store_images(objects)
+        ids = [obj.pk for obj in objects if obj.pk is not None]
+        taken = set(self.model.objects.filter(pk__in=ids).values_list(
+            'pk', flat=True)) if ids else set()
+        posts, existing = set(), set()
+        if name == 'comments':
+            posts = set(Post.objects.filter(
+                pk__in={obj.post_id for obj in objects}).values_list(
+                    'pk', flat=True))
+        elif name == 'follows':
+            existing = set(self.model.objects.filter(
+                user_id__in={obj.user_id for obj in objects},
+                author_id__in={obj.author_id for obj in objects},
+            ).values_list('user_id', 'author_id'))
+        kept = []
+        for obj in objects:
+            reason = self.rejection(name, obj, taken, posts, existing)
+            if reason is not None:
+                self.skip(SkipRow(reason))
+                continue
+            if obj.pk is not None:
+                taken.add(obj.pk)
+            if name == 'follows':
+                existing.add((obj.user_id, obj.author_id))
+            elif name == 'groups':
+                # slug занят строкой, которая будет вставлена
+                self.groups[obj.slug] = None
+            kept.append(obj)
+        return kept
+
+    def rejection(self, name, obj, taken, posts, existing):
+        ''' Причина не вставлять объект пачки или None '''
+        if obj.pk is not None and obj.pk in taken:
+            return f'id {obj.pk} уже занят'
+        if name == 'comments' and obj.post_id not in posts:
+            return f'нет поста {obj.post_id}'
+        if name == 'follows' and (obj.user_id, obj.author_id) in existing:
+            return 'подписка уже есть'
+        if name == 'groups' and obj.slug in self.groups:
+            return f'группа {obj.slug} уже есть'
+        return None
+
+    def insert(self, name, objects):
+        ''' bulk_create пачки и то, что сигналы сделали бы по строке
+
+        Счётчики сдвигаются на число строк пачки, а ленты получают только
+        новые посты или подписки - одним INSERT ... SELECT на пачку.
+        '''
+        if not objects:
+            return
+        # bulk_create в SQLite не возвращает id: новые строки - после last
+        last = self.model.objects.aggregate(last=Max('pk'))['last'] or 0
+        self.model.objects.bulk_create(
+            objects, batch_size=bulk_batch_size(self.model, len(objects)))
+        created = self.model.objects.filter(
+            Q(pk__gt=last)
+            | Q(pk__in=[obj.pk for obj in objects if obj.pk is not None]))
+        if name == 'posts':
+            change_many(UserCounter.objects, 'posts_count', Counter(
+                post.author_id for post in objects), key='user_id')
+            acquire_images(Counter(post.image.name for post in objects))
+            fan_out_posts(created)
+        elif name == 'comments':
+            change_many(Post.objects, 'comments_count', Counter(
+                comment.post_id for comment in objects if comment.active))
+        elif name == 'follows':
+            change_many(UserCounter.objects, 'followers_count', Counter(
+                obj.author_id for obj in objects), key='user_id')
+            change_many(UserCounter.objects, 'following_count', Counter(
+                obj.user_id for obj in objects), key='user_id')
+            fan_out_posts(Post.objects.all(), follows=created)
@@ -0,0 +1,32 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from posts.models import Post
+from posts.renditions import render
+
+
+class Command(BaseCommand):
+    help = 'Готовит миниатюры для уже загруженных картинок постов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=4,
+            help='Число потоков, генерирующих миниатюры, 0 - без пула')
+
+    def handle(self, *args, **options):
+        names = (
+            Post.objects.exclude(image='')
+            .order_by()
+            .values_list('image', flat=True)
+            .distinct()
+            .iterator()
+        )
+        if options['workers'] > 0:
+            with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+                results = list(pool.map(render, names))
+        else:
+            results = list(map(render, names))
+        self.stdout.write(self.style.SUCCESS(
+            f'Миниатюр готово: {sum(results)}, ошибок: '
+            f'{len(results) - sum(results)}'))
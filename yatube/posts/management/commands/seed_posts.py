@@ -0,0 +1,180 @@
+import random
+from contextlib import contextmanager
+from datetime import timedelta
+from itertools import accumulate, islice
+from time import perf_counter
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from faker import Faker
+
+from posts.counters import rebuild_counters
+from posts.models import Comment, Follow, Group, Post, User
+from posts.search import rebuild_search_index, uninstall_search
+from posts.timeline import rebuild_timelines
+from posts.utils import bulk_batch_size
+
+# тексты берутся из заранее сгенерированного набора: Faker на миллионах
+# строк заметно медленнее самой вставки
+TEXT_POOL = 1000
+PERIOD = timedelta(days=365)
+
+
+@contextmanager
+def keep_dates(*fields):
+    ''' Отключает auto_now/auto_now_add, чтобы сохранить заданные даты '''
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class Command(BaseCommand):
+    help = 'Заполняет базу синтетическими пользователями, постами и подписками'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--groups', type=int, default=100)
+        parser.add_argument('--posts', type=int, default=100000)
+        parser.add_argument('--comments', type=int, default=200000)
+        parser.add_argument(
+            '--follows', type=int, default=20,
+            help='Среднее число подписок одного пользователя')
+        parser.add_argument(
+            '--skew', type=float, default=1.1,
+            help='Показатель закона Ципфа для популярности авторов')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument(
+            '--password', default='yatube-seed',
+            help='Общий пароль созданных пользователей')
+
+    def insert(self, model, objects, batch_size):
+        started = perf_counter()
+        total = 0
+        objects = iter(objects)
+        while True:
+            batch = list(islice(objects, batch_size))
+            if not batch:
+                break
+            model.objects.bulk_create(
+                batch, batch_size=bulk_batch_size(model, batch_size))
+            total += len(batch)
+        self.stdout.write(
+            f'{model._meta.verbose_name_plural}: {total} '
+            f'за {perf_counter() - started:.1f} с')
+        return total
+
+    def random_date(self):
+        return self.now - self.random.random() * PERIOD
+
+    def make_users(self, count, password):
+        prefix = f'seed{self.now:%y%m%d%H%M%S}'
+        for i in range(count):
+            first_name, last_name = self.random.choice(self.names)
+            yield User(
+                username=f'{prefix}_{i}',
+                first_name=first_name,
+                last_name=last_name,
+                password=password,
+                date_joined=self.now,
+            )
+
+    def make_groups(self, count):
+        for i in range(count):
+            title = self.faker.catch_phrase()[:200]
+            yield Group(
+                title=title,
+                slug=f'seed-{self.now:%y%m%d%H%M%S}-{i}',
+                description=self.random.choice(self.texts),
+            )
+
+    def make_posts(self, count, users, groups):
+        for _ in range(count):
+            group = self.random.choice(groups) if (
+                groups and self.random.random() < 0.6) else None
+            yield Post(
+                text=self.random.choice(self.texts),
+                author_id=self.random.choice(users),
+                group_id=group,
+                pub_date=self.random_date(),
+            )
+
+    def make_comments(self, count, users, posts):
+        for _ in range(count):
+            created = self.random_date()
+            yield Comment(
+                post_id=self.random.choice(posts),
+                author_id=self.random.choice(users),
+                text=self.random.choice(self.texts)[:200],
+                created=created,
+                updated=created,
+            )
+
+    def make_follows(self, users, average, skew):
+        ''' Подписки с распределением Ципфа: немногие авторы популярны '''
+        authors = list(users)
+        self.random.shuffle(authors)
+        weights = list(accumulate(
+            1 / rank ** skew for rank in range(1, len(authors) + 1)))
+        for user in users:
+            count = self.random.randint(0, 2 * average)
+            chosen = set(self.random.choices(
+                authors, cum_weights=weights, k=count))
+            chosen.discard(user)
+            for author in chosen:
+                yield Follow(user_id=user, author_id=author)
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.faker = Faker('ru_RU')
+        self.faker.seed_instance(options['seed'])
+        self.now = timezone.now()
+        self.texts = [
+            self.faker.text(max_nb_chars=400) for _ in range(TEXT_POOL)]
+        self.names = [
+            (self.faker.first_name(), self.faker.last_name())
+            for _ in range(TEXT_POOL)]
+        batch_size = options['batch_size']
+        started = perf_counter()
+
+        # поисковый индекс быстрее построить целиком, чем вести триггерами
+        uninstall_search()
+        try:
+            password = make_password(options['password'])
+            self.insert(
+                User, self.make_users(options['users'], password), batch_size)
+            self.insert(
+                Group, self.make_groups(options['groups']), batch_size)
+            users = list(User.objects.values_list('pk', flat=True))
+            groups = list(Group.objects.values_list('pk', flat=True))
+            with keep_dates(Post._meta.get_field('pub_date')):
+                self.insert(
+                    Post, self.make_posts(options['posts'], users, groups),
+                    batch_size)
+            posts = list(Post.objects.values_list('pk', flat=True))
+            with keep_dates(Comment._meta.get_field('created'),
+                            Comment._meta.get_field('updated')):
+                self.insert(
+                    Comment,
+                    self.make_comments(options['comments'], users, posts),
+                    batch_size)
+            self.insert(
+                Follow,
+                self.make_follows(
+                    users, options['follows'], options['skew']),
+                batch_size)
+
+            self.stdout.write(f'Счётчиков исправлено: {rebuild_counters()}')
+            self.stdout.write(f'Записей в лентах: {rebuild_timelines()}')
+        finally:
+            # триггеры нужны базе и при ошибке заполнения
+            indexed = rebuild_search_index()
+        self.stdout.write(f'Постов в поиске: {indexed}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово за {perf_counter() - started:.1f} с'))
@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.db import migrations
+
+
+def drop_search(apps, schema_editor):
+    from posts.search import uninstall_search
+    uninstall_search(schema_editor.connection.alias)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('posts', '0011_feed_indexes'),
+    ]
+
+    # индекс и триггеры строит обработчик post_migrate после всех
+    # миграций: с триггерами SQLite не пересоздаёт таблицы в следующих
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, drop_search),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 2.2.16 on 2026-10-18 21:24
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.db.models.expressions
+from django.db.models import F
+
+
+def remove_self_follows(apps, schema_editor):
+    ''' Подписки на себя, которые запретит no_yourself_follow, вместе с
+    тем, что они принесли в ленты, счётчики и уведомления '''
+    Follow = apps.get_model('posts', 'Follow')
+    Notification = apps.get_model('posts', 'Notification')
+    Timeline = apps.get_model('posts', 'Timeline')
+    UserCounter = apps.get_model('posts', 'UserCounter')
+    self_follows = Follow.objects.filter(user=F('author'))
+    users = list(self_follows.values_list('user_id', flat=True))
+    self_follows.delete()
+    Timeline.objects.filter(user=F('author')).delete()
+    Notification.objects.filter(user=F('author')).delete()
+    for user_id in users:
+        UserCounter.objects.filter(user_id=user_id).update(
+            followers_count=F('followers_count') - 1,
+            following_count=F('following_count') - 1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0016_notifications'),
+    ]
+
+    # изменения модели Follow, не вынесенные в миграции до ленты подписок
+    operations = [
+        migrations.RunPython(remove_self_follows, migrations.RunPython.noop),
+        migrations.AlterModelOptions(
+            name='follow',
+            options={},
+        ),
+        migrations.AlterField(
+            model_name='follow',
+            name='author',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='following', to=settings.AUTH_USER_MODEL, verbose_name='Интересующий Вас автор'),
+        ),
+        migrations.AlterField(
+            model_name='follow',
+            name='user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='follower', to=settings.AUTH_USER_MODEL, verbose_name='Подписчик'),
+        ),
+        migrations.AddConstraint(
+            model_name='follow',
+            constraint=models.CheckConstraint(check=models.Q(_negated=True, user=django.db.models.expressions.F('author')), name='no_yourself_follow'),
+        ),
+    ]
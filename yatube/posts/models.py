@@ -2,6 +2,9 @@ from django.contrib.auth import get_user_model
 from django.db import models
 from django.conf import settings
 from django.db.models import Q, F
+from django.utils import timezone
+
+from .storage import image_storage
 
 User = get_user_model()
 
@@ -57,13 +60,30 @@ class Post(models.Model):
     image = models.ImageField(
         'Картинка',
         upload_to='posts/',
+        storage=image_storage,
         blank=True
     )
+    comments_count = models.PositiveIntegerField(
+        'Число комментариев',
+        default=0,
+        editable=False
+    )
 
     class Meta:
         ordering = ['-pub_date']
         verbose_name_plural = 'Посты'
         verbose_name = 'Пост'
+        indexes = [
+            models.Index(
+                fields=['-pub_date', '-id'],
+                name='post_feed_idx'),
+            models.Index(
+                fields=['group', '-pub_date', '-id'],
+                name='post_group_feed_idx'),
+            models.Index(
+                fields=['author', '-pub_date', '-id'],
+                name='post_author_feed_idx'),
+        ]
 
     def __str__(self):
         return self.text[:settings.NUMBER_LETTERS]
@@ -96,6 +116,11 @@ class Comment(models.Model):
         ordering = ['-created']
         verbose_name_plural = 'Коментарии'
         verbose_name = 'Коментарий'
+        indexes = [
+            models.Index(
+                fields=['post', 'active', '-created', '-id'],
+                name='comment_post_active_idx'),
+        ]
 
     def __str__(self):
         return self.text[:settings.NUMBER_LETTERS]
@@ -127,6 +152,234 @@ class Follow(models.Model):
                 check=~Q(user=F('author')),
                 name='no_yourself_follow')
         ]
+        indexes = [
+            models.Index(
+                fields=['user', 'author'],
+                name='follow_user_author_idx'),
+            models.Index(
+                fields=['author', 'user'],
+                name='follow_author_user_idx'),
+        ]
 
     def __str__(self):
         return f'{self.user} подписался на {self.author}'
+
+
+class Timeline(models.Model):
+    """Материализованная лента подписок пользователя."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+        verbose_name='Читатель')
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Пост')
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Автор')
+    pub_date = models.DateTimeField(
+        verbose_name='Дата публикации')
+
+    class Meta:
+        ordering = ['-pub_date']
+        verbose_name_plural = 'Ленты'
+        verbose_name = 'Запись ленты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'post'],
+                name='unique_timeline_post')
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-pub_date', '-post'],
+                name='timeline_user_feed_idx'),
+            models.Index(
+                fields=['user', 'author'],
+                name='timeline_user_author_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.post_id} в ленте {self.user_id}'
+
+
+class UserCounter(models.Model):
+    """Денормализованные счётчики пользователя."""
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='counter',
+        verbose_name='Пользователь')
+    posts_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Постов')
+    followers_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Подписчиков')
+    following_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Подписок')
+
+    class Meta:
+        verbose_name_plural = 'Счётчики'
+        verbose_name = 'Счётчик'
+
+    def __str__(self):
+        return f'Счётчики {self.user_id}'
+
+
+class StoredImage(models.Model):
+    """Число постов, ссылающихся на файл картинки."""
+    name = models.CharField(
+        max_length=100,
+        primary_key=True,
+        verbose_name='Файл')
+    refs = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Ссылок')
+
+    class Meta:
+        verbose_name_plural = 'Картинки'
+        verbose_name = 'Картинка'
+
+    def __str__(self):
+        return f'{self.name}: {self.refs}'
+
+
+class ImportCheckpoint(models.Model):
+    """Позиция в файле импорта после последней записанной пачки."""
+    source = models.CharField(
+        max_length=255,
+        primary_key=True,
+        verbose_name='Источник')
+    position = models.BigIntegerField(
+        default=0,
+        verbose_name='Байт')
+    rows = models.BigIntegerField(
+        default=0,
+        verbose_name='Строк')
+    updated = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Обновлён')
+
+    class Meta:
+        verbose_name_plural = 'Позиции импорта'
+        verbose_name = 'Позиция импорта'
+
+    def __str__(self):
+        return f'{self.source}: {self.position}'
+
+
+class Notification(models.Model):
+    """Сводка новых постов или комментариев автора для подписчика."""
+    POST = 'post'
+    COMMENT = 'comment'
+    KINDS = (
+        (POST, 'Новые посты'),
+        (COMMENT, 'Новые комментарии'),
+    )
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='notifications',
+        verbose_name='Получатель')
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Автор')
+    kind = models.CharField(
+        max_length=10,
+        choices=KINDS,
+        verbose_name='Вид')
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.SET_NULL,
+        related_name='+',
+        null=True,
+        blank=True,
+        verbose_name='Последний пост')
+    count = models.PositiveIntegerField(
+        default=1,
+        verbose_name='Событий')
+    read = models.BooleanField(
+        default=False,
+        verbose_name='Прочитано')
+    created = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Создано')
+    updated = models.DateTimeField(
+        default=timezone.now,
+        verbose_name='Последнее событие')
+
+    class Meta:
+        verbose_name_plural = 'Уведомления'
+        verbose_name = 'Уведомление'
+        ordering = ('-updated', '-id')
+        constraints = [
+            # непрочитанная сводка автора одна, новые события её дополняют
+            models.UniqueConstraint(
+                fields=['user', 'author', 'kind'],
+                condition=Q(read=False),
+                name='unique_unread_notification'),
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', 'read', '-updated'],
+                name='notification_user_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.user_id}: {self.kind} {self.author_id} x{self.count}'
+
+
+class Delivery(models.Model):
+    """События автора, которые ещё не разосланы подписчикам."""
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Автор')
+    kind = models.CharField(
+        max_length=10,
+        choices=Notification.KINDS,
+        verbose_name='Вид')
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.SET_NULL,
+        related_name='+',
+        null=True,
+        blank=True,
+        verbose_name='Последний пост')
+    count = models.PositiveIntegerField(
+        default=1,
+        verbose_name='Событий')
+    started = models.BooleanField(
+        default=False,
+        verbose_name='Рассылается')
+    after = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Разослано до подписчика')
+    created = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Создана')
+
+    class Meta:
+        verbose_name_plural = 'Рассылки уведомлений'
+        verbose_name = 'Рассылка уведомлений'
+        constraints = [
+            # события копятся в одной ещё не начатой рассылке автора
+            models.UniqueConstraint(
+                fields=['author', 'kind'],
+                condition=Q(started=False),
+                name='unique_pending_delivery'),
+        ]
+
+    def __str__(self):
+        return f'{self.kind} {self.author_id} x{self.count}'
@@ -0,0 +1,124 @@
+''' Уведомления подписчиков о новых постах и комментариях автора
+
+В запросе событие стоит одного UPDATE или INSERT строки Delivery -
+накопителя событий автора. Первое событие ставит в очередь рассылку
+через NOTIFICATION_DIGEST_WINDOW секунд, следующие до её начала только
+увеличивают счётчик накопителя: сто постов за окно дают одну сводку.
+
+Рассылка проходит подписчиков пачками по user_id. Пачка и курсор
+накопителя фиксируются одной транзакцией, поэтому повтор задачи после
+сбоя продолжает с первой неразосланной пачки. Непрочитанная сводка того
+же автора дополняется, а не дублируется, так что число непрочитанных
+меняется и сбрасывается в кеше только у получивших новую сводку.
+'''
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import (BooleanField, CharField, DateTimeField, F,
+                              IntegerField, Value)
+from django.utils import timezone
+
+from core.queue import task
+
+from .models import Delivery, Follow, Notification, UserCounter
+from .utils import insert_select
+
+
+def unread_key(user_id):
+    return f'notifications_unread:{user_id}'
+
+
+def unread_count(user):
+    ''' Число непрочитанных сводок пользователя, из кеша '''
+    if not user.is_authenticated:
+        return 0
+    key = unread_key(user.pk)
+    count = cache.get(key)
+    if count is None:
+        count = Notification.objects.filter(user=user, read=False).count()
+        cache.set(key, count, settings.NOTIFICATION_UNREAD_TIMEOUT)
+    return count
+
+
+def mark_read(user):
+    Notification.objects.filter(user=user, read=False).update(read=True)
+    cache.delete(unread_key(user.pk))
+
+
+def record_event(author_id, kind, post_id):
+    ''' Событие автора попадает в накопитель; первое ставит рассылку '''
+    if not UserCounter.objects.filter(
+            user_id=author_id, followers_count__gt=0).exists():
+        return
+    pending = Delivery.objects.filter(
+        author_id=author_id, kind=kind, started=False)
+    if pending.update(count=F('count') + 1, post_id=post_id):
+        return
+    try:
+        with transaction.atomic():
+            delivery = Delivery.objects.create(
+                author_id=author_id, kind=kind, post_id=post_id)
+    except IntegrityError:
+        # накопитель создал параллельный запрос
+        pending.update(count=F('count') + 1, post_id=post_id)
+        return
+    deliver_notifications.apply_async(
+        [delivery.pk], countdown=settings.NOTIFICATION_DIGEST_WINDOW)
+
+
+def deliver_batch(delivery, users):
+    ''' Сводки для пачки подписчиков users, отсортированных по id
+
+    Возвращает id тех, у кого появилась новая непрочитанная сводка.
+    Новые сводки вставляются одним INSERT ... SELECT из подписок:
+    у кого непрочитанная уже есть, тех пропускает уникальный индекс.
+    '''
+    followers = Follow.objects.filter(
+        author_id=delivery.author_id,
+        user_id__gte=users[0], user_id__lte=users[-1],
+    )
+    unread = Notification.objects.filter(
+        author_id=delivery.author_id, kind=delivery.kind, read=False,
+        user__in=followers.values('user_id'))
+    existing = set(unread.values_list('user_id', flat=True))
+    now = timezone.now()
+    unread.update(count=F('count') + delivery.count,
+                  post_id=delivery.post_id, updated=now)
+    fields = {
+        'author': Value(delivery.author_id, IntegerField()),
+        'kind': Value(delivery.kind, CharField()),
+        'post': Value(delivery.post_id, IntegerField()),
+        'count': Value(delivery.count, IntegerField()),
+        'read': Value(False, BooleanField()),
+        'created': Value(now, DateTimeField()),
+        'updated': Value(now, DateTimeField()),
+    }
+    insert_select(
+        Notification, ('user', *fields),
+        followers.order_by().values_list('user_id', *fields.values()))
+    return [user_id for user_id in users if user_id not in existing]
+
+
+@task
+def deliver_notifications(delivery_id):
+    ''' Рассылает накопленные события автора подписчикам пачками '''
+    with transaction.atomic():
+        # дальше события копятся в новом накопителе
+        Delivery.objects.filter(pk=delivery_id).update(started=True)
+        delivery = Delivery.objects.filter(pk=delivery_id).first()
+    if delivery is None:
+        return
+    followers = Follow.objects.filter(
+        author_id=delivery.author_id, user__isnull=False,
+    ).order_by('user_id').values_list('user_id', flat=True)
+    while True:
+        users = sorted(set(followers.filter(user_id__gt=delivery.after)[
+            :settings.NOTIFICATION_BATCH_SIZE]))
+        if not users:
+            break
+        with transaction.atomic():
+            created = deliver_batch(delivery, users)
+            delivery.after = users[-1]
+            delivery.save(update_fields=['after'])
+        cache.delete_many([unread_key(user_id) for user_id in created])
+    delivery.delete()
@@ -0,0 +1,187 @@
+import logging
+import os
+import posixpath
+import tempfile
+from io import BytesIO
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, connection, transaction
+from django.utils.functional import SimpleLazyObject
+from PIL import Image, ImageOps
+
+from core.queue import task
+
+from .cache import bump_versions, post_scopes
+from .models import Post
+from .storage import image_storage
+
+logger = logging.getLogger(__name__)
+
+RENDITION_DIR = 'renditions'
+# расширение версии -> формат Pillow и MIME-тип
+FORMATS = {
+    'webp': ('WEBP', 'image/webp'),
+    'jpeg': ('JPEG', 'image/jpeg'),
+    'png': ('PNG', 'image/png'),
+}
+
+
+def rendition_name(source, width, extension):
+    ''' Имя версии ширины width в формате extension
+
+    Выводится из имени исходной картинки, поэтому адреса версий строятся
+    без обращений к хранилищу и базе.
+    '''
+    return posixpath.join(RENDITION_DIR, source, f'{width}.{extension}')
+
+
+def pending_key(source):
+    return f'rendition_pending:{source}'
+
+
+def rendition_size(width):
+    return width, round(width / settings.POST_RENDITION_RATIO)
+
+
+def rendition_set(source):
+    return [
+        (width, extension, rendition_name(source, width, extension))
+        for width in settings.POST_RENDITION_WIDTHS
+        for extension in settings.POST_RENDITION_FORMATS
+    ]
+
+
+def save_rendition(name, frame, extension):
+    ''' Пишет версию через временный файл, чтобы её не отдали недописанной '''
+    image_format = FORMATS[extension][0]
+    if image_format == 'JPEG' and frame.mode != 'RGB':
+        frame = frame.convert('RGB')
+    output = BytesIO()
+    frame.save(output, image_format, quality=settings.POST_RENDITION_QUALITY)
+    path = default_storage.path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(descriptor, 'wb') as file:
+        file.write(output.getvalue())
+    os.chmod(temporary, 0o644)
+    os.replace(temporary, path)
+
+
+def render_set(source):
+    ''' Готовит недостающие версии source за одно декодирование '''
+    missing = [
+        (width, extension, name)
+        for width, extension, name in rendition_set(source)
+        if not default_storage.exists(name)
+    ]
+    if not missing:
+        return False
+    largest = rendition_size(max(width for width, _, _ in missing))
+    with image_storage.open(source) as file, Image.open(file) as image:
+        # JPEG сразу декодируется в уменьшенном масштабе, не меньше largest
+        image.draft('RGB', largest)
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert(
+                'RGBA' if 'transparency' in image.info else 'RGB')
+        for width in sorted({width for width, _, _ in missing}, reverse=True):
+            frame = ImageOps.fit(image, rendition_size(width), Image.LANCZOS)
+            for frame_width, extension, name in missing:
+                if frame_width == width:
+                    save_rendition(name, frame, extension)
+    return True
+
+
+def delete_set(source):
+    for _, _, name in rendition_set(source):
+        default_storage.delete(name)
+    try:
+        os.rmdir(default_storage.path(posixpath.join(RENDITION_DIR, source)))
+    except OSError:
+        pass
+
+
+def rendition_ready(name):
+    ''' Снимает отметку «готовится» и сбрасывает кеш лент с картинкой
+
+    Пока версии готовились, страницы показывали оригинал и могли попасть
+    в кеш фрагментов, поэтому их области получают новые версии.
+    '''
+    if cache.get(pending_key(name)) is None:
+        return
+    cache.delete(pending_key(name))
+    scopes = set()
+    for post in Post.objects.filter(image=name).only(
+            'pk', 'author_id', 'group_id'):
+        scopes.update(post_scopes(post))
+    if scopes:
+        bump_versions(*scopes)
+
+
+@task
+def prepare_renditions(name):
+    ''' Фоновая подготовка версий; ошибка уходит на повтор очереди '''
+    render_set(name)
+    rendition_ready(name)
+
+
+def render(name):
+    ''' Готовит набор версий картинки поста, ошибки только логируются
+
+    После ошибки отметка «готовится» остаётся до истечения, и страницы
+    показывают оригинал вместо версий, которых нет.
+    '''
+    try:
+        prepare_renditions(name)
+        return True
+    except Exception:
+        logger.exception('Не удалось подготовить версии %s', name)
+        return False
+    finally:
+        # внутри транзакции вызывающего соединение закрывать нельзя
+        if not connection.in_atomic_block:
+            close_old_connections()
+
+
+def start_rendition(name):
+    cache.set(pending_key(name), True, settings.RENDITION_PENDING_TIMEOUT)
+    prepare_renditions.delay(name)
+
+
+def schedule_rendition(image):
+    ''' Ставит генерацию версий в очередь после фиксации транзакции
+
+    До её окончания картинка отмечена в кеше как «готовится», и
+    страницы показывают оригинал, а не запускают генерацию через
+    views.rendition на каждую версию из srcset.
+    '''
+    if not image:
+        return
+    name = image.name
+    transaction.on_commit(lambda: start_rendition(name))
+
+
+def pending_renditions(posts):
+    ''' Картинки постов страницы, версии которых ещё готовятся
+
+    Отметки всех картинок читаются одним get_many, и только когда шаблон
+    впервые спросит о них: при попадании в кеш фрагмента обращения нет.
+    '''
+    def resolve():
+        names = {post.image.name for post in posts if post.image}
+        if not names:
+            return frozenset()
+        found = cache.get_many([pending_key(name) for name in names])
+        return frozenset(
+            name for name in names if pending_key(name) in found)
+    return SimpleLazyObject(resolve)
+
+
+def srcset(source, extension):
+    return ', '.join(
+        f'{default_storage.url(rendition_name(source, width, extension))} '
+        f'{width}w'
+        for width in settings.POST_RENDITION_WIDTHS
+    )
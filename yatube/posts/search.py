@@ -0,0 +1,190 @@
+import re
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+
+from .models import Post, User
+from .utils import CursorPaginator, get_feed
+
+SEARCH_TABLE = 'posts_post_search'
+# веса bm25 для колонок text, group_title, author_name: столбец rank
+# индекса считается с ними
+SEARCH_WEIGHTS = (1.0, 0.5, 0.5)
+WORD = re.compile(r'\w+')
+
+
+def search_sql():
+    ''' Таблица FTS5 и триггеры, синхронизирующие её с постами '''
+    user_table = User._meta.db_table
+    author_name = ("trim({0}first_name || ' ' || {0}last_name)"
+                   " || ' ' || {0}username")
+    insert = f'''
+        INSERT INTO {SEARCH_TABLE}(rowid, text, group_title, author_name)
+        SELECT new.id, new.text,
+               coalesce((SELECT title FROM posts_group
+                         WHERE id = new.group_id), ''),
+               (SELECT {author_name.format('')} FROM {user_table}
+                WHERE id = new.author_id);'''
+    return [
+        f'''CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(
+            text, group_title, author_name,
+            tokenize = 'unicode61 remove_diacritics 2');''',
+        f'''CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_insert
+            AFTER INSERT ON posts_post BEGIN {insert} END;''',
+        f'''CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_update
+            AFTER UPDATE OF text, group_id, author_id ON posts_post BEGIN
+            DELETE FROM {SEARCH_TABLE} WHERE rowid = old.id; {insert} END;''',
+        f'''CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_delete
+            AFTER DELETE ON posts_post BEGIN
+            DELETE FROM {SEARCH_TABLE} WHERE rowid = old.id; END;''',
+        f'''CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_group
+            AFTER UPDATE OF title ON posts_group BEGIN
+            UPDATE {SEARCH_TABLE} SET group_title = new.title
+            WHERE rowid IN (SELECT id FROM posts_post
+                            WHERE group_id = new.id); END;''',
+        f'''CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_author
+            AFTER UPDATE OF username, first_name, last_name
+            ON {user_table} BEGIN
+            UPDATE {SEARCH_TABLE}
+            SET author_name = {author_name.format('new.')}
+            WHERE rowid IN (SELECT id FROM posts_post
+                            WHERE author_id = new.id); END;''',
+    ]
+
+
+def install_search(using=DEFAULT_DB_ALIAS):
+    ''' Создаёт индекс и триггеры, если их нет (после пересоздания таблиц) '''
+    db = connections[using]
+    if db.vendor != 'sqlite':
+        return False
+    if Post._meta.db_table not in db.introspection.table_names():
+        return False
+    with db.cursor() as cursor:
+        for sql in search_sql():
+            cursor.execute(sql)
+        # настройку пишем только при изменении: FTS5 держит её в памяти
+        # соединения, и откат записи оставил бы там устаревшую
+        rank = f'bm25({", ".join(map(str, SEARCH_WEIGHTS))})'
+        cursor.execute(
+            f"SELECT v FROM {SEARCH_TABLE}_config WHERE k = 'rank'")
+        if cursor.fetchone() != (rank,):
+            cursor.execute(
+                f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rank) "
+                f"VALUES ('rank', %s)", [rank])
+    return True
+
+
+def drop_search_triggers(using=DEFAULT_DB_ALIAS):
+    ''' Удаляет триггеры, индекс остаётся
+
+    Триггеры на posts_group и auth_user ссылаются на posts_post, поэтому
+    с ними SQLite не может пересоздать таблицу постов в миграции.
+    '''
+    db = connections[using]
+    if db.vendor != 'sqlite':
+        return
+    with db.cursor() as cursor:
+        for suffix in ('insert', 'update', 'delete', 'group', 'author'):
+            cursor.execute(f'DROP TRIGGER IF EXISTS {SEARCH_TABLE}_{suffix}')
+
+
+def uninstall_search(using=DEFAULT_DB_ALIAS):
+    db = connections[using]
+    if db.vendor != 'sqlite':
+        return
+    drop_search_triggers(using)
+    with db.cursor() as cursor:
+        cursor.execute(f'DROP TABLE IF EXISTS {SEARCH_TABLE}')
+
+
+def rebuild_search_index(using=DEFAULT_DB_ALIAS):
+    ''' Заново заполняет поисковый индекс, возвращает число постов '''
+    if not install_search(using):
+        return 0
+    user_table = User._meta.db_table
+    with connections[using].cursor() as cursor:
+        cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+        cursor.execute(f'''
+            INSERT INTO {SEARCH_TABLE}(rowid, text, group_title, author_name)
+            SELECT p.id, p.text, coalesce(g.title, ''),
+                   trim(u.first_name || ' ' || u.last_name)
+                   || ' ' || u.username
+            FROM posts_post p
+            JOIN {user_table} u ON u.id = p.author_id
+            LEFT JOIN posts_group g ON g.id = p.group_id''')
+        indexed = cursor.rowcount
+        cursor.execute(
+            f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('optimize')")
+    return indexed
+
+
+def match_query(query):
+    ''' Запрос пользователя в безопасный синтаксис MATCH: слова через И '''
+    return ' '.join(f'"{word}"' for word in WORD.findall(query))
+
+
+class SearchPaginator(CursorPaginator):
+    ''' Пагинация результатов поиска по ключу (rank, id)
+
+    Строки выбираются по встроенному столбцу rank с ORDER BY rank: FTS5
+    сортирует совпадения сам, без временного B-дерева. Порядок строк с
+    равным rank FTS5 не задаёт, поэтому они упорядочиваются по id здесь.
+    '''
+
+    def __init__(self, query, per_page):
+        super().__init__(Post.objects.none(), per_page, field='search_score')
+        self.query = match_query(query)
+
+    def dump_value(self, value):
+        return repr(value)
+
+    def load_value(self, value):
+        return float(value)
+
+    def ranked(self, cursor_key, backward, limit):
+        ''' Не больше limit пар (id, rank) за курсором в порядке выдачи '''
+        sql = [f'SELECT rowid, rank FROM {SEARCH_TABLE} '
+               f'WHERE {SEARCH_TABLE} MATCH %s']
+        params = [self.query]
+        lookup, order = ('<', 'DESC') if backward else ('>', 'ASC')
+        if cursor_key:
+            sql.append(f'AND (rank {lookup} %s OR '
+                       f'(rank = %s AND rowid {lookup} %s))')
+            value, pk = cursor_key
+            params += [value, value, pk]
+        sql.append(f'ORDER BY rank {order}')
+        with connection.cursor() as cursor:
+            cursor.execute(' '.join(sql), params)
+            rows = cursor.fetchmany(limit)
+            # FTS5 сортирует все совпадения сразу, так что строки с тем же
+            # rank, что у последней, дочитываются из того же запроса
+            while len(rows) >= limit:
+                more = cursor.fetchmany(limit)
+                tied = [row for row in more if row[1] == rows[limit - 1][1]]
+                rows += tied
+                if not more or len(tied) < len(more):
+                    break
+        rows.sort(key=lambda row: (row[1], row[0]), reverse=backward)
+        return rows[:limit]
+
+    def get_rows(self, cursor_key, backward):
+        if not self.query:
+            return []
+        scores = self.ranked(cursor_key, backward, self.per_page + 1)
+        posts = get_feed(Post.objects.all()).in_bulk(
+            [pk for pk, _ in scores])
+        rows = []
+        for pk, value in scores:
+            if pk in posts:
+                posts[pk].search_score = value
+                rows.append(posts[pk])
+        return rows
+
+
+def get_search_page(query, request):
+    ''' Страница результатов полнотекстового поиска '''
+    paginator = SearchPaginator(query, settings.QUANTITY_POST)
+    return paginator.get_page(
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+    )
@@ -0,0 +1,177 @@
+from django.db import connections, transaction
+from django.db.migrations.recorder import MigrationRecorder
+from django.db.models.signals import (post_delete, post_migrate, post_save,
+                                      pre_migrate, pre_save)
+from django.dispatch import receiver
+
+from .cache import GLOBAL_SCOPE, bump_versions, post_scopes
+from .counters import change_comments_count, change_counters
+from .images import acquire_image, release_image
+from .models import (Comment, Follow, Group, Notification, Post, User,
+                     UserCounter)
+from .notifications import record_event
+from .renditions import schedule_rendition
+from .search import (drop_search_triggers, install_search,
+                     rebuild_search_index)
+from .timeline import (add_author, fan_out_post, follower_removed,
+                       remove_author)
+
+# миграция, после которой в базе есть поисковый индекс
+SEARCH_MIGRATION = ('posts', '0012_post_search')
+
+
+@receiver(post_save, sender=User)
+def user_created(sender, instance, created, **kwargs):
+    if created:
+        UserCounter.objects.get_or_create(user=instance)
+
+
+@receiver(post_save, sender=Post)
+def post_created(sender, instance, created, **kwargs):
+    ''' Новый пост попадает в ленты и уведомления подписчиков '''
+    if created:
+        change_counters(instance.author_id, posts_count=1)
+        fan_out_post(instance)
+        record_event(instance.author_id, Notification.POST, instance.pk)
+
+
+@receiver(post_save, sender=Post)
+def post_image_saved(sender, instance, **kwargs):
+    ''' Версии новой картинки готовятся заранее, а не при первом показе
+
+    Ссылка на прежнюю картинку снимается, так что файл, на который
+    больше не ссылается ни один пост, удаляется вместе с версиями.
+    '''
+    saved_image = getattr(instance, '_saved_image', '')
+    if instance.image.name != saved_image:
+        acquire_image(instance.image.name)
+        release_image(saved_image)
+        instance._saved_image = instance.image.name
+        schedule_rendition(instance.image)
+
+
+@receiver(pre_save, sender=Post)
+def post_moved(sender, instance, **kwargs):
+    ''' Смена группы, автора или картинки существующего поста '''
+    instance._saved_image = ''
+    if instance.pk is None:
+        return
+    old = Post.objects.filter(pk=instance.pk).values(
+        'group_id', 'author_id', 'image').first()
+    if old is None:
+        return
+    instance._saved_image = old['image']
+    if old['group_id'] and old['group_id'] != instance.group_id:
+        bump_versions(f'group:{old["group_id"]}')
+    if old['author_id'] != instance.author_id:
+        change_counters(old['author_id'], posts_count=-1)
+        change_counters(instance.author_id, posts_count=1)
+        bump_versions(f'profile:{old["author_id"]}')
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    change_counters(instance.author_id, posts_count=-1)
+    release_image(instance.image.name)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def post_changed(sender, instance, **kwargs):
+    bump_versions(*post_scopes(instance))
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def group_changed(sender, instance, **kwargs):
+    ''' Название группы выводится во всех лентах '''
+    bump_versions(GLOBAL_SCOPE)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def comment_changed(sender, instance, **kwargs):
+    bump_versions(f'post:{instance.post_id}')
+
+
+@receiver(post_save, sender=Comment)
+def comment_created(sender, instance, created, **kwargs):
+    if created and instance.active:
+        record_event(
+            instance.author_id, Notification.COMMENT, instance.post_id)
+
+
+@receiver(pre_save, sender=Comment)
+def comment_saving(sender, instance, **kwargs):
+    ''' Запоминает пост и активность комментария до сохранения '''
+    instance._saved_state = None
+    if instance.pk is not None:
+        instance._saved_state = Comment.objects.filter(
+            pk=instance.pk).values_list('post_id', 'active').first()
+
+
+@receiver(post_save, sender=Comment)
+def comment_counted(sender, instance, **kwargs):
+    ''' Счётчик комментариев поста учитывает только активные
+
+    Сдвигается после удачного сохранения: упавший save счётчик не
+    меняет, а перенос комментария переносит и его учёт.
+    '''
+    saved = getattr(instance, '_saved_state', None) or (None, False)
+    current = (instance.post_id, instance.active)
+    if saved == current:
+        return
+    with transaction.atomic():
+        if saved[1]:
+            change_comments_count(saved[0], -1)
+        if current[1]:
+            change_comments_count(current[0], 1)
+    instance._saved_state = current
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    if instance.active:
+        change_comments_count(instance.post_id, -1)
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, **kwargs):
+    if created:
+        change_counters(instance.author_id, followers_count=1)
+        change_counters(instance.user_id, following_count=1)
+    if created and instance.user_id and instance.author_id:
+        add_author(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    change_counters(instance.author_id, followers_count=-1)
+    change_counters(instance.user_id, following_count=-1)
+    if instance.user_id and instance.author_id:
+        remove_author(instance.user_id, instance.author_id)
+        follower_removed(instance.author_id)
+
+
+@receiver(pre_migrate)
+def search_uninstalled(sender, using, **kwargs):
+    ''' Миграции идут без триггеров поиска: с ними SQLite не пересоздаёт
+    таблицы постов, групп и пользователей '''
+    if sender.name == 'posts':
+        drop_search_triggers(using)
+
+
+@receiver(post_migrate)
+def search_installed(sender, using, plan=None, **kwargs):
+    ''' После миграций триггеры ставятся заново
+
+    Изменения постов за время миграций триггеры не видели, поэтому
+    после применённых миграций индекс перестраивается целиком.
+    '''
+    if sender.name != 'posts' or SEARCH_MIGRATION not in MigrationRecorder(
+            connections[using]).applied_migrations():
+        return
+    if plan:
+        rebuild_search_index(using)
+    else:
+        install_search(using)
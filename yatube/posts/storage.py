@@ -0,0 +1,65 @@
+import hashlib
+import os
+import posixpath
+import tempfile
+
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    ''' Файлы под SHA-256 содержимого: posts/ab/cd/<digest>.jpg
+
+    Одинаковые загрузки получают одно имя, поэтому файл и его миниатюры
+    хранятся и генерируются один раз, а лишние копии не пишутся.
+    '''
+
+    def get_available_name(self, name, max_length=None):
+        # итоговое имя зависит от содержимого и выбирается в _save
+        return name
+
+    def digest_name(self, name, digest):
+        directory, filename = posixpath.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        return posixpath.join(
+            directory, digest[:2], digest[2:4], digest + extension)
+
+    def _save(self, name, content):
+        if hasattr(content, 'temporary_file_path'):
+            # загрузка уже на диске: хеш посчитан при приёме или считается
+            # здесь, а файл переносится без копии
+            source = content.temporary_file_path()
+            digest = getattr(content, 'content_digest', None)
+            if digest is None:
+                digest = hashlib.sha256()
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                digest = digest.hexdigest()
+        else:
+            os.makedirs(self.location, exist_ok=True)
+            descriptor, source = tempfile.mkstemp(
+                dir=self.location, suffix='.upload')
+            digest = hashlib.sha256()
+            with os.fdopen(descriptor, 'wb') as temporary:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    temporary.write(chunk)
+            digest = digest.hexdigest()
+        name = self.digest_name(name, digest)
+        path = self.path(name)
+        try:
+            if os.path.exists(path):
+                return name
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            file_move_safe(source, path)
+            os.chmod(path, self.file_permissions_mode or 0o644)
+        finally:
+            if not hasattr(content, 'temporary_file_path') and (
+                    os.path.exists(source)):
+                os.remove(source)
+        return name
+
+
+image_storage = ContentAddressedStorage()
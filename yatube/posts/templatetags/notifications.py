@@ -0,0 +1,11 @@
+from django import template
+
+from ..notifications import unread_count
+
+register = template.Library()
+
+
+@register.simple_tag
+def unread_notifications(user):
+    ''' Число непрочитанных сводок для шапки, из кеша '''
+    return unread_count(user)
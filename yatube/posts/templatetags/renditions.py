@@ -0,0 +1,41 @@
+from django import template
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.utils.html import format_html, format_html_join
+
+from posts.renditions import (FORMATS, rendition_name, rendition_size,
+                              srcset)
+
+register = template.Library()
+
+
+@register.simple_tag
+def picture(image, sizes=None, css_class='card-img-top', pending=()):
+    ''' <picture> с srcset по набору версий картинки поста
+
+    Адреса выводятся из имени файла, так что тег не обращается ни к
+    хранилищу, ни к базе. Для картинок из pending, версии которых ещё
+    готовятся (см. pending_renditions), выводится оригинал.
+    '''
+    if not image:
+        return ''
+    width, height = rendition_size(settings.POST_RENDITION_DEFAULT_WIDTH)
+    if image.name in pending:
+        return format_html(
+            '<img class="{}" src="{}" width="{}" height="{}" '
+            'style="object-fit: cover" loading="lazy" alt="">',
+            css_class, image.url, width, height)
+    sizes = sizes or settings.POST_RENDITION_SIZES
+    # последний формат понимают все браузеры, он идёт в <img>
+    *extensions, fallback = settings.POST_RENDITION_FORMATS
+    sources = format_html_join(
+        '', '<source type="{}" srcset="{}" sizes="{}">',
+        ((FORMATS[extension][1], srcset(image.name, extension), sizes)
+         for extension in extensions))
+    return format_html(
+        '<picture>{}<img class="{}" src="{}" srcset="{}" sizes="{}" '
+        'width="{}" height="{}" loading="lazy" alt=""></picture>',
+        sources, css_class,
+        default_storage.url(rendition_name(
+            image.name, settings.POST_RENDITION_DEFAULT_WIDTH, fallback)),
+        srcset(image.name, fallback), sizes, width, height)
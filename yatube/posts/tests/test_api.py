@@ -0,0 +1,133 @@
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from ..api import POST_FIELDS
+from ..models import Comment, Follow, Group, Post, User
+
+POSTS_COUNT = 15
+
+
+@override_settings(QUANTITY_POST=10)
+class ApiTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = User.objects.create_user(username='reader')
+        cls.author = User.objects.create_user(
+            username='author', first_name='Имя', last_name='Фамилия')
+        cls.group = Group.objects.create(
+            title='Группа', slug='group', description='-')
+        cls.posts = [
+            Post.objects.create(
+                text=f'Пост {i}', author=cls.author,
+                group=None if i % 2 else cls.group)
+            for i in range(POSTS_COUNT)
+        ]
+        Comment.objects.create(
+            post=cls.posts[-1], author=cls.reader, text='Комментарий')
+        Follow.objects.create(user=cls.reader, author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+
+    def get(self, name, *args, **params):
+        response = self.client.get(reverse(f'api:{name}', args=args), params)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        return response, response.json()
+
+    def test_feeds_paginate_by_cursor(self):
+        """Ленты листаются курсором от новых постов к старым"""
+        newest = [post.pk for post in reversed(self.posts)]
+        for name, args, expected in (
+            ('index', (), newest),
+            ('profile', (self.author.username,), newest),
+            ('group_list', (self.group.slug,),
+             [post.pk for post in reversed(self.posts) if post.group_id]),
+        ):
+            with self.subTest(name=name):
+                _, first = self.get(name, *args, fields='id', limit=5)
+                self.assertIsNone(first['previous_cursor'])
+                ids, page = [], first
+                while True:
+                    ids += [post['id'] for post in page['results']]
+                    if page['next_cursor'] is None:
+                        break
+                    _, page = self.get(name, *args, fields='id', limit=5,
+                                       after=page['next_cursor'])
+                self.assertEqual(ids, expected)
+
+    def test_post_serialization(self):
+        """Пост по умолчанию отдаётся со всеми полями"""
+        post = self.posts[-1]
+        _, data = self.get('post_detail', post.pk)
+        self.assertEqual(list(data), list(POST_FIELDS))
+        self.assertEqual(data['text'], post.text)
+        self.assertEqual(data['author'],
+                         {'username': 'author', 'name': 'Имя Фамилия'})
+        self.assertEqual(data['group'], {'slug': 'group', 'title': 'Группа'})
+        self.assertEqual(data['comments_count'], 1)
+        self.assertIsNone(data['image'])
+
+    def test_fields_limit_columns(self):
+        """fields сужает ответ и выборку колонок"""
+        with CaptureQueriesContext(connection) as captured:
+            _, data = self.get('index', fields='id,group')
+        self.assertEqual(set(data['results'][0]), {'id', 'group'})
+        sql = next(query['sql'] for query in captured.captured_queries
+                   if 'posts_post' in query['sql'])
+        self.assertIn('posts_group', sql)
+        self.assertNotIn('"posts_post"."text"', sql)
+        self.assertNotIn('auth_user', sql)
+        response, data = self.get('index', fields='id,password')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('password', data['error'])
+
+    def test_feed_query_budget(self):
+        """Страница ленты - один запрос при любом числе постов"""
+        with self.assertNumQueries(1):
+            self.get('index')
+
+    def test_follow_feed(self):
+        """Лента подписок доступна только авторизованному"""
+        response, _ = self.get('follow_index')
+        self.assertEqual(response.status_code, 401)
+        self.client.force_login(self.reader)
+        _, data = self.get('follow_index', fields='id', limit=5)
+        self.assertEqual([post['id'] for post in data['results']],
+                         [post.pk for post in self.posts[:-6:-1]])
+        self.assertIsNotNone(data['next_cursor'])
+
+    def test_batch(self):
+        """Пакет постов в порядке ids, отсутствующие перечислены"""
+        ids = [self.posts[3].pk, self.posts[0].pk, 0, self.posts[3].pk]
+        with self.assertNumQueries(1):
+            _, data = self.get(
+                'posts_batch', ids=','.join(map(str, ids)), fields='id,text')
+        self.assertEqual(data['results'], [
+            {'id': self.posts[3].pk, 'text': 'Пост 3'},
+            {'id': self.posts[0].pk, 'text': 'Пост 0'},
+        ])
+        self.assertEqual(data['missing'], [0])
+        with override_settings(API_BATCH_LIMIT=2):
+            response, _ = self.get('posts_batch', ids='1,2,3')
+        self.assertEqual(response.status_code, 400)
+        response, _ = self.get('posts_batch', ids='1,x')
+        self.assertEqual(response.status_code, 400)
+
+    def test_comments_and_not_found(self):
+        """Комментарии поста и 404 в формате JSON"""
+        _, data = self.get('comments', self.posts[-1].pk)
+        self.assertEqual([comment['text'] for comment in data['results']],
+                         ['Комментарий'])
+        for name, args in (('post_detail', (0,)), ('comments', (0,)),
+                           ('group_list', ('missing',)),
+                           ('profile', ('missing',))):
+            with self.subTest(name=name):
+                response, data = self.get(name, *args)
+                self.assertEqual(response.status_code, 404)
+                self.assertIn('error', data)
+        response = self.client.post(reverse('api:index'))
+        self.assertEqual(response.status_code, 405)
@@ -0,0 +1,152 @@
+import json
+import os
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.contrib.sessions.models import Session
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F
+from django.test import TestCase
+
+from core.models import Task
+
+from ..counters import rebuild_counters
+from ..management.commands.benchmark_concurrency import Command
+from ..models import Comment, Follow, Group, Post, Timeline, User
+from ..search import SEARCH_TABLE
+
+
+class SeedBenchmarkTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        call_command(
+            'seed_posts', users=30, groups=3, posts=60, comments=40,
+            follows=4, batch_size=25, seed=1, stdout=StringIO())
+
+    def test_seed_creates_data(self):
+        """seed_posts создаёт заданное число объектов с разными датами"""
+        self.assertEqual(User.objects.count(), 30)
+        self.assertEqual(Group.objects.count(), 3)
+        self.assertEqual(Post.objects.count(), 60)
+        self.assertEqual(Comment.objects.count(), 40)
+        self.assertTrue(Follow.objects.exists())
+        self.assertFalse(Follow.objects.filter(user=F('author')).exists())
+        self.assertGreater(
+            Post.objects.values('pub_date').distinct().count(), 1)
+
+    def test_seed_rebuilds_derived_data(self):
+        """После seed_posts счётчики, ленты и поиск согласованы"""
+        self.assertEqual(rebuild_counters(), 0)
+        expected = sum(
+            Post.objects.filter(author_id=author).count()
+            for author in Follow.objects.values_list('author', flat=True))
+        self.assertEqual(Timeline.objects.count(), expected)
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT count(*) FROM {SEARCH_TABLE}')
+            self.assertEqual(cursor.fetchone()[0], 60)
+
+    def test_seed_failure_keeps_search(self):
+        """Упавший seed_posts возвращает поисковые триггеры"""
+        with mock.patch('posts.management.commands.seed_posts.'
+                        'rebuild_counters', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                call_command('seed_posts', users=2, groups=1, posts=1,
+                             comments=0, follows=0, stdout=StringIO())
+        post = Post.objects.create(
+            text='неповторимое', author=User.objects.first())
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {SEARCH_TABLE} '
+                f'WHERE {SEARCH_TABLE} MATCH %s', ['неповторимое'])
+            self.assertEqual(cursor.fetchall(), [(post.pk,)])
+
+    def test_benchmark_report_and_baseline(self):
+        """benchmark_posts замеряет все адреса и сравнивает с базовым"""
+        follows = Follow.objects.count()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'baseline.json')
+            call_command(
+                'benchmark_posts', requests=3, warmup=1, output=path,
+                stdout=StringIO())
+            with open(path) as baseline:
+                report = json.load(baseline)['urls']
+            out, err = StringIO(), StringIO()
+            call_command(
+                'benchmark_posts', requests=3, warmup=0, baseline=path,
+                stdout=out, stderr=err)
+        self.assertIn('index', report)
+        self.assertEqual(report['profile_unfollow']['status'], 302)
+        for result in report.values():
+            self.assertLessEqual(result['p50'], result['p99'])
+            self.assertGreaterEqual(result['queries'], 0)
+        self.assertIn('p95', out.getvalue())
+        self.assertEqual(err.getvalue(), '')
+        self.assertNotIn('export', report)
+        self.assertEqual(Follow.objects.count(), follows)
+
+    def test_concurrency_benchmark_report(self):
+        """benchmark_concurrency отчитывается о смешанной нагрузке и
+        удаляет только созданные ею строки"""
+        def tables():
+            return [model.objects.count()
+                    for model in (Post, Comment, Follow, Task, Session)]
+
+        counts = tables()
+        logins = dict(User.objects.values_list('pk', 'last_login'))
+        run = Command.run
+
+        def run_with_site_write(command, options):
+            # запись сайта из другого процесса: без сигналов этого процесса
+            Task.objects.bulk_create([Task(name='site.task', arguments='[]')])
+            return run(command, options)
+
+        with tempfile.TemporaryDirectory() as directory, mock.patch.object(
+                Command, 'run', run_with_site_write):
+            path = os.path.join(directory, 'concurrency.json')
+            call_command(
+                'benchmark_concurrency', threads=0, duration=0.3, seed=1,
+                write_ratio=0.5, output=path, stdout=StringIO(),
+                stderr=StringIO())
+            with open(path) as output:
+                report = json.load(output)
+        self.assertEqual(report['errors'], 0)
+        self.assertGreater(report['throughput'], 0)
+        self.assertTrue(report['operations'])
+        self.assertTrue(Task.objects.filter(name='site.task').exists())
+        Task.objects.filter(name='site.task').delete()
+        self.assertEqual(tables(), counts)
+        self.assertEqual(
+            dict(User.objects.values_list('pk', 'last_login')), logins)
+
+    def test_uploads_benchmark_report(self):
+        """benchmark_uploads сравнивает обработчики и не оставляет постов"""
+        posts = Post.objects.count()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'uploads.json')
+            call_command(
+                'benchmark_uploads', sizes='64x48', bomb='6000x5000',
+                repeat=1, output=path, stdout=StringIO())
+            with open(path) as output:
+                report = json.load(output)
+        self.assertTrue(report['64x48 django']['accepted'])
+        self.assertTrue(report['64x48 bounded']['accepted'])
+        self.assertFalse(report['bomb 6000x5000 bounded']['accepted'])
+        self.assertEqual(Post.objects.count(), posts)
+
+    def test_notifications_benchmark_report(self):
+        """benchmark_notifications собирает посты окна в одну сводку"""
+        posts = Post.objects.count()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'notifications.json')
+            call_command(
+                'benchmark_notifications', followers=7, posts=3,
+                output=path, stdout=StringIO())
+            with open(path) as output:
+                report = json.load(output)
+        self.assertEqual(report['followers'], 7)
+        self.assertEqual(report['deliveries'], 1)
+        self.assertEqual(report['digest_counts'], [3])
+        self.assertEqual(Post.objects.count(), posts)
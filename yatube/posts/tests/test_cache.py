@@ -1,6 +1,11 @@
+from http import HTTPStatus
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.cache import cache
+from django.db import connection
 from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 from ..models import Group, Post
@@ -32,13 +37,126 @@ class PaginatorViewsTest(TestCase):
         post = Post.objects.create(
             text='Пост под кеш',
             author=self.author)
-        content_add = self.authorized_client.get(
-            reverse('posts:index')).content
-        post.delete()
-        content_delete = self.authorized_client.get(
-            reverse('posts:index')).content
-        self.assertEqual(content_add, content_delete)
+        content_add = self.authorized_client.get(URL_INDEX).content
+        Post.objects.filter(pk=post.pk).update(text='Без сигналов')
+        content_cached = self.authorized_client.get(URL_INDEX).content
+        self.assertEqual(content_add, content_cached)
         cache.clear()
-        content_cache_clear = self.authorized_client.get(
-            reverse('posts:index')).content
+        content_cache_clear = self.authorized_client.get(URL_INDEX).content
         self.assertNotEqual(content_add, content_cache_clear)
+
+    def test_cache_invalidated_on_write(self):
+        """Запись поста сразу обновляет закешированные ленты"""
+        urls = (
+            URL_INDEX,
+            reverse('posts:group_list', args=[self.group.slug]),
+            reverse('posts:profile', args=[self.author.username]),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                content_before = self.authorized_client.get(url).content
+                post = Post.objects.create(
+                    text=f'Новый пост {url}',
+                    group=self.group,
+                    author=self.author)
+                content_add = self.authorized_client.get(url).content
+                self.assertNotEqual(content_before, content_add)
+                self.assertIn(post.text.encode(), content_add)
+                post.delete()
+                content_delete = self.authorized_client.get(url).content
+                self.assertNotIn(post.text.encode(), content_delete)
+
+    def test_cache_key_includes_cursor(self):
+        """Разные страницы ленты кешируются отдельно"""
+        for i in range(settings.QUANTITY_POST):
+            Post.objects.create(text=f'Пост #{i}', author=self.author)
+        first_page = self.authorized_client.get(URL_INDEX)
+        second_page = self.authorized_client.get(
+            URL_INDEX + '?after=' + first_page.context['page_obj'].next_cursor)
+        self.assertIn(self.post.text.encode(), second_page.content)
+        self.assertNotIn(self.post.text.encode(), first_page.content)
+
+    def test_cached_fragment_skips_feed_query(self):
+        """Лента из кеша фрагмента не читает посты из базы"""
+        urls = (
+            URL_INDEX,
+            reverse('posts:group_list', args=[self.group.slug]),
+            reverse('posts:profile', args=[self.author.username]),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                cold = self.authorized_client.get(url)
+                with CaptureQueriesContext(connection) as captured:
+                    warm = self.authorized_client.get(url)
+                self.assertEqual(cold.content, warm.content)
+                self.assertFalse([
+                    query['sql'] for query in captured
+                    if 'FROM "posts_post"' in query['sql']])
+
+
+class ConditionalGetTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.group = Group.objects.create(
+            title='test_group',
+            slug='test-slug',
+            description='test_description'
+        )
+        cls.post = Post.objects.create(
+            text='some_text', group=cls.group, author=cls.author)
+        cls.urls = {
+            URL_INDEX: 0,
+            reverse('posts:group_list', args=[cls.group.slug]): 1,
+            reverse('posts:profile', args=[cls.author.username]): 1,
+            reverse('posts:post_detail', args=[cls.post.pk]): 1,
+        }
+
+    def setUp(self):
+        cache.clear()
+
+    def test_repeat_visit_not_modified(self):
+        """Повторный запрос с ETag получает 304 без рендеринга"""
+        for url, queries in self.urls.items():
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, HTTPStatus.OK)
+                self.assertIn('no-cache', response['Cache-Control'])
+                with self.assertNumQueries(queries):
+                    repeat = self.client.get(
+                        url, HTTP_IF_NONE_MATCH=response['ETag'])
+                self.assertEqual(
+                    repeat.status_code, HTTPStatus.NOT_MODIFIED)
+                self.assertEqual(repeat.templates, [])
+                repeat = self.client.get(
+                    url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+                self.assertEqual(
+                    repeat.status_code, HTTPStatus.NOT_MODIFIED)
+
+    def test_write_changes_validators(self):
+        """Новый пост делает сохранённые валидаторы устаревшими"""
+        etags = {url: self.client.get(url)['ETag'] for url in self.urls}
+        Post.objects.create(
+            text='new_post', group=self.group, author=self.author)
+        for url, etag in etags.items():
+            with self.subTest(url=url):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_validators_depend_on_visitor_and_cursor(self):
+        """ETag различается для другого пользователя и другой страницы"""
+        etag = self.client.get(URL_INDEX)['ETag']
+        client = Client()
+        client.force_login(self.author)
+        self.assertNotEqual(client.get(URL_INDEX)['ETag'], etag)
+        response = self.client.get(
+            URL_INDEX, {'after': 'cursor'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_missing_object_not_found(self):
+        """Для несуществующего объекта проверка свежести не мешает 404"""
+        response = self.client.get(
+            reverse('posts:post_detail', args=[self.post.pk + 100]),
+            HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
@@ -0,0 +1,104 @@
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import DatabaseError
+from django.test import TestCase, TransactionTestCase
+
+from ..models import Comment, Follow, Post, User, UserCounter
+
+
+class CountersTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.user = User.objects.create_user(username='user')
+
+    def counter(self, user):
+        return UserCounter.objects.get(user=user)
+
+    def test_posts_count(self):
+        """Счётчик постов автора меняется при создании и удалении"""
+        post = Post.objects.create(text='post', author=self.author)
+        self.assertEqual(self.counter(self.author).posts_count, 1)
+        post.delete()
+        self.assertEqual(self.counter(self.author).posts_count, 0)
+
+    def test_comments_count(self):
+        """Счётчик учитывает только активные комментарии"""
+        post = Post.objects.create(text='post', author=self.author)
+        comment = Comment.objects.create(
+            post=post, author=self.user, text='comment')
+        Comment.objects.create(
+            post=post, author=self.user, text='hidden', active=False)
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+        comment.active = False
+        comment.save()
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 0)
+
+    def test_moved_comment_moves_count(self):
+        """Перенос комментария в другой пост переносит и его учёт"""
+        first = Post.objects.create(text='first', author=self.author)
+        second = Post.objects.create(text='second', author=self.author)
+        comment = Comment.objects.create(
+            post=first, author=self.user, text='comment')
+        comment.post = second
+        comment.save()
+        comment.active = False
+        comment.save()
+        comment.active = True
+        comment.save()
+        counts = dict(Post.objects.values_list('pk', 'comments_count'))
+        self.assertEqual(counts, {first.pk: 0, second.pk: 1})
+
+    def test_decrement_stops_at_zero(self):
+        """Уменьшение разошедшегося счётчика не уходит ниже нуля"""
+        post = Post.objects.create(text='post', author=self.author)
+        comment = Comment.objects.create(
+            post=post, author=self.user, text='comment')
+        Post.objects.filter(pk=post.pk).update(comments_count=0)
+        UserCounter.objects.filter(user=self.author).update(posts_count=0)
+        comment.delete()
+        post.delete()
+        self.assertEqual(self.counter(self.author).posts_count, 0)
+
+    def test_follow_counts(self):
+        """Подписка меняет счётчики подписчиков и подписок"""
+        follow = Follow.objects.create(user=self.user, author=self.author)
+        self.assertEqual(self.counter(self.author).followers_count, 1)
+        self.assertEqual(self.counter(self.user).following_count, 1)
+        follow.delete()
+        self.assertEqual(self.counter(self.author).followers_count, 0)
+        self.assertEqual(self.counter(self.user).following_count, 0)
+
+    def test_rebuild_counters_command(self):
+        """Команда rebuild_counters исправляет расхождения"""
+        post = Post.objects.create(text='post', author=self.author)
+        Comment.objects.create(post=post, author=self.user, text='comment')
+        UserCounter.objects.filter(user=self.author).update(posts_count=7)
+        Post.objects.filter(pk=post.pk).update(comments_count=0)
+        UserCounter.objects.filter(user=self.user).delete()
+        out = StringIO()
+        call_command('rebuild_counters', stdout=out)
+        self.assertIn('исправлено значений: 2', out.getvalue())
+        self.assertEqual(self.counter(self.author).posts_count, 1)
+        self.assertEqual(self.counter(self.user).following_count, 0)
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+
+
+class CommentSaveTest(TransactionTestCase):
+    def test_failed_save_keeps_count(self):
+        """Несохранённый комментарий не меняет счётчик"""
+        author = User.objects.create_user(username='author')
+        post = Post.objects.create(text='post', author=author)
+        with mock.patch.object(Comment, '_do_insert',
+                               side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                Comment.objects.create(
+                    post=post, author=author, text='comment')
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 0)
@@ -0,0 +1,97 @@
+import csv
+import json
+import os
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+
+from ..models import Comment, Follow, Group, Post, User
+
+POSTS_COUNT = 7
+
+
+def export(*args, **options):
+    out = StringIO()
+    call_command('export_data', *args, stdout=out, stderr=StringIO(),
+                 **options)
+    return out.getvalue()
+
+
+class ExportTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author')
+        cls.staff = User.objects.create_user(
+            username='staff', is_staff=True)
+        cls.group = Group.objects.create(
+            title='Группа', slug='group', description='-')
+        cls.posts = [
+            Post.objects.create(
+                text=f'Пост {i},\n"строка" {i}\r\nещё', author=cls.author,
+                group=cls.group)
+            for i in range(POSTS_COUNT)
+        ]
+        Comment.objects.create(
+            post=cls.posts[0], author=cls.staff, text='Комментарий')
+        Follow.objects.create(user=cls.staff, author=cls.author)
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp()
+        os.close(handle)
+        self.addCleanup(os.remove, self.path)
+
+    def test_ndjson(self):
+        """NDJSON - строка на запись по возрастанию id"""
+        rows = [json.loads(line) for line in export('posts').splitlines()]
+        self.assertEqual([row['id'] for row in rows],
+                         [post.pk for post in self.posts])
+        self.assertEqual(rows[0]['text'], self.posts[0].text)
+        self.assertEqual(rows[0]['author_id'], self.author.pk)
+        self.assertEqual(rows[0]['pub_date'],
+                         self.posts[0].pub_date.isoformat())
+        for name in ('comments', 'follows', 'groups'):
+            with self.subTest(name=name):
+                self.assertEqual(len(export(name).splitlines()), 1)
+
+    def test_csv(self):
+        """CSV с заголовком, переводы строк в тексте сохраняются"""
+        rows = list(csv.reader(StringIO(
+            export('posts', export_format='csv'), newline='')))
+        self.assertEqual(rows[0][:2], ['id', 'text'])
+        self.assertEqual(len(rows), POSTS_COUNT + 1)
+        self.assertEqual(rows[1][1], self.posts[0].text)
+
+    def test_resume_after_partial_write(self):
+        """--resume дописывает выгрузку после последней целой записи"""
+        for export_format in ('ndjson', 'csv'):
+            with self.subTest(export_format=export_format):
+                full = export('posts', export_format=export_format)
+                cut = full.encode().index(b'\xd1\x81\xd1\x82', len(full) // 2)
+                with open(self.path, 'wb') as file:
+                    file.write(full.encode()[:cut])
+                export('posts', export_format=export_format,
+                       output=self.path, resume=True)
+                with open(self.path, encoding='utf-8', newline='') as file:
+                    self.assertEqual(file.read(), full)
+
+    def test_endpoint(self):
+        """Выгрузка по адресу доступна только персоналу"""
+        url = reverse('posts:export', args=['posts', 'ndjson'])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 302)
+        self.client.force_login(self.staff)
+        response = self.client.get(url)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(
+            b''.join(response.streaming_content).decode(), export('posts'))
+        response = self.client.get(url, {'after': self.posts[-2].pk})
+        ids = [json.loads(line)['id'] for line in
+               b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(ids, [self.posts[-1].pk])
+        for args in (['users', 'csv'], ['posts', 'xml']):
+            response = self.client.get(reverse('posts:export', args=args))
+            self.assertEqual(response.status_code, 404)
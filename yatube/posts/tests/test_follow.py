@@ -3,10 +3,14 @@ import tempfile
 
 from django.conf import settings
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import Client, TestCase, override_settings
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import (Client, TestCase, TransactionTestCase,
+                         override_settings)
 from django.urls import reverse
 
-from ..models import Follow, Group, Post, User
+from ..models import Follow, Group, Post, Timeline, User
 
 small_gif = (
     b'\x47\x49\x46\x38\x39\x61\x02\x00'
@@ -118,3 +122,140 @@ class FollowTest(TestCase):
         response = self.authorized_client.get(URL)
         content = response.context['page_obj']
         self.assertNotIn(self.post, content)
+
+
+class TimelineTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.user = User.objects.create_user(username='user')
+        cls.authorized_client = Client()
+        cls.authorized_client.force_login(cls.user)
+        cls.url = reverse('posts:follow_index')
+
+    def feed(self):
+        return list(self.authorized_client.get(self.url).context['page_obj'])
+
+    def test_new_post_fan_out(self):
+        """Новый пост раскладывается в ленты подписчиков"""
+        Follow.objects.create(user=self.user, author=self.author)
+        post = Post.objects.create(text='fan_out', author=self.author)
+        self.assertTrue(Timeline.objects.filter(
+            user=self.user, post=post).exists())
+        self.assertEqual(self.feed(), [post])
+
+    def test_fan_out_to_many_followers(self):
+        """Раскладка не упирается в лимит строк одного INSERT"""
+        User.objects.bulk_create(
+            User(username=f'follower_{i}') for i in range(600))
+        Follow.objects.bulk_create(
+            Follow(user_id=pk, author=self.author)
+            for pk in User.objects.filter(
+                username__startswith='follower_').values_list('pk', flat=True))
+        post = Post.objects.create(text='fan_out', author=self.author)
+        self.assertEqual(Timeline.objects.filter(post=post).count(), 600)
+
+    def test_follow_backfill_and_unfollow(self):
+        """Подписка заполняет ленту, отписка очищает её"""
+        post = Post.objects.create(text='old_post', author=self.author)
+        follow = Follow.objects.create(user=self.user, author=self.author)
+        self.assertEqual(self.feed(), [post])
+        follow.delete()
+        self.assertFalse(Timeline.objects.filter(user=self.user).exists())
+        self.assertEqual(self.feed(), [])
+
+    def test_deleted_post_leaves_timeline(self):
+        """Удалённый пост пропадает из ленты"""
+        Follow.objects.create(user=self.user, author=self.author)
+        post = Post.objects.create(text='deleted', author=self.author)
+        post.delete()
+        self.assertEqual(self.feed(), [])
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=0)
+    def test_pull_for_popular_author(self):
+        """Посты популярных авторов подмешиваются при чтении"""
+        Follow.objects.create(user=self.user, author=self.author)
+        post = Post.objects.create(text='popular', author=self.author)
+        self.assertFalse(Timeline.objects.filter(user=self.user).exists())
+        self.assertEqual(self.feed(), [post])
+
+
+@override_settings(TIMELINE_FANOUT_LIMIT=1, TASKS_EAGER=True)
+class FanoutLimitTest(TransactionTestCase):
+    def test_author_back_under_limit_is_fanned_out(self):
+        """Посты, опубликованные сверх предела, возвращаются в ленты"""
+        author = User.objects.create_user(username='author')
+        user = User.objects.create_user(username='user')
+        other = User.objects.create_user(username='other')
+        Follow.objects.create(user=user, author=author)
+        follow = Follow.objects.create(user=other, author=author)
+        post = Post.objects.create(text='pulled', author=author)
+        self.assertFalse(Timeline.objects.exists())
+        follow.delete()
+        self.assertEqual(
+            list(Timeline.objects.values_list('user', 'post')),
+            [(user.pk, post.pk)])
+
+
+class FollowMigrationTest(TransactionTestCase):
+    def migrate(self, target):
+        call_command('migrate', 'posts', target, verbosity=0)
+        return MigrationExecutor(connection).loader.project_state(
+            ('posts', target)).apps
+
+    def tearDown(self):
+        call_command('migrate', verbosity=0)
+        super().tearDown()
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=1)
+    def test_fill_skips_crowded_authors(self):
+        """Заполнение лент пропускает авторов с подписчиками сверх предела"""
+        apps = self.migrate('0008_auto_20221218_1442')
+        User = apps.get_model('auth', 'User')
+        Post = apps.get_model('posts', 'Post')
+        Follow = apps.get_model('posts', 'Follow')
+        author, crowded, first, second = (
+            User.objects.create(username=name)
+            for name in ('author', 'crowded', 'first', 'second'))
+        post = Post.objects.create(text='Пост', author=author)
+        Post.objects.create(text='Пост', author=crowded)
+        Follow.objects.create(user=first, author=author)
+        for user in (first, second):
+            Follow.objects.create(user=user, author=crowded)
+
+        apps = self.migrate('0009_timeline')
+        self.assertEqual(
+            list(apps.get_model('posts', 'Timeline').objects.values_list(
+                'user', 'post', 'author')),
+            [(first.pk, post.pk, author.pk)])
+
+    def test_self_follows_removed(self):
+        """Миграция ограничения убирает подписки на себя и их следы"""
+        apps = self.migrate('0016_notifications')
+        User = apps.get_model('auth', 'User')
+        Post = apps.get_model('posts', 'Post')
+        Follow = apps.get_model('posts', 'Follow')
+        Timeline = apps.get_model('posts', 'Timeline')
+        UserCounter = apps.get_model('posts', 'UserCounter')
+        author = User.objects.create(username='author')
+        reader = User.objects.create(username='reader')
+        post = Post.objects.create(text='Пост', author=author)
+        Follow.objects.create(user=author, author=author)
+        Follow.objects.create(user=reader, author=author)
+        for user in (author, reader):
+            Timeline.objects.create(
+                user=user, post=post, author=author, pub_date=post.pub_date)
+        UserCounter.objects.create(
+            user=author, posts_count=1, followers_count=2, following_count=1)
+
+        self.migrate('0017_follow_constraints')
+        self.assertEqual(
+            list(Follow.objects.values_list('user', 'author')),
+            [(reader.pk, author.pk)])
+        self.assertEqual(
+            list(Timeline.objects.values_list('user', flat=True)),
+            [reader.pk])
+        counter = UserCounter.objects.get(user=author)
+        self.assertEqual(
+            (counter.followers_count, counter.following_count), (1, 0))
@@ -1,5 +1,8 @@
+import hashlib
 import shutil
+import struct
 import tempfile
+import zlib
 from http import HTTPStatus
 
 from django.conf import settings
@@ -9,10 +12,32 @@ from django.urls import reverse
 
 from ..forms import PostForm
 from ..models import Group, Post, User
+from ..storage import image_storage
+from ..uploads import read_header
 
+small_gif = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 
 
+def png_header(width, height):
+    """PNG с заявленными размерами, но без настоящих пикселей"""
+    def chunk(kind, data):
+        return (struct.pack('>I', len(data)) + kind + data
+                + struct.pack('>I', zlib.crc32(kind + data)))
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 0,
+                                         0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(b'\x00' * 64))
+            + chunk(b'IEND', b''))
+
+
 @override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
 class PostFormTests(TestCase):
     @classmethod
@@ -73,7 +98,8 @@ class PostFormTests(TestCase):
             Post.objects.filter(
                 group=form_data['group'],
                 text=form_data['text'],
-                image='posts/smail.gif'
+                image=image_storage.digest_name(
+                    'posts/smail.gif', hashlib.sha256(smail_gif).hexdigest())
             ).exists()
         )
         self.assertEqual(response.status_code, HTTPStatus.OK)
@@ -171,3 +197,95 @@ class PostFormTests(TestCase):
                                 args=[self.post.id]))
         self.assertRedirects(response, expected_redirect)
         self.assertEqual(self.post.comments.count(), comments_before)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, IMAGE_MAX_PIXELS=10 ** 6)
+class ImageUploadLimitsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='auth')
+        cls.author_client = Client()
+        cls.author_client.force_login(cls.author)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def upload(self, content, name='image.png'):
+        response = self.author_client.post(reverse('posts:create'), {
+            'text': 'post',
+            'image': SimpleUploadedFile(name, content, 'image/png'),
+        })
+        return response
+
+    def assertRejected(self, response, code):
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertFalse(Post.objects.exists())
+        error = response.context['form'].errors.as_data()['image'][0]
+        self.assertEqual(error.code, 'invalid_image')
+        self.assertEqual(
+            error.message, response.wsgi_request.FILES[
+                'image'].upload_error.messages[0])
+        self.assertEqual(
+            response.wsgi_request.FILES['image'].upload_error.code, code)
+
+    def test_header_is_enough(self):
+        """Формат и размеры читаются из заголовка без пикселей"""
+        self.assertEqual(
+            read_header(png_header(10000, 10000)[:41]),
+            ('PNG', (10000, 10000)))
+        self.assertIsNone(read_header(png_header(10, 10)[:20]))
+
+    def test_too_many_pixels(self):
+        """Картинка больше IMAGE_MAX_PIXELS отклоняется по заголовку"""
+        self.assertRejected(
+            self.upload(png_header(2000, 1000)), 'too_many_pixels')
+
+    def test_decompression_bomb(self):
+        """Бомба сверх предела Pillow отклоняется без распаковки"""
+        self.assertRejected(
+            self.upload(png_header(100000, 100000)), 'too_many_pixels')
+
+    @override_settings(IMAGE_UPLOAD_MAX_BYTES=100)
+    def test_too_large(self):
+        """Запись останавливается на IMAGE_UPLOAD_MAX_BYTES"""
+        self.assertRejected(
+            self.upload(small_gif + b'\x00' * 200, 'image.gif'), 'too_large')
+
+    def test_not_an_image(self):
+        self.assertRejected(self.upload(b'not an image' * 10), 'invalid_image')
+
+    @override_settings(IMAGE_FORMATS=('JPEG',))
+    def test_format(self):
+        self.assertRejected(
+            self.upload(small_gif, 'image.gif'), 'invalid_format')
+
+    def test_accepted_upload(self):
+        """Принятая загрузка хранится под хешем, посчитанным при приёме"""
+        response = self.upload(small_gif, 'image.gif')
+        self.assertEqual(response.status_code, HTTPStatus.FOUND)
+        self.assertEqual(
+            Post.objects.get().image.name,
+            image_storage.digest_name(
+                'posts/image.gif', hashlib.sha256(small_gif).hexdigest()))
+
+    def test_csrf_checked_after_handler(self):
+        """Обработчик ставится до чтения POST, CSRF всё равно проверяется"""
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.author)
+        response = client.post(reverse('posts:create'), {
+            'text': 'post',
+            'image': SimpleUploadedFile('image.gif', small_gif, 'image/gif'),
+        })
+        self.assertEqual(response.status_code, HTTPStatus.FORBIDDEN)
+        self.assertFalse(Post.objects.exists())
+
+    def test_form_checks_uploads_without_handler(self):
+        """Файл, пришедший не через обработчик, проверяется формой"""
+        form = PostForm({'text': 'post'}, files={
+            'image': SimpleUploadedFile('image.png', png_header(2000, 1000))})
+        self.assertFalse(form.is_valid())
+        self.assertEqual(
+            form.errors.as_data()['image'][0].code, 'too_many_pixels')
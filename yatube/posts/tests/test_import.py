@@ -0,0 +1,196 @@
+import json
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from django.conf import settings
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from ..models import (Comment, Follow, Group, ImportCheckpoint, Post,
+                      StoredImage, Timeline, User, UserCounter)
+from ..renditions import rendition_set
+
+small_gif = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ImportTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Группа', slug='group', description='-')
+        Follow.objects.create(user=cls.reader, author=cls.author)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, 'wb') as file:
+            file.write(content.encode() if isinstance(content, str)
+                       else content)
+        return path
+
+    def ndjson(self, name, rows):
+        return self.write(name, ''.join(
+            json.dumps(row, ensure_ascii=False) + '\n' for row in rows))
+
+    def load(self, *args, **options):
+        out, err = StringIO(), StringIO()
+        call_command('import_data', *args, batch_size=2, stdout=out,
+                     stderr=err, **options)
+        return out.getvalue(), err.getvalue()
+
+    def test_posts(self):
+        """Посты загружаются пачками со счётчиками и лентами"""
+        path = self.ndjson('posts.ndjson', [
+            {'text': 'Первый\nпост', 'author': 'author', 'group': 'group',
+             'pub_date': '2020-01-02T03:04:05+00:00'},
+            {'text': 'Второй', 'author_id': self.author.pk},
+            {'text': 'Чужой', 'author': 'nobody'},
+            {'text': 'Третий', 'author': 'author', 'group': 'missing'},
+        ])
+        out, err = self.load('posts', path)
+        self.assertIn('строк/с', out)
+        self.assertIn('nobody', err)
+        post = Post.objects.get(text='Первый\nпост')
+        self.assertEqual(post.group, self.group)
+        self.assertEqual(post.pub_date.year, 2020)
+        self.assertEqual(Post.objects.count(), 2)
+        self.assertEqual(
+            UserCounter.objects.get(user=self.author).posts_count, 2)
+        self.assertEqual(
+            Timeline.objects.filter(user=self.reader).count(), 2)
+        self.assertEqual(
+            ImportCheckpoint.objects.get().position, os.path.getsize(path))
+
+    def test_restart_after_partial_file(self):
+        """Повторный запуск продолжает с позиции последней пачки"""
+        header = 'id,text,author\n'
+        rows = [f'{100 + i},"Пост {i},\nстрока",author\n' for i in range(5)]
+        path = self.write('posts.csv', header + ''.join(rows[:3])
+                          + rows[3][:8])
+        self.load('posts', path)
+        self.assertEqual(Post.objects.count(), 3)
+        self.write('posts.csv', header + ''.join(rows))
+        out, _ = self.load('posts', path)
+        self.assertIn('Продолжение', out)
+        self.assertEqual(sorted(Post.objects.values_list('pk', flat=True)),
+                         [100, 101, 102, 103, 104])
+        self.assertEqual(Post.objects.get(pk=103).text, 'Пост 3,\nстрока')
+        self.assertEqual(
+            UserCounter.objects.get(user=self.author).posts_count, 5)
+
+        self.load('posts', path, from_start=True)
+        self.assertEqual(Post.objects.count(), 5)
+
+    def test_image_stage(self):
+        """Стадия картинок сохраняет файлы по хешу и готовит версии"""
+        images = os.path.join(self.directory, 'images')
+        os.mkdir(images)
+        self.write('images/a.gif', small_gif)
+        self.write('images/b.gif', small_gif)
+        self.write('images/broken.gif', b'not an image')
+        path = self.ndjson('posts.ndjson', [
+            {'text': 'a', 'author': 'author', 'image': 'a.gif'},
+            {'text': 'b', 'author': 'author', 'image': 'b.gif'},
+            {'text': 'c', 'author': 'author', 'image': 'broken.gif'},
+            {'text': 'd', 'author': 'author', 'image': '../posts.ndjson'},
+        ])
+        for workers in (0, 2):
+            with self.subTest(workers=workers):
+                out, err = self.load('posts', path, images=images,
+                                     workers=workers, from_start=True)
+                self.assertIn('картинок с ошибками: 2', out)
+                self.assertIn('broken.gif', err)
+        names = set(Post.objects.exclude(image='').values_list(
+            'image', flat=True))
+        self.assertEqual(len(names), 1)
+        name = names.pop()
+        self.assertEqual(StoredImage.objects.get(name=name).refs, 4)
+        for _, _, rendition in rendition_set(name):
+            self.assertTrue(
+                os.path.exists(os.path.join(TEMP_MEDIA_ROOT, rendition)))
+
+    def test_comments_and_follows(self):
+        """Комментарии и подписки проверяются пачкой, счётчики сходятся"""
+        post = Post.objects.create(text='Пост', author=self.author)
+        path = self.ndjson('comments.ndjson', [
+            {'post_id': post.pk, 'author': 'reader', 'text': 'Да',
+             'created': '2021-05-06T07:08:09'},
+            {'post_id': post.pk, 'author': 'reader', 'text': 'Скрыт',
+             'active': False},
+            {'post_id': 0, 'author': 'reader', 'text': 'Нет поста'},
+        ])
+        self.load('comments', path)
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+        self.assertEqual(Comment.objects.get(text='Да').created.year, 2021)
+
+        User.objects.create_user(username='writer')
+        path = self.ndjson('follows.ndjson', [
+            {'user': 'reader', 'author': 'author'},
+            {'user': 'author', 'author': 'writer'},
+            {'user': 'reader', 'author': 'writer'},
+            {'user': 'reader', 'author': 'writer'},
+        ])
+        _, err = self.load('follows', path)
+        self.assertIn('подписка уже есть', err)
+        self.assertEqual(Follow.objects.count(), 3)
+        writer = UserCounter.objects.get(user__username='writer')
+        self.assertEqual(writer.followers_count, 2)
+        self.assertEqual(
+            UserCounter.objects.get(user=self.reader).following_count, 2)
+
+    def test_malformed_lines_are_skipped(self):
+        """Битая строка пропускается, а позиция уходит за неё"""
+        path = self.write('posts.ndjson', (
+            '{"text": "Первый", "author": "author"}\n'
+            '{"text": "Оборван\n'
+            '[1, 2]\n'
+        ).encode() + b'{"text": "\xff", "author": "author"}\n' + (
+            '{"text": "Последний", "author": "author"}\n').encode())
+        _, err = self.load('posts', path)
+        self.assertEqual(err.count('Пропуск'), 3)
+        self.assertEqual(
+            sorted(Post.objects.values_list('text', flat=True)),
+            ['Первый', 'Последний'])
+        out, _ = self.load('posts', path)
+        self.assertIn('пропущено строк: 0', out)
+        self.assertEqual(Post.objects.count(), 2)
+
+        path = self.write(
+            'posts.csv', b'text,author\n\xff,author\nOk,author\n')
+        _, err = self.load('posts', path)
+        self.assertIn('строка до байта', err)
+        self.assertTrue(Post.objects.filter(text='Ok').exists())
+
+    def test_skipped_group_keeps_slug_free(self):
+        """Slug отклонённой группы можно загрузить следующей строкой"""
+        path = self.ndjson('groups.ndjson', [
+            {'id': self.group.pk, 'title': 'Занят id', 'slug': 'new'},
+            {'title': 'Новая', 'slug': 'new'},
+            {'title': 'Дубль', 'slug': 'new'},
+        ])
+        _, err = self.load('groups', path)
+        self.assertIn(f'id {self.group.pk} уже занят', err)
+        self.assertIn('группа new уже есть', err)
+        self.assertEqual(Group.objects.get(slug='new').title, 'Новая')
@@ -0,0 +1,108 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from ..models import Comment, Delivery, Follow, Notification, Post, User
+from ..notifications import deliver_notifications, unread_count
+
+
+@override_settings(NOTIFICATION_BATCH_SIZE=2)
+class NotificationTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author')
+        cls.followers = [
+            User.objects.create_user(username=f'follower_{i}')
+            for i in range(5)
+        ]
+        for follower in cls.followers:
+            Follow.objects.create(user=follower, author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+
+    def publish(self, count=1):
+        for i in range(count):
+            post = Post.objects.create(text=f'Пост {i}', author=self.author)
+        return post
+
+    def deliver(self):
+        delivery = Delivery.objects.get(started=False)
+        deliver_notifications(delivery.pk)
+        self.assertFalse(Delivery.objects.exists())
+
+    def test_posts_coalesce_into_digest(self):
+        """Посты за окно рассылки дают подписчику одну сводку"""
+        last = self.publish(3)
+        delivery = Delivery.objects.get()
+        self.assertEqual((delivery.count, delivery.post), (3, last))
+        self.deliver()
+        self.assertEqual(Notification.objects.count(), len(self.followers))
+        self.assertEqual(
+            set(Notification.objects.values_list('count', 'post')),
+            {(3, last.pk)})
+
+        self.publish()
+        self.deliver()
+        self.assertEqual(Notification.objects.count(), len(self.followers))
+        self.assertEqual(
+            set(Notification.objects.values_list('count', flat=True)), {4})
+
+    def test_read_digest_is_not_extended(self):
+        """После прочтения новые события начинают новую сводку"""
+        self.publish()
+        self.deliver()
+        reader = self.followers[0]
+        client = self.client
+        client.force_login(reader)
+        response = client.get(reverse('posts:notifications'))
+        self.assertContains(response, 'новых постов - 1')
+        client.post(reverse('posts:notifications'))
+        self.assertEqual(unread_count(reader), 0)
+
+        self.publish()
+        self.deliver()
+        self.assertEqual(reader.notifications.count(), 2)
+        self.assertEqual(unread_count(reader), 1)
+
+    def test_unread_count_in_header(self):
+        """Шапка показывает число непрочитанных из кеша"""
+        self.client.force_login(self.followers[1])
+        self.client.get(reverse('posts:index'))
+        self.publish()
+        response = self.client.get(reverse('posts:index'))
+        self.assertNotContains(response, 'badge-danger')
+        self.deliver()
+        response = self.client.get(reverse('posts:index'))
+        self.assertContains(response, '<span class="badge badge-danger">1')
+        with self.assertNumQueries(0):
+            self.assertEqual(unread_count(self.followers[1]), 1)
+
+    def test_retry_resumes_after_last_batch(self):
+        """Повтор рассылки не дублирует уже разосланные пачки"""
+        self.publish(2)
+        delivery = Delivery.objects.get()
+        with mock.patch('posts.notifications.cache.delete_many',
+                        side_effect=[None, RuntimeError]):
+            with self.assertRaises(RuntimeError):
+                deliver_notifications(delivery.pk)
+        self.assertEqual(Delivery.objects.get().after, self.followers[3].pk)
+        deliver_notifications(delivery.pk)
+        self.assertEqual(
+            list(Notification.objects.values_list('count', flat=True)),
+            [2] * len(self.followers))
+
+    def test_comments_and_silent_authors(self):
+        """Комментарии рассылаются отдельно, у автора без подписчиков
+        рассылки нет"""
+        post = self.publish()
+        Comment.objects.create(post=post, author=self.author, text='-')
+        self.assertEqual(
+            sorted(Delivery.objects.values_list('kind', flat=True)),
+            [Notification.COMMENT, Notification.POST])
+
+        Delivery.objects.all().delete()
+        Post.objects.create(text='-', author=self.followers[0])
+        self.assertFalse(Delivery.objects.exists())
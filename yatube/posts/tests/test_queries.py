@@ -0,0 +1,72 @@
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from ..models import Comment, Follow, Group, Post, User
+
+POSTS_COUNT = 15
+
+
+class FeedQueriesTest(TestCase):
+    """Число запросов ленты не зависит от числа постов на странице."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='test_group',
+            slug='test-slug',
+            description='test_description'
+        )
+        for i in range(POSTS_COUNT):
+            author = User.objects.create_user(
+                username=f'author_{i}', first_name='Имя', last_name=f'{i}')
+            group = Group.objects.create(
+                title=f'group_{i}', slug=f'group-{i}', description='-')
+            post = Post.objects.create(
+                text=f'Пост #{i}',
+                author=author,
+                group=cls.group if i % 2 else group,
+            )
+            Comment.objects.create(post=post, author=cls.user, text='-')
+            Follow.objects.create(user=cls.user, author=author)
+        cls.author = author
+        cls.post = post
+
+    def setUp(self):
+        self.guest_client = Client()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+        cache.clear()
+
+    def assert_budget(self, client, budgets):
+        for url, budget in budgets.items():
+            with self.subTest(url=url):
+                with self.assertNumQueries(budget):
+                    client.get(url)
+
+    def test_guest_feed_query_budget(self):
+        """Ленты для гостя укладываются в бюджет запросов."""
+        self.assert_budget(self.guest_client, {
+            reverse('posts:index'): 1,
+            reverse('posts:group_list', args=[self.group.slug]): 3,
+            reverse('posts:profile', args=[self.author.username]): 3,
+            reverse('posts:post_detail', args=[self.post.pk]): 3,
+        })
+
+    def test_follow_feed_query_budget(self):
+        """Лента подписок укладывается в бюджет запросов."""
+        url = reverse('posts:follow_index')
+        # число непрочитанных уведомлений в шапке считается при промахе кеша
+        self.assert_budget(self.authorized_client, {url: 6})
+        self.assert_budget(self.authorized_client, {url: 5})
+
+    def test_feeds_use_indexes(self):
+        """Ленты читаются по индексам без сортировки во временном B-дереве."""
+        out = StringIO()
+        call_command('explain_feeds', stdout=out)
+        self.assertNotIn('USE TEMP B-TREE', out.getvalue())
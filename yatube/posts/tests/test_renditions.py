@@ -0,0 +1,137 @@
+import os
+import shutil
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
+from django.core.management import call_command
+from django.template import Context, Template
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from PIL import Image
+
+from ..models import Post, User
+from ..renditions import pending_key, rendition_name, rendition_set, render
+
+small_gif = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, TASKS_EAGER=True,
+                   POST_RENDITION_WIDTHS=(320, 640),
+                   POST_RENDITION_FORMATS=('webp', 'jpeg'),
+                   POST_RENDITION_DEFAULT_WIDTH=640)
+class RenditionTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def create_post(self, name):
+        return Post.objects.create(
+            text='post',
+            author=self.author,
+            image=SimpleUploadedFile(
+                name=name, content=small_gif, content_type='image/gif'),
+        )
+
+    def path(self, name):
+        return os.path.join(TEMP_MEDIA_ROOT, name)
+
+    def test_render_set(self):
+        """Набор содержит каждую ширину в каждом формате"""
+        post = self.create_post('original.gif')
+        self.assertTrue(render(post.image.name))
+        for width, extension, name in rendition_set(post.image.name):
+            with Image.open(self.path(name)) as image:
+                self.assertEqual(image.format, extension.upper())
+                self.assertEqual(image.width, width)
+
+    def test_picture_tag_does_no_lookups(self):
+        """Тег строит srcset без обращений к базе и хранилищу"""
+        post = self.create_post('tag.gif')
+        template = Template('{% load renditions %}{% picture image %}')
+        with self.assertNumQueries(0), mock.patch.object(
+                FileSystemStorage, 'exists', side_effect=AssertionError):
+            html = template.render(Context({'image': post.image}))
+        media = settings.MEDIA_URL + 'renditions/' + post.image.name
+        self.assertIn(
+            f'<source type="image/webp" srcset="{media}/320.webp 320w, '
+            f'{media}/640.webp 640w"', html)
+        self.assertIn(f'src="{media}/640.jpeg"', html)
+        self.assertIn(f'{media}/320.jpeg 320w', html)
+        self.assertIn('sizes=', html)
+        self.assertEqual(Template(
+            '{% load renditions %}{% picture image %}').render(
+                Context({'image': None})), '')
+
+    def test_pending_image_shows_original(self):
+        """Пока версии готовятся, лента показывает оригинал"""
+        post = self.create_post('pending.gif')
+        cache.set(pending_key(post.image.name), True)
+        media = settings.MEDIA_URL + 'renditions/' + post.image.name
+        response = self.client.get(reverse('posts:index'))
+        self.assertContains(response, f'src="{post.image.url}"')
+        self.assertNotContains(response, media)
+
+        self.assertTrue(render(post.image.name))
+        self.assertIsNone(cache.get(pending_key(post.image.name)))
+        response = self.client.get(reverse('posts:index'))
+        self.assertContains(response, f'src="{media}/640.jpeg"')
+
+    def test_page_resolves_pending_in_one_lookup(self):
+        """Отметки картинок страницы читаются одним get_many"""
+        posts = [self.create_post(f'page{i}.gif') for i in range(3)]
+        cache.clear()
+        with mock.patch('posts.renditions.cache',
+                        mock.Mock(wraps=cache)) as counted:
+            self.client.get(reverse('posts:index'))
+            self.assertEqual(counted.get_many.call_count, 1)
+            keys = counted.get_many.call_args[0][0]
+            self.assertCountEqual(
+                keys, {pending_key(post.image.name) for post in posts})
+            self.client.get(reverse('posts:index'))
+            self.assertEqual(counted.get_many.call_count, 1)
+        self.assertEqual(counted.get.call_count, 0)
+
+    def test_missing_rendition_rendered_on_request(self):
+        """Промах по версии готовит набор и отдаёт файл"""
+        post = self.create_post('lazy.gif')
+        name = rendition_name(post.image.name, 320, 'webp')
+        response = self.client.get(settings.MEDIA_URL + name)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertTrue(os.path.exists(self.path(name)))
+        for url in (
+            rendition_name(post.image.name, 100, 'webp'),
+            rendition_name(post.image.name, 320, 'gif'),
+            rendition_name('posts/missing.gif', 320, 'webp'),
+            rendition_name('posts/../../settings.py', 320, 'webp'),
+        ):
+            response = self.client.get(settings.MEDIA_URL + url)
+            self.assertEqual(response.status_code, 404, url)
+
+    def test_render_thumbnails_command(self):
+        """Команда render_thumbnails готовит наборы версий"""
+        post = self.create_post('backfill.gif')
+        out = StringIO()
+        call_command('render_thumbnails', workers=0, stdout=out)
+        self.assertIn('ошибок: 0', out.getvalue())
+        for _, _, name in rendition_set(post.image.name):
+            self.assertTrue(os.path.exists(self.path(name)))
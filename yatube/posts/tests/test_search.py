@@ -0,0 +1,116 @@
+from io import StringIO
+
+from django.apps import apps
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from ..models import Group, Post, User
+from ..search import SEARCH_TABLE
+from ..signals import search_installed, search_uninstalled
+
+URL_SEARCH = reverse('posts:search')
+
+
+class SearchTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(
+            username='author', first_name='Лев', last_name='Толстой')
+        cls.group = Group.objects.create(
+            title='Классика',
+            slug='classic',
+            description='test_description'
+        )
+        cls.post = Post.objects.create(
+            text='Все счастливые семьи похожи друг на друга',
+            author=cls.author,
+            group=cls.group,
+        )
+
+    def setUp(self):
+        self.client = Client()
+
+    def search(self, query, **params):
+        response = self.client.get(URL_SEARCH, {'q': query, **params})
+        return response.context['page_obj']
+
+    def test_search_by_text_group_and_author(self):
+        """Поиск находит пост по тексту, группе и автору"""
+        for query in ('счастливые семьи', 'классика', 'Толстой'):
+            with self.subTest(query=query):
+                self.assertEqual(list(self.search(query)), [self.post])
+
+    def test_search_index_follows_changes(self):
+        """Индекс обновляется при правке поста и группы"""
+        self.post.text = 'Анна Каренина'
+        self.post.save()
+        self.assertEqual(list(self.search('семьи')), [])
+        self.assertEqual(list(self.search('Каренина')), [self.post])
+        Group.objects.filter(pk=self.group.pk).update(title='Роман')
+        self.assertEqual(list(self.search('роман')), [self.post])
+        self.post.delete()
+        self.assertEqual(list(self.search('Каренина')), [])
+
+    def test_search_ranking_and_cursor(self):
+        """Результаты ранжируются по bm25 и листаются курсором"""
+        for i in range(12):
+            Post.objects.create(text=f'мир {i}', author=self.author)
+        best = Post.objects.create(text='мир мир мир', author=self.author)
+        first_page = self.search('мир')
+        self.assertEqual(first_page[0], best)
+        second_page = self.search('мир', after=first_page.next_cursor)
+        self.assertEqual(len(first_page) + len(second_page), 13)
+        self.assertFalse(set(first_page) & set(second_page))
+        back_page = self.search('мир', before=second_page.previous_cursor)
+        self.assertEqual(list(back_page), list(first_page))
+
+    def test_search_sorted_by_fts(self):
+        """Совпадения сортирует FTS5, без временного B-дерева"""
+        for i in range(12):
+            Post.objects.create(text=f'мир {i}', author=self.author)
+        with CaptureQueriesContext(connection) as queries:
+            self.search('мир', after=self.search('мир').next_cursor)
+        plans = []
+        with connection.cursor() as cursor:
+            for query in queries.captured_queries:
+                if SEARCH_TABLE in query['sql']:
+                    cursor.execute(f'EXPLAIN QUERY PLAN {query["sql"]}')
+                    plans += [row[-1] for row in cursor.fetchall()]
+        self.assertTrue(plans)
+        self.assertNotIn('USE TEMP B-TREE', ' '.join(plans))
+
+    def test_search_query_syntax_is_escaped(self):
+        """Служебные символы FTS5 в запросе не ломают поиск"""
+        for query in ('', '"', 'AND OR NOT', 'семьи)(*'):
+            with self.subTest(query=query):
+                response = self.client.get(URL_SEARCH, {'q': query})
+                self.assertEqual(response.status_code, 200)
+
+    def test_rebuild_search_index_command(self):
+        """Команда rebuild_search_index заново заполняет индекс"""
+        out = StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn('Проиндексировано постов: 1', out.getvalue())
+        self.assertEqual(list(self.search('семьи')), [self.post])
+
+
+class SearchMigrationTest(TransactionTestCase):
+    def test_migration_rebuilds_post_table(self):
+        """Миграции пересоздают таблицу постов, поиск после них полный"""
+        posts = apps.get_app_config('posts')
+        author = User.objects.create_user(username='author')
+        search_uninstalled(sender=posts, using='default')
+        with connection.schema_editor() as editor:
+            editor._remake_table(Post)
+        post = Post.objects.create(text='пересобранная таблица', author=author)
+        search_installed(sender=posts, using='default', plan=[(None, False)])
+        response = self.client.get(URL_SEARCH, {'q': 'пересобранная'})
+        self.assertEqual(list(response.context['page_obj']), [post])
+        post.text = 'таблица с триггерами'
+        post.save()
+        response = self.client.get(URL_SEARCH, {'q': 'триггерами'})
+        self.assertEqual(list(response.context['page_obj']), [post])
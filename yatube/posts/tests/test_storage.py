@@ -0,0 +1,138 @@
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import (Client, TestCase, TransactionTestCase,
+                         override_settings)
+from django.urls import reverse
+
+from ..images import acquire_image, acquire_images, release_image
+from ..models import Post, StoredImage, User
+from ..renditions import render, rendition_set
+
+small_gif = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
+other_gif = small_gif.replace(b'\xFF\xFF\xFF', b'\x00\xFF\x00')
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+
+def upload(name, content=small_gif):
+    return SimpleUploadedFile(
+        name=name, content=content, content_type='image/gif')
+
+
+def stored_files(directory):
+    return [
+        os.path.join(path, name)
+        for path, _, names in os.walk(os.path.join(TEMP_MEDIA_ROOT, directory))
+        for name in names
+    ]
+
+
+class StorageTestMixin:
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+        self.author = User.objects.create_user(username='author')
+
+    def create_post(self, name, content=small_gif):
+        return Post.objects.create(
+            text='post', author=self.author, image=upload(name, content))
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, TASKS_EAGER=True)
+class ContentAddressedStorageTest(StorageTestMixin, TestCase):
+    def test_duplicates_share_file(self):
+        """Одинаковые загрузки хранятся одним файлом под хешем"""
+        first = self.create_post('first.gif')
+        second = self.create_post('second.GIF')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertRegex(
+            first.image.name, r'^posts/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}'
+                              r'\.gif$')
+        self.assertEqual(stored_files('posts'), [first.image.path])
+        self.assertEqual(
+            StoredImage.objects.get(name=first.image.name).refs, 2)
+
+    def test_duplicates_share_renditions(self):
+        """Версии дубликата уже готовы"""
+        first = self.create_post('first.gif')
+        self.assertTrue(render(first.image.name))
+        second = self.create_post('second.gif')
+        renditions = rendition_set(first.image.name)
+        self.assertEqual(rendition_set(second.image.name), renditions)
+        self.assertEqual(len(stored_files('renditions')), len(renditions))
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, TASKS_EAGER=True)
+class OrphanImageTest(StorageTestMixin, TransactionTestCase):
+    def test_last_reference_removes_file_and_renditions(self):
+        """Файл и версии удаляются вместе с последней ссылкой"""
+        first = self.create_post('first.gif')
+        second = self.create_post('second.gif')
+        path = first.image.path
+        renditions = len(rendition_set(first.image.name))
+        self.assertEqual(len(stored_files('renditions')), renditions)
+
+        first.delete()
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(StoredImage.objects.get(name=second.image.name).refs,
+                         1)
+
+        client = Client()
+        client.force_login(self.author)
+        client.post(reverse('posts:edit', args=[second.pk]), {
+            'text': 'edited', 'image': upload('other.gif', other_gif)})
+        second.refresh_from_db()
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(stored_files('posts'), [second.image.path])
+        self.assertEqual(len(stored_files('renditions')), renditions)
+
+        second.delete()
+        self.assertEqual(stored_files('posts'), [])
+        self.assertEqual(stored_files('renditions'), [])
+        self.assertFalse(StoredImage.objects.exists())
+
+
+class ImageRefsTest(TransactionTestCase):
+    def refs(self):
+        return dict(StoredImage.objects.values_list('name', 'refs'))
+
+    def test_batch_acquire_and_release(self):
+        """Пачка прибавляет ссылки и известным, и новым картинкам"""
+        acquire_image('posts/a.gif')
+        acquire_images({'posts/a.gif': 2, 'posts/b.gif': 1, '': 5})
+        self.assertEqual(self.refs(), {'posts/a.gif': 3, 'posts/b.gif': 1})
+        release_image('posts/b.gif')
+        release_image('posts/b.gif')
+        self.assertEqual(self.refs(), {'posts/a.gif': 3})
+
+    def test_concurrent_refs_are_not_lost(self):
+        """Параллельные ссылки и их снятие сходятся к исходному числу"""
+        acquire_image('posts/a.gif')
+
+        def churn(_):
+            try:
+                for _ in range(20):
+                    acquire_image('posts/a.gif')
+                    release_image('posts/a.gif')
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            list(pool.map(churn, range(4)))
+        self.assertEqual(self.refs(), {'posts/a.gif': 1})
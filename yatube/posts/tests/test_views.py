@@ -1,9 +1,9 @@
 from django import forms
 from django.contrib.auth import get_user_model
-from django.test import Client, TestCase
+from django.test import Client, TestCase, override_settings
 from django.urls import reverse
 
-from ..models import Group, Post
+from ..models import Comment, Group, Post
 
 User = get_user_model()
 
@@ -116,11 +116,103 @@ class PaginatorViewsTest(TestCase):
         ]
         for reverse_ in url_pages:
             with self.subTest(reverse_=reverse_):
-                self.assertEqual(len(self.unauthorized_client.get(
-                    reverse_).context.get('page_obj')),
-                    posts_on_first_page
-                )
-                self.assertEqual(len(self.unauthorized_client.get(
-                    reverse_ + '?page=2').context.get('page_obj')),
-                    posts_on_second_page
-                )
+                first_page = self.unauthorized_client.get(
+                    reverse_).context.get('page_obj')
+                self.assertEqual(len(first_page), posts_on_first_page)
+                second_page = self.unauthorized_client.get(
+                    reverse_ + '?after=' + first_page.next_cursor
+                ).context.get('page_obj')
+                self.assertEqual(len(second_page), posts_on_second_page)
+                self.assertIsNone(second_page.next_cursor)
+                back_page = self.unauthorized_client.get(
+                    reverse_ + '?before=' + second_page.previous_cursor
+                ).context.get('page_obj')
+                self.assertEqual(list(back_page), list(first_page))
+                self.assertFalse(back_page.has_previous())
+
+    def test_paginator_bad_cursor(self):
+        """Некорректный курсор открывает первую страницу."""
+        response = self.unauthorized_client.get(
+            reverse('posts:index') + '?after=broken')
+        self.assertEqual(len(response.context['page_obj']), 10)
+        self.assertFalse(response.context['page_obj'].has_previous())
+
+
+@override_settings(COMMENTS_PER_PAGE=4, COMMENTS_PAGE_LIMIT=6)
+class CommentsPaginationTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create(username='auth')
+        cls.post = Post.objects.create(text='Пост', author=cls.user)
+        for i in range(10):
+            Comment.objects.create(
+                post=cls.post, author=cls.user, text=f'Комментарий #{i}')
+        cls.url = reverse('posts:comments', args=[cls.post.pk])
+
+    def test_post_detail_first_page(self):
+        """На странице поста первая страница комментариев, новые сверху"""
+        response = self.client.get(
+            reverse('posts:post_detail', args=[self.post.pk]))
+        comments = response.context['comments']
+        self.assertEqual(
+            [comment.text for comment in comments],
+            [f'Комментарий #{i}' for i in range(9, 5, -1)])
+        self.assertContains(
+            response, f'{self.url}?after={comments.next_cursor}')
+
+    def test_load_more_fragment(self):
+        """Фрагмент следующей страницы продолжает список без повторов"""
+        seen = []
+        url = self.url
+        while url:
+            with self.assertNumQueries(2):
+                response = self.client.get(url)
+            self.assertTemplateUsed(response, 'posts/includes/comments.html')
+            page = response.context['comments']
+            seen += [comment.pk for comment in page]
+            url = page.next_cursor and f'{self.url}?after={page.next_cursor}'
+        self.assertEqual(seen, list(
+            Comment.objects.order_by('-created', '-id')
+            .values_list('pk', flat=True)))
+
+    def test_load_more_json_and_limit(self):
+        """JSON-ответ соблюдает потолок числа строк на запрос"""
+        response = self.client.get(self.url, {'format': 'json', 'limit': 500})
+        data = response.json()
+        self.assertEqual(len(data['comments']), 6)
+        self.assertEqual(data['comments'][0]['text'], 'Комментарий #9')
+        self.assertIsNotNone(data['next_cursor'])
+        data = self.client.get(self.url, {
+            'format': 'json', 'limit': 500, 'after': data['next_cursor'],
+        }).json()
+        self.assertEqual(len(data['comments']), 4)
+        self.assertIsNone(data['next_cursor'])
+
+    def test_load_more_keeps_limit(self):
+        """Ссылка «Показать ещё» сохраняет выбранный limit"""
+        response = self.client.get(
+            reverse('posts:post_detail', args=[self.post.pk]), {'limit': 2})
+        comments = response.context['comments']
+        self.assertEqual(len(comments), 2)
+        self.assertContains(
+            response, f'{self.url}?after={comments.next_cursor}&limit=2')
+
+    def test_past_last_page_is_not_empty_post(self):
+        """За последней страницей нет призыва оставить первый комментарий"""
+        url = reverse('posts:post_detail', args=[self.post.pk])
+        after = self.client.get(url, {'limit': 6}).context[
+            'comments'].next_cursor
+        response = self.client.get(url, {'limit': 6, 'after': after})
+        self.assertNotContains(response, 'Комментариев нет')
+        response = self.client.get(url, {
+            'after': response.context['comments'].paginator.encode_cursor(
+                Comment.objects.earliest('created', 'pk'))})
+        self.assertEqual(len(response.context['comments']), 0)
+        self.assertNotContains(response, 'Комментариев нет')
+
+    def test_missing_post(self):
+        """Комментарии несуществующего поста - 404"""
+        response = self.client.get(
+            reverse('posts:comments', args=[self.post.pk + 100]))
+        self.assertEqual(response.status_code, 404)
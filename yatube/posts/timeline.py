@@ -0,0 +1,144 @@
+from django.conf import settings
+from django.db import transaction
+
+from core.queue import task
+
+from .models import Follow, Post, Timeline, UserCounter
+from .utils import (CursorPaginator, bulk_batch_size, get_feed,
+                    insert_select)
+
+
+def pull_authors():
+    ''' Счётчики авторов, чьи посты не раскладываются по лентам '''
+    return UserCounter.objects.filter(
+        followers_count__gt=settings.TIMELINE_FANOUT_LIMIT)
+
+
+def get_pull_authors(user):
+    followed = Follow.objects.filter(user=user).values('author')
+    return list(pull_authors().filter(user__in=followed).values_list(
+        'user_id', flat=True))
+
+
+def fan_out_post(post):
+    ''' Раскладывает новый пост по лентам подписчиков автора '''
+    if pull_authors().filter(user_id=post.author_id).exists():
+        return
+    followers = Follow.objects.filter(
+        author_id=post.author_id, user__isnull=False
+    ).values_list('user_id', flat=True).iterator()
+    Timeline.objects.bulk_create(
+        (Timeline(user_id=user_id, post_id=post.pk,
+                  author_id=post.author_id, pub_date=post.pub_date)
+         for user_id in followers),
+        batch_size=bulk_batch_size(
+            Timeline, settings.TIMELINE_BATCH_SIZE),
+        ignore_conflicts=True,
+    )
+
+
+def add_author(user_id, author_id):
+    ''' Добавляет в ленту подписчика уже опубликованные посты автора '''
+    if pull_authors().filter(user_id=author_id).exists():
+        return
+    posts = Post.objects.filter(author_id=author_id).values_list(
+        'pk', 'pub_date').iterator()
+    Timeline.objects.bulk_create(
+        (Timeline(user_id=user_id, post_id=pk,
+                  author_id=author_id, pub_date=pub_date)
+         for pk, pub_date in posts),
+        batch_size=bulk_batch_size(
+            Timeline, settings.TIMELINE_BATCH_SIZE),
+        ignore_conflicts=True,
+    )
+
+
+def remove_author(user_id, author_id):
+    ''' Убирает посты автора из ленты отписавшегося пользователя '''
+    Timeline.objects.filter(user_id=user_id, author_id=author_id).delete()
+
+
+def fan_out_posts(posts, follows=None):
+    ''' Раскладывает posts по лентам одним INSERT ... SELECT
+
+    follows сужает раскладку до этих подписок, например только что
+    загруженных; по умолчанию посты попадают ко всем подписчикам.
+    '''
+    subscription = {'author__following__user__isnull': False}
+    if follows is not None:
+        subscription['author__following__in'] = follows
+    rows = posts.filter(**subscription).exclude(
+        author__in=pull_authors().values('user_id'),
+    ).order_by().values_list(
+        'author__following__user', 'pk', 'author', 'pub_date')
+    return insert_select(
+        Timeline, ('user', 'post', 'author', 'pub_date'), rows)
+
+
+def follower_removed(author_id):
+    ''' Автор, опустившийся до TIMELINE_FANOUT_LIMIT, снова раскладывается
+
+    Вызывается после уменьшения счётчика в той же транзакции: строка
+    счётчика заблокирована, поэтому ровно один вызов увидит предел.
+    '''
+    if UserCounter.objects.filter(
+            user_id=author_id,
+            followers_count=settings.TIMELINE_FANOUT_LIMIT).exists():
+        restore_author.delay(author_id)
+
+
+@task
+def restore_author(author_id):
+    ''' Раскладывает все посты автора по лентам его подписчиков
+
+    Пока подписчиков было больше предела, новые посты автора не
+    попадали в ленты, а новые подписчики не получали прежних постов.
+    Уже разложенные строки пропускает уникальный индекс.
+    '''
+    return fan_out_posts(Post.objects.filter(author_id=author_id))
+
+
+def rebuild_timelines():
+    ''' Заново раскладывает все посты по лентам одним INSERT ... SELECT '''
+    with transaction.atomic():
+        Timeline.objects.all().delete()
+        return fan_out_posts(Post.objects.all())
+
+
+class TimelinePaginator(CursorPaginator):
+    ''' Пагинация ленты подписок по готовому списку id постов
+
+    Посты страницы догружаются из posts, по умолчанию - с полями ленты.
+    '''
+
+    def __init__(self, user, per_page, posts=None):
+        super().__init__(Post.objects.none(), per_page)
+        self.user = user
+        self.posts = get_feed(Post.objects.all()) if posts is None else posts
+
+    def get_rows(self, cursor_key, backward):
+        keys = self.keyset(
+            Timeline.objects.filter(user=self.user)
+            .values_list('pub_date', 'post_id'),
+            cursor_key, backward, key='post_id',
+        )
+        pull_authors = get_pull_authors(self.user)
+        if pull_authors:
+            keys += self.keyset(
+                Post.objects.filter(author__in=pull_authors)
+                .values_list('pub_date', 'pk'),
+                cursor_key, backward,
+            )
+            keys = sorted(set(keys), reverse=not backward)
+        ids = [pk for _, pk in keys[:self.per_page + 1]]
+        posts = self.posts.in_bulk(ids)
+        return [posts[pk] for pk in ids if pk in posts]
+
+
+def get_timeline_page(user, request):
+    ''' Страница ленты подписок пользователя '''
+    paginator = TimelinePaginator(user, settings.QUANTITY_POST)
+    return paginator.get_page(
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+    )
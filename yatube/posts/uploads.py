@@ -0,0 +1,163 @@
+import hashlib
+import struct
+import warnings
+from functools import wraps
+from io import BytesIO
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import (SimpleUploadedFile,
+                                            TemporaryUploadedFile)
+from django.core.files.uploadhandler import (FileUploadHandler,
+                                             StopFutureHandlers)
+from django.utils.module_loading import import_string
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from PIL import Image
+
+# ошибки Pillow при разборе неполного или чужого заголовка
+HEADER_ERRORS = (OSError, SyntaxError, ValueError, EOFError, IndexError,
+                 struct.error)
+
+
+def check_image(size, image_format, dimensions):
+    ''' Проверяет картинку по байтам, формату и числу пикселей '''
+    if size > settings.IMAGE_UPLOAD_MAX_BYTES:
+        raise too_large()
+    if image_format not in settings.IMAGE_FORMATS:
+        raise ValidationError(
+            'Поддерживаются только %(formats)s.',
+            code='invalid_format',
+            params={'formats': ', '.join(settings.IMAGE_FORMATS)})
+    width, height = dimensions
+    if not (width and height) or width * height > settings.IMAGE_MAX_PIXELS:
+        raise too_many_pixels()
+
+
+def too_large():
+    return ValidationError(
+        'Файл больше %(limit)d МБ.',
+        code='too_large',
+        params={'limit': settings.IMAGE_UPLOAD_MAX_BYTES // 2 ** 20})
+
+
+def too_many_pixels():
+    return ValidationError(
+        'Картинка больше %(limit)d мегапикселей.',
+        code='too_many_pixels',
+        params={'limit': settings.IMAGE_MAX_PIXELS // 10 ** 6})
+
+
+def read_header(header):
+    ''' Формат и размеры по первым байтам файла или None, если их мало
+
+    Pillow разбирает только заголовок, пиксели не распаковываются, поэтому
+    бомба в несколько гигапикселей отсеивается по первым килобайтам.
+    '''
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+            with Image.open(BytesIO(header)) as image:
+                return image.format, image.size
+    except Image.DecompressionBombError:
+        # размеры превышают и предел самого Pillow
+        raise too_many_pixels()
+    except HEADER_ERRORS:
+        return None
+
+
+class RejectedUpload(SimpleUploadedFile):
+    ''' Пустая замена отклонённой загрузки с причиной в upload_error '''
+
+    def __init__(self, name, size, error):
+        super().__init__(name, b'')
+        self.size = size
+        self.upload_error = error
+
+
+class BoundedImageUploadHandler(FileUploadHandler):
+    ''' Пишет загрузку сразу на диск, проверяя её по ходу чтения
+
+    Превышение IMAGE_UPLOAD_MAX_BYTES, чужой формат или слишком большие
+    размеры из заголовка останавливают запись: остаток запроса читается
+    вхолостую, а форма получает RejectedUpload с причиной. Принятая
+    загрузка несёт формат, размеры и SHA-256 для хранилища.
+    '''
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.file = TemporaryUploadedFile(
+            self.file_name, self.content_type, 0, self.charset,
+            self.content_type_extra)
+        self.header = b''
+        self.info = None
+        self.error = None
+        self.digest = hashlib.sha256()
+        # файл целиком принимает этот обработчик
+        raise StopFutureHandlers
+
+    def reject(self, error):
+        self.error = error
+        self.file.close()
+
+    def inspect(self, complete=False):
+        try:
+            self.info = read_header(self.header)
+        except ValidationError as error:
+            self.reject(error)
+            return
+        if self.info is None and (
+                complete or len(self.header) >= settings.IMAGE_HEADER_BYTES):
+            self.reject(ValidationError(
+                'Загрузите картинку: файл не распознан.',
+                code='invalid_image'))
+        elif self.info is not None:
+            self.header = b''
+            try:
+                check_image(0, *self.info)
+            except ValidationError as error:
+                self.reject(error)
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.error is not None:
+            return None
+        if start + len(raw_data) > settings.IMAGE_UPLOAD_MAX_BYTES:
+            self.reject(too_large())
+            return None
+        if self.info is None:
+            self.header += raw_data[
+                :settings.IMAGE_HEADER_BYTES - len(self.header)]
+            self.inspect()
+            if self.error is not None:
+                return None
+        self.digest.update(raw_data)
+        self.file.write(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        if self.error is None and self.info is None:
+            self.inspect(complete=True)
+        if self.error is not None:
+            return RejectedUpload(self.file_name, file_size, self.error)
+        self.file.seek(0)
+        self.file.size = file_size
+        self.file.image_format, self.file.image_size = self.info
+        self.file.content_digest = self.digest.hexdigest()
+        return self.file
+
+
+def image_uploads(view):
+    ''' Файлы запроса к view принимают обработчики IMAGE_UPLOAD_HANDLERS
+
+    Остальной сайт работает с FILE_UPLOAD_HANDLERS. Обработчики нужно
+    поставить до первого чтения POST, а его читает проверка CSRF,
+    поэтому она выполняется внутри, как советует документация Django.
+    '''
+    protected = csrf_protect(view)
+
+    @csrf_exempt
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        for path in reversed(settings.IMAGE_UPLOAD_HANDLERS):
+            request.upload_handlers.insert(0, import_string(path)(request))
+        return protected(request, *args, **kwargs)
+    return wrapper
@@ -1,10 +1,223 @@
-from django.core.paginator import Paginator
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
 from django.conf import settings
+from django.core.paginator import Page, Paginator
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import AutoField, Q
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+from .models import Comment
+
+COMMENT_FIELDS = (
+    'text', 'created', 'author',
+    'author__username', 'author__first_name', 'author__last_name',
+)
+FEED_FIELDS = (
+    'text', 'pub_date', 'image', 'author', 'group',
+    'author__username', 'author__first_name', 'author__last_name',
+    'group__title', 'group__slug',
+)
+
+
+def get_feed(post_list):
+    ''' Посты ленты вместе с автором и группой одним запросом '''
+    return post_list.select_related('author', 'group').only(*FEED_FIELDS)
+
+
+def bulk_batch_size(model, batch_size, using=DEFAULT_DB_ALIAS):
+    ''' Размер пачки bulk_create в пределах ограничений базы
+
+    Django 2.2 не урезает явно переданный batch_size, а SQLite не
+    принимает больше 500 строк в одном INSERT ... SELECT UNION ALL.
+    '''
+    fields = [field for field in model._meta.concrete_fields
+              if not isinstance(field, AutoField)]
+    return min(batch_size, connections[using].ops.bulk_batch_size(fields, []))
+
+
+def insert_select(model, fields, rows, using=DEFAULT_DB_ALIAS):
+    ''' INSERT ... SELECT строк запроса rows в поля fields модели model
+
+    Строки не проходят через Python, конфликты уникальности
+    пропускаются; возвращает число вставленных строк.
+    '''
+    connection = connections[using]
+    sql, params = rows.query.sql_with_params()
+    columns = ', '.join(
+        connection.ops.quote_name(model._meta.get_field(name).column)
+        for name in fields)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'{connection.ops.insert_statement(ignore_conflicts=True)} '
+            f'{model._meta.db_table} ({columns}) {sql} '
+            f'{connection.ops.ignore_conflicts_suffix_sql(True)}',
+            params)
+        return cursor.rowcount
+
+
+class CursorPaginator(Paginator):
+    ''' Пагинация по ключу (дата, id) без COUNT и OFFSET '''
+
+    def __init__(self, object_list, per_page, field='pub_date',
+                 with_count=False):
+        super().__init__(object_list, per_page)
+        self.field = field
+        self.with_count = with_count
+        self._num_pages = 1
+
+    @cached_property
+    def count(self):
+        ''' Общее число объектов считается только по запросу '''
+        if not self.with_count:
+            return None
+        return self.object_list.count()
+
+    @property
+    def num_pages(self):
+        return self._num_pages
+
+    def dump_value(self, value):
+        return value.isoformat()
+
+    def load_value(self, value):
+        return parse_datetime(value)
+
+    def encode_cursor(self, obj):
+        value = f'{self.dump_value(getattr(obj, self.field))}|{obj.pk}'
+        return urlsafe_b64encode(value.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            cursor += '=' * (-len(cursor) % 4)
+            value, pk = urlsafe_b64decode(cursor).decode().rsplit('|', 1)
+            return self.load_value(value), int(pk)
+        except ValueError:
+            return None
+
+    def keyset(self, queryset, cursor_key, backward, key='pk'):
+        ''' Срез per_page + 1 строк за курсором в порядке выборки '''
+        field = self.field
+        if backward:
+            lookup, order = 'gt', (field, key)
+        else:
+            lookup, order = 'lt', (f'-{field}', f'-{key}')
+        if cursor_key:
+            value, pk = cursor_key
+            queryset = queryset.filter(
+                Q(**{f'{field}__{lookup}': value})
+                | Q(**{field: value, f'{key}__{lookup}': pk})
+            )
+        return list(queryset.order_by(*order)[:self.per_page + 1])
+
+    def get_rows(self, cursor_key, backward):
+        return self.keyset(self.object_list, cursor_key, backward)
+
+    def get_page(self, after=None, before=None, lazy=False):
+        ''' Страница после курсора after или перед курсором before
+
+        Ленивая страница (lazy) выбирает строки при первом обращении.
+        '''
+        backward = False
+        cursor_key = before and self.decode_cursor(before)
+        if cursor_key and cursor_key[0] is not None:
+            backward = True
+        else:
+            cursor_key = after and self.decode_cursor(after)
+            if not (cursor_key and cursor_key[0] is not None):
+                cursor_key = None
+        page = CursorPage(self, cursor_key, backward)
+        return page if lazy else page.evaluate()
+
+
+class CursorPage(Page):
+    ''' Страница CursorPaginator, которая выбирает строки при первом
+    обращении к ним, номеру или курсорам '''
+
+    def __init__(self, paginator, cursor_key, backward):
+        self.paginator = paginator
+        self.cursor_key = cursor_key
+        self.backward = backward
+
+    @cached_property
+    def state(self):
+        paginator = self.paginator
+        rows = paginator.get_rows(self.cursor_key, self.backward)
+        has_more = len(rows) > paginator.per_page
+        rows = rows[:paginator.per_page]
+        if self.backward:
+            rows.reverse()
+            has_previous, has_next = has_more, True
+        else:
+            has_previous, has_next = self.cursor_key is not None, has_more
+        number = 2 if has_previous else 1
+        paginator._num_pages = number + 1 if has_next else number
+        return rows, number, has_previous, has_next
+
+    @property
+    def object_list(self):
+        return self.state[0]
+
+    @property
+    def number(self):
+        return self.state[1]
+
+    def has_next(self):
+        return self.state[3]
+
+    def has_previous(self):
+        return self.state[2]
+
+    @property
+    def next_cursor(self):
+        rows = self.object_list
+        if not (self.has_next() and rows):
+            return None
+        return self.paginator.encode_cursor(rows[-1])
+
+    @property
+    def previous_cursor(self):
+        rows = self.object_list
+        if not (self.has_previous() and rows):
+            return None
+        return self.paginator.encode_cursor(rows[0])
+
+    def evaluate(self):
+        ''' Обычная Page с уже выбранными строками и курсорами '''
+        page = Page(self.object_list, self.number, self.paginator)
+        page.next_cursor = self.next_cursor
+        page.previous_cursor = self.previous_cursor
+        return page
+
+
+def get_page(post_list, request, with_count=False, lazy=False):
+    ''' Создание пагинации страницы
+
+    Ленту в кеше фрагмента шаблона показывают с lazy=True: при попадании
+    в кеш посты из базы не читаются.
+    '''
+    paginator = CursorPaginator(
+        post_list, settings.QUANTITY_POST, with_count=with_count)
+    return paginator.get_page(
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+        lazy=lazy,
+    )
+
+
+def get_comments_paginator(post_id, per_page):
+    comments = Comment.objects.filter(
+        post_id=post_id, active=True
+    ).select_related('author').only(*COMMENT_FIELDS)
+    return CursorPaginator(comments, per_page, field='created')
 
 
-def get_page(post_list, request):
-    ''' Создание пагинации страницы '''
-    paginator = Paginator(post_list, settings.QUANTITY_POST)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-    return page_obj
+def get_comments_page(post_id, request):
+    ''' Страница комментариев поста: новые сначала, не больше лимита '''
+    try:
+        limit = int(request.GET.get('limit', settings.COMMENTS_PER_PAGE))
+    except ValueError:
+        limit = settings.COMMENTS_PER_PAGE
+    limit = max(1, min(limit, settings.COMMENTS_PAGE_LIMIT))
+    paginator = get_comments_paginator(post_id, limit)
+    return paginator.get_page(after=request.GET.get('after'))
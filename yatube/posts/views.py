@@ -1,65 +1,134 @@
 from django.shortcuts import render, get_object_or_404
 from django.shortcuts import redirect
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth import get_user_model
 from django.contrib.auth.decorators import login_required
-from django.core.paginator import Paginator
 from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.http import (FileResponse, Http404, HttpResponseBadRequest,
+                         JsonResponse, StreamingHttpResponse)
 
 from .models import Group, Post, User, Follow
+from .cache import conditional_page, feed_cache_key
+from .counters import get_counter
+from .export import EXPORTS
+from .export import FORMATS as EXPORT_FORMATS
+from .export import export_lines
 from .forms import CommentForm, PostForm
-from .utils import get_page
+from .notifications import mark_read
+from .renditions import FORMATS, pending_renditions, rendition_name
+from .renditions import render as render_rendition
+from .search import get_search_page
+from .storage import image_storage
+from .timeline import get_timeline_page
+from .uploads import image_uploads
+from .utils import get_comments_page, get_feed, get_page
 
 User = get_user_model()
 
 
+def lookup(queryset, field):
+    ''' Одно поле одного объекта: единственный запрос проверки свежести '''
+    return queryset.order_by().values_list(field, flat=True).first()
+
+
+def group_scopes(slug):
+    pk = lookup(Group.objects.filter(slug=slug), 'pk')
+    return None if pk is None else [f'group:{pk}']
+
+
+def profile_scopes(username):
+    pk = lookup(User.objects.filter(username=username), 'pk')
+    return None if pk is None else [f'profile:{pk}']
+
+
+def post_scopes(post_id):
+    author_id = lookup(Post.objects.filter(pk=post_id), 'author_id')
+    if author_id is None:
+        return None
+    return [f'post:{post_id}', f'profile:{author_id}']
+
+
+@conditional_page(lambda: ['index'])
 def index(request):
     """Вывод постов на главную"""
-    post_list = Post.objects.select_related('group')
+    post_list = get_feed(Post.objects.all())
 
-    page_obj = get_page(post_list, request)
+    page_obj = get_page(post_list, request, lazy=True)
     context = {
-        'page_obj': page_obj
+        'page_obj': page_obj,
+        'pending_images': pending_renditions(page_obj),
+        'cache_key': feed_cache_key(request, 'index'),
+        'cache_timeout': settings.FEED_CACHE_TIMEOUT,
     }
     return render(request, 'posts/index.html',
                   context)
 
 
+@conditional_page(group_scopes)
 def group_posts(request, slug):
     """Получение постов по группам"""
     group = get_object_or_404(Group, slug=slug)
-    post_list = group.posts.all()
-    page_obj = get_page(post_list, request)
+    post_list = get_feed(group.posts.all())
+    page_obj = get_page(post_list, request, lazy=True)
     context = {
         'group': group,
         'page_obj': page_obj,
+        'pending_images': pending_renditions(page_obj),
+        'cache_key': feed_cache_key(request, f'group:{group.pk}'),
+        'cache_timeout': settings.FEED_CACHE_TIMEOUT,
     }
     return render(request, 'posts/group_list.html',
                   context)
 
 
+@conditional_page(profile_scopes)
 def profile(request, username):
     """ Получение постов по авторам """
 
-    author = get_object_or_404(User, username=username)
-    post_list = author.posts.all()
-    page_obj = get_page(post_list, request)
+    author = get_object_or_404(
+        User.objects.select_related('counter'), username=username)
+    post_list = get_feed(author.posts.all())
+    page_obj = get_page(post_list, request, lazy=True)
 
     context = {
         'author': author,
+        'counter': get_counter(author),
         'posts': post_list,
         'page_obj': page_obj,
+        'pending_images': pending_renditions(page_obj),
+        'cache_key': feed_cache_key(request, f'profile:{author.pk}'),
+        'cache_timeout': settings.FEED_CACHE_TIMEOUT,
     }
     return render(request, 'posts/profile.html',
                   context)
 
 
+def search(request):
+    """Полнотекстовый поиск по постам"""
+    query = request.GET.get('q', '').strip()
+    page_obj = get_search_page(query, request)
+    context = {
+        'query': query,
+        'page_obj': page_obj,
+        'pending_images': pending_renditions(page_obj),
+    }
+    return render(request, 'posts/search.html', context)
+
+
+@conditional_page(post_scopes)
 def post_detail(request, post_id):
-    post = get_object_or_404(Post, id=post_id)
-    comments = post.comments.filter(active=True)
+    post = get_object_or_404(
+        Post.objects.select_related('author__counter', 'group'),
+        id=post_id)
+    comments = get_comments_page(post.pk, request)
     form = CommentForm()
     template = 'posts/post_detail.html'
     context = {
         'post': post,
+        'pending_images': pending_renditions([post]),
+        'author_counter': get_counter(post.author),
         'requser': request.user,
         'comments': comments,
         'form': form,
@@ -67,7 +136,31 @@ def post_detail(request, post_id):
     return render(request, template, context)
 
 
+@conditional_page(post_scopes)
+def comments(request, post_id):
+    """Следующая страница комментариев: фрагмент HTML или JSON"""
+    page_obj = get_comments_page(post_id, request)
+    if not page_obj and not Post.objects.filter(pk=post_id).exists():
+        raise Http404
+    if request.GET.get('format') != 'json':
+        return render(request, 'posts/includes/comments.html', {
+            'comments': page_obj,
+            'post_id': post_id,
+        })
+    return JsonResponse({
+        'comments': [{
+            'id': comment.pk,
+            'author': comment.author.username,
+            'author_name': comment.author.get_full_name(),
+            'text': comment.text,
+            'created': comment.created.isoformat(),
+        } for comment in page_obj],
+        'next_cursor': page_obj.next_cursor,
+    })
+
+
 @login_required
+@image_uploads
 def post_create(request):
     '''Создание поста'''
     if request.method == "POST":
@@ -84,6 +177,7 @@ def post_create(request):
 
 
 @login_required
+@image_uploads
 def post_edit(request, post_id):
     '''Редактирование поста'''
     post = get_object_or_404(Post, pk=post_id)
@@ -113,14 +207,25 @@ def add_comment(request, post_id):
     return redirect('posts:post_detail', post_id=post_id)
 
 
+@login_required
+def notifications(request):
+    ''' Сводки подписок; POST отмечает их прочитанными '''
+    if request.method == 'POST':
+        mark_read(request.user)
+        return redirect('posts:notifications')
+    notification_list = request.user.notifications.select_related(
+        'author', 'post')[:settings.NOTIFICATIONS_PER_PAGE]
+    return render(request, 'posts/notifications.html',
+                  {'notifications': notification_list})
+
+
 @login_required
 def follow_index(request):
-    posts = Post.objects.filter(
-        author__following__user=request.user)
-    paginator = Paginator(posts, settings.QUANTITY_POST)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-    context = {'page_obj': page_obj}
+    page_obj = get_timeline_page(request.user, request)
+    context = {
+        'page_obj': page_obj,
+        'pending_images': pending_renditions(page_obj),
+    }
     return render(request, 'posts/follow.html', context)
 
 
@@ -141,3 +246,42 @@ def profile_unfollow(request, username):
     )
     follow.delete()
     return redirect('posts:profile', username)
+
+
+def rendition(request, source, width, extension):
+    '''Версия картинки поста, которой ещё нет на диске
+
+    Готовые файлы отдаёт веб-сервер, сюда приходят только промахи:
+    набор версий готовится один раз, и нужная отдаётся.
+    '''
+    if (width not in settings.POST_RENDITION_WIDTHS
+            or extension not in settings.POST_RENDITION_FORMATS
+            or not source.startswith(Post.image.field.upload_to)):
+        raise Http404
+    try:
+        exists = image_storage.exists(source)
+    except SuspiciousFileOperation:
+        raise Http404
+    if not exists or not render_rendition(source):
+        raise Http404
+    return FileResponse(
+        default_storage.open(rendition_name(source, width, extension)),
+        content_type=FORMATS[extension][1])
+
+
+@staff_member_required
+def export(request, name, export_format):
+    """Потоковая выгрузка таблицы; ?after= продолжает её с id"""
+    if name not in EXPORTS or export_format not in EXPORT_FORMATS:
+        raise Http404
+    after = request.GET.get('after')
+    try:
+        after = None if after is None else int(after)
+    except ValueError:
+        return HttpResponseBadRequest('after должен быть целым числом')
+    response = StreamingHttpResponse(
+        export_lines(name, export_format, after, header=after is None),
+        content_type=EXPORT_FORMATS[export_format])
+    response['Content-Disposition'] = (
+        f'attachment; filename="{name}.{export_format}"')
+    return response
@@ -1,5 +1,7 @@
 from django.contrib.auth import get_user_model
-from django.contrib.auth.forms import UserCreationForm
+from django.contrib.auth.forms import PasswordResetForm, UserCreationForm
+
+from .tasks import send_password_reset
 
 User = get_user_model()
 
@@ -13,3 +15,18 @@ class CreationForm(UserCreationForm):
             'last_name',
             'username',
             'email')
+
+
+class QueuedPasswordResetForm(PasswordResetForm):
+    """Письмо сброса пароля отправляет воркер очереди, так что запрос не
+    ждёт почтовый сервер. В очередь уходит id пользователя, а не токен."""
+
+    def send_mail(self, subject_template_name, email_template_name,
+                  context, from_email, to_email,
+                  html_email_template_name=None):
+        user = context['user']
+        context = {key: value for key, value in context.items()
+                   if key not in ('user', 'uid', 'token')}
+        send_password_reset.delay(
+            user.pk, context, subject_template_name, email_template_name,
+            from_email, to_email, html_email_template_name)
@@ -0,0 +1,46 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.tokens import default_token_generator
+from django.core.mail import EmailMultiAlternatives
+from django.template import loader
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+
+from core.queue import task
+
+User = get_user_model()
+
+
+@task
+def send_email(subject, body, from_email, to, html=None):
+    ''' Отправка письма через EMAIL_BACKEND вне запроса '''
+    message = EmailMultiAlternatives(subject, body, from_email, to)
+    if html is not None:
+        message.attach_alternative(html, 'text/html')
+    message.send()
+
+
+@task
+def send_password_reset(user_id, context, subject_template_name,
+                        email_template_name, from_email, to_email,
+                        html_email_template_name=None):
+    ''' Письмо сброса пароля; ссылка с токеном собирается здесь
+
+    Аргументы задачи лежат в базе и остаются в упавших строках, поэтому
+    токена в них нет.
+    '''
+    user = User.objects.filter(pk=user_id).first()
+    if user is None:
+        return
+    context = {
+        **context,
+        'user': user,
+        'uid': urlsafe_base64_encode(force_bytes(user.pk)),
+        'token': default_token_generator.make_token(user),
+    }
+    subject = loader.render_to_string(subject_template_name, context)
+    subject = ''.join(subject.splitlines())
+    body = loader.render_to_string(email_template_name, context)
+    html = None
+    if html_email_template_name is not None:
+        html = loader.render_to_string(html_email_template_name, context)
+    send_email(subject, body, from_email, [to_email], html)
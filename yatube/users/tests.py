@@ -0,0 +1,38 @@
+import re
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.management import call_command
+from django.test import TransactionTestCase
+from django.urls import reverse
+
+from core.models import Task
+
+User = get_user_model()
+
+
+class PasswordResetTest(TransactionTestCase):
+    def test_reset_mail_sent_by_worker(self):
+        """Письмо сброса пароля уходит из очереди, а не из запроса"""
+        User.objects.create_user(
+            username='user', email='user@example.com', password='secret')
+        response = self.client.post(
+            reverse('users:password_reset'), {'email': 'user@example.com'})
+        self.assertRedirects(response, reverse('users:password_reset_done'))
+        self.assertEqual(mail.outbox, [])
+        task = Task.objects.get()
+        self.assertEqual(task.name, 'users.tasks.send_password_reset')
+
+        call_command('run_tasks', workers=0, once=True, stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['user@example.com'])
+        self.assertFalse(Task.objects.exists())
+        path, uid, token = re.search(
+            r'testserver(\S+/reset/([^/]+)/([^/]+)/)',
+            mail.outbox[0].body).groups()
+        self.assertNotIn(token, task.arguments)
+        response = self.client.get(path)
+        self.assertRedirects(
+            response, reverse('users:password_reset_confirm',
+                              args=[uid, 'set-password']))
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 
 import os
+import tempfile
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -48,6 +49,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.RequestMetricsMiddleware',
+    'core.middleware.PrimaryPinMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -85,8 +88,47 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'CONN_MAX_AGE': 60,
+        # тестовая база в файле, а не в памяти: потоки воркера очереди
+        # ждут блокировку по busy_timeout, как в работе; файл вне
+        # исходников, рядом с ним SQLite держит -wal и -shm
+        'TEST': {'NAME': os.path.join(
+            tempfile.gettempdir(), 'yatube_test.sqlite3')},
     }
 }
+# настраиваются при открытии каждого соединения SQLite: WAL пускает
+# читателей параллельно с писателем, а busy_timeout ждёт блокировку
+# вместо ошибки database is locked
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000,
+}
+# постоянные соединения проверяются не чаще раза в столько секунд
+CONN_HEALTH_CHECK_INTERVAL = 30
+
+# реплики только для чтения, например YATUBE_REPLICAS=replica; локально
+# их наполняет из default команда replicate
+READ_REPLICAS = [
+    alias for alias in os.environ.get('YATUBE_REPLICAS', '').split(',')
+    if alias
+]
+for alias in READ_REPLICAS:
+    DATABASES[alias] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, f'{alias}.sqlite3'),
+        'CONN_MAX_AGE': 60,
+        'TEST': {'MIRROR': 'default'},
+    }
+DATABASE_ROUTERS = ['core.routers.ReplicaRouter']
+# после записи пользователь столько секунд читает из default, чтобы видеть
+# свои изменения; кеш лент и ETag от окна не зависят: страницы с версиями
+# читают только реплики, которые команда replicate уже довела до них
+REPLICA_PIN_SECONDS = 5
+REPLICA_PIN_COOKIE = 'pin_primary'
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
@@ -128,6 +170,46 @@ USE_TZ = True
 STATIC_URL = '/static/'
 STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static')]
 QUANTITY_POST = 10
+# комментарии поста подгружаются страницами, limit из запроса ограничен
+COMMENTS_PER_PAGE = 20
+COMMENTS_PAGE_LIMIT = 100
+# JSON API: предел limit страницы ленты и ids в одном пакетном запросе
+API_PAGE_LIMIT = 100
+API_BATCH_LIMIT = 100
+# выгрузка таблиц читает строки из базы пачками этого размера
+EXPORT_CHUNK_SIZE = 2000
+# посты авторов с большим числом подписчиков не раскладываются по лентам,
+# а подмешиваются при чтении ленты подписок
+TIMELINE_FANOUT_LIMIT = 5000
+TIMELINE_BATCH_SIZE = 1000
+# уведомления подписчиков: события автора копятся
+# NOTIFICATION_DIGEST_WINDOW секунд и рассылаются одной сводкой
+# фоновой задачей пачками по NOTIFICATION_BATCH_SIZE подписчиков
+NOTIFICATION_DIGEST_WINDOW = 60
+NOTIFICATION_BATCH_SIZE = 5000
+NOTIFICATION_UNREAD_TIMEOUT = 60 * 60
+NOTIFICATIONS_PER_PAGE = 50
+# набор версий картинки поста: каждая ширина в каждом формате, кадр
+# с пропорциями 960x339; последний формат идёт в <img> для всех браузеров
+POST_RENDITION_WIDTHS = (320, 640, 960, 1280)
+POST_RENDITION_FORMATS = ('webp', 'jpeg')
+POST_RENDITION_RATIO = 960 / 339
+POST_RENDITION_DEFAULT_WIDTH = 960
+POST_RENDITION_QUALITY = 80
+POST_RENDITION_SIZES = (
+    '(max-width: 576px) 100vw, (max-width: 992px) 700px, 960px')
+# пока версии готовятся, страницы показывают оригинал; отметка истекает
+# сама, если генерация не удалась
+RENDITION_PENDING_TIMEOUT = 600
+# загрузки картинок постов пишутся на диск и проверяются по ходу приёма:
+# не больше байт и пикселей, формат и размеры читаются из первых
+# IMAGE_HEADER_BYTES без распаковки; остальные загрузки сайта принимают
+# обычные FILE_UPLOAD_HANDLERS
+IMAGE_UPLOAD_HANDLERS = ['posts.uploads.BoundedImageUploadHandler']
+IMAGE_UPLOAD_MAX_BYTES = 5 * 1024 * 1024
+IMAGE_MAX_PIXELS = 25_000_000
+IMAGE_HEADER_BYTES = 256 * 1024
+IMAGE_FORMATS = ('JPEG', 'PNG', 'GIF', 'WEBP')
 NUMBER_LETTERS = 15
 LOGIN_URL = 'users:login'
 LOGIN_REDIRECT_URL = 'posts:index'
@@ -136,8 +218,64 @@ EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
 # указываем директорию, в которую будут складываться файлы писем
 EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 
+# фоновые задачи (письма, версии картинок) выполняет manage.py run_tasks;
+# TASKS_EAGER=1 выполняет их в процессе сайта сразу после транзакции
+TASKS_EAGER = os.environ.get('YATUBE_TASKS_EAGER') == '1'
+TASK_WORKERS = 4
+# повторы упавшей задачи с паузой TASK_RETRY_DELAY, удваивающейся до
+# TASK_RETRY_MAX_DELAY секунд
+TASK_RETRIES = 3
+TASK_RETRY_DELAY = 10
+TASK_RETRY_MAX_DELAY = 600
+# задача воркера, не закончившего её за столько секунд, ставится заново
+TASK_LOCK_TIMEOUT = 15 * 60
+TASK_POLL_INTERVAL = 1
+
+# фрагменты лент инвалидируются сигналами, поэтому хранятся долго
+FEED_CACHE_TIMEOUT = 60 * 60 * 24
+
+# доля запросов, для которых снимаются метрики SQL, шаблонов и кеша
+REQUEST_METRICS_SAMPLE_RATE = 0.01
+REQUEST_METRICS_SLOWEST = 3
+
+# пересчёт закешированных фрагментов одним процессом: остальные отдают
+# прежнее значение ещё STAMPEDE_STALE_TIMEOUT секунд после срока или
+# ждут результат до STAMPEDE_LOCK_TIMEOUT; BETA > 1 обновляет раньше срока
+STAMPEDE_BETA = 1.0
+STAMPEDE_STALE_TIMEOUT = 60
+STAMPEDE_LOCK_TIMEOUT = 10
+STAMPEDE_POLL_INTERVAL = 0.02
+
+# общий уровень кеша для всех процессов: файловый в YATUBE_CACHE_DIR,
+# без него - LocMemCache как замена на время разработки и тестов
+CACHE_DIR = os.environ.get('YATUBE_CACHE_DIR')
+if CACHE_DIR:
+    SHARED_CACHE = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': CACHE_DIR,
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    }
+else:
+    SHARED_CACHE = {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'shared',
+    }
+
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'core.cache.TieredCache',
+        'LOCATION': 'default',
+        'OPTIONS': {
+            'SHARED': SHARED_CACHE,
+            # LRU процесса: не больше записей, байт и секунд на значение
+            'LOCAL_MAX_ENTRIES': 2000,
+            'LOCAL_MAX_BYTES': 32 * 1024 * 1024,
+            'LOCAL_TIMEOUT': 5,
+            # версии областей, блокировки пересчёта, отметки готовящихся
+            # версий картинок, числа непрочитанных уведомлений и отметки
+            # синхронизации реплик - только общий уровень
+            'SHARED_ONLY': (r'^feed_version:|:lock$|^rendition_pending:'
+                            r'|^notifications_unread:|^replica_synced:'),
+        },
     }
 }
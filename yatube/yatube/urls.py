@@ -3,12 +3,19 @@ from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import include, path
 
+from posts.views import rendition
+
 urlpatterns = [
     path('auth/', include('users.urls', namespace='users')),
     path('auth/', include('django.contrib.auth.urls')),
     path('admin/', admin.site.urls),
+    path('api/v1/', include('posts.api_urls', namespace='api')),
     path('', include('posts.urls', namespace='index')),
     path('about/', include('about.urls', namespace='about')),
+    # промахи по версиям картинок, готовые файлы отдаёт веб-сервер
+    path(settings.MEDIA_URL.lstrip('/')
+         + 'renditions/<path:source>/<int:width>.<slug:extension>',
+         rendition, name='rendition'),
 ]
 
 